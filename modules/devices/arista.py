@@ -3,13 +3,31 @@
 Netconfigit Arista device class
 """
 
+import json
 import logging
 import os
 import re
-import time
+import socket
+import httplib
+from modules import expect
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# device prompt, ie. "switch>" or "switch#"
+PROMPT = re.compile(r"(^|[\r\n])[\w\-\.\(\)/:@]+[>#]\s*$")
+PASSWORD = re.compile(r"[Pp]assword:\s*$")
+DENIED = re.compile("% ?(Access denied|Bad secrets)")
+# the copy command either reports completion or only shows the transfer progress meter
+SUCCESS = re.compile('Copy completed successfully|'
+                     '[1-9][0-9]*\s.[1-9][0-9]*\s*.[0]\s*.[0]\s*.[1-9][0-9]*\s.[1-9][0-9]*')
+FAILURE = re.compile("Error")
+# header lines of the configs, which are updated whenever the config is changed or saved
+CHANGED = re.compile("! (Last configuration change|Startup-config last modified) at")
+# error shown instead of the output of a command
+INVALID = re.compile(r"(^|[\r\n])% ?(Invalid|Incomplete|Ambiguous)")
+# path of the eAPI JSON-RPC endpoint
+EAPI_PATH = "/command-api"
+
 
 class Arista(object):
     """Arista device class
@@ -27,11 +45,16 @@ class Arista(object):
         """
         self.device = _device
         self.netconfigit = _netconfigit
+        self.session = None
 
         self.command_copy_startup = "copy startup-config tftp://" + self.netconfigit.transfer_ip + \
                                     "/" + self.device.name + "/startup-config\n"
         self.command_copy_running = "copy running-config tftp://" + self.netconfigit.transfer_ip + \
                                     "/" + self.device.name + "/running-config\n"
+        self.command_show_startup = "show startup-config\n"
+        self.command_show_running = "show running-config\n"
+        self.probe_commands = {"running-config": "show running-config | include Last configuration change\n",
+                               "startup-config": "show startup-config | include Startup-config last modified\n"}
 
     def run_action(self, action):
         """Defines and runs actions for the device associated with the class
@@ -43,68 +66,153 @@ class Arista(object):
         status = 0
         connected = 0
 
-        if self.device.access_type == "ssh":
+        if self.device.access_type in ("ssh", "telnet"):
             try:
-                self.client, self.channel = self.netconfigit.get_ssh_client_channel(self.device)
-                connected = 1
+                self.session = self.netconfigit.get_session(self.device, self.login_dialogs)
+                if self.session is not None:
+                    connected = 1
             except:
                 logger.error("Error connecting to " + self.device.name)
 
             if connected == 1:
-                if action == "running-config":
-                    status = self.get_config("running-config")
-                elif action == "startup-config":
-                    status = self.get_config("startup-config")
-                else:
-                    logger.error("Action " + action + " not implemented for " +
-                                 self.device.manufacturer.title() + " devices.")
-                self.client.close()
+                # a config which hasn't changed since it was last archived isn't transferred again
+                if self.netconfigit.check_unchanged(self.device, action, self) == 1:
+                    return
+                dialog = self.action_dialog(action)
+                if dialog is not None:
+                    status = self.session.run(dialog)
+        elif self.device.access_type == "eapi":
+            if action in ("running-config", "startup-config"):
+                status = self.get_config_eapi(action)
+            else:
+                logger.error("Action " + action + " not implemented for " +
+                             self.device.manufacturer.title() + " devices.")
         else:
             logger.error("Access method " + self.device.access_type + " not implemented for " +
                          self.device.manufacturer.title() + " devices.")
 
-        if status == 1:
-            self.netconfigit.success_list.append({self.device.name: action})
-        if status == 0:
-            self.netconfigit.failure_list.append({self.device.name: action})
+        self.netconfigit.record_result(self.device, action, status)
+
+    def action_dialog(self, action):
+        """Defines the dialog which runs an action on the device
+
+        Checks for valid action names
+        :param action: the action to run
+        :return: the dialog, or None if the action is not implemented
+        """
+        if action == "running-config":
+            return self.get_config("running-config")
+        elif action == "startup-config":
+            return self.get_config("startup-config")
+        logger.error("Action " + action + " not implemented for " +
+                     self.device.manufacturer.title() + " devices.")
+        return None
+
+    def change_probe(self, action):
+        """Defines the dialog which probes for changes to the config archived by an action
+
+        Shows the header line of the config updated when it is changed or saved
+        :param action: the action
+        :return: the dialog, or None if the action has no probe
+        """
+        if action in self.probe_commands:
+            return expect.OutputDialog(self.probe_commands[action], PROMPT, success=CHANGED)
+        return None
+
+    def login_dialogs(self):
+        """Defines the dialogs run once after connecting to the device
+
+        Waits for the first prompt, enters enable mode and disables paging for in-band capture
+        :return: list of dialogs
+        """
+        dialogs = [self.netconfigit.login_dialog(self.device, PROMPT)]
+        if self.device.enable_password != "NULL":
+            dialogs.append(expect.Dialog("enable\n", PROMPT,
+                                         answers=[(PASSWORD, self.device.enable_password + "\n")], failure=DENIED))
+        if self.device.capture == "inband":
+            dialogs.append(expect.Dialog("terminal length 0\n", PROMPT, failure=INVALID))
+        return dialogs
 
     def get_config(self, config_type):
-        """Transfers configurations from device via ssh and tftp
+        """Defines the transfer of configurations from device via ssh and tftp
 
         Issues commands to device via ssh to transfer configs to local tftp server
         :param config_type: the configuration type (ie. startup-config, running-config)
-        :return: boolean, 0 means transfer failed, 1 means transfer was successful
+        :return: the dialog which transfers the config
         """
-        output = ""
-        success = 0
-        transfer_pattern = re.compile('[1-9][0-9]*\s.[1-9][0-9]*\s*.[0]\s*.[0]\s*.[1-9][0-9]*\s.[1-9][0-9]*')
+        if self.device.capture == "inband":
+            return self.get_config_inband(config_type)
+        if config_type == "startup-config":
+            command = self.command_copy_startup
+        else:
+            command = self.command_copy_running
+        return expect.Dialog(command, PROMPT, success=SUCCESS, failure=FAILURE, timeout=expect.TRANSFER_TIMEOUT)
 
-        time.sleep(5)
-        if self.device.enable_password != "NULL":
-            self.channel.send("enable\n")
-            while not self.channel.recv_ready():
-                time.sleep(5)
-            output += self.channel.recv(1024)
-            time.sleep(3)
-            self.channel.send(self.device.enable_password + "\n")
-            while not self.channel.recv_ready():
-                time.sleep(5)
-            output += self.channel.recv(1024)
+    def get_config_inband(self, config_type):
+        """Defines the capture of configurations from device over the ssh session
+
+        Shows the config on the device and streams the output straight into the repository
+        :param config_type: the configuration type (ie. startup-config, running-config)
+        :return: the dialog which captures the config
+        """
         if config_type == "startup-config":
-            self.channel.send(self.command_copy_startup)
-        elif config_type == "running-config":
-            self.channel.send(self.command_copy_running)
-        while not self.channel.recv_ready():
-            time.sleep(5)
-        output += self.channel.recv(1024)
-        if self.netconfigit.verbose == 1:
-            print output
-
-        if "Copy completed successfully" in output:
-            success = 1
-        if transfer_pattern.search(output) is not None:
-            success = 1
-        if "Error" in output:
-            success = 0
-
-        return success
\ No newline at end of file
+            command = self.command_show_startup
+        else:
+            command = self.command_show_running
+        return expect.CaptureDialog(command, PROMPT, self.netconfigit.archive_path(self.device, config_type),
+                                    failure=INVALID)
+
+    def get_config_eapi(self, config_type):
+        """Fetches configurations from device via eAPI
+
+        Runs the show command through the JSON-RPC runCmds method and writes the output into the repository.
+        The device's eAPI connection is kept open for all of its actions.
+        :param config_type: the configuration type (ie. startup-config, running-config)
+        :return: 0/1 for fail/success
+        """
+        if self.device.enable_password != "NULL":
+            enable = {"cmd": "enable", "input": self.device.enable_password}
+        else:
+            enable = "enable"
+        request = {"jsonrpc": "2.0", "method": "runCmds", "id": self.device.name,
+                   "params": {"version": 1, "format": "text", "cmds": [enable, "show " + config_type]}}
+        try:
+            client = self.netconfigit.get_http_client(self.device)
+            response = client.request("POST", EAPI_PATH, json.dumps(request),
+                                      {"Content-Type": "application/json"})
+            body = response.read()
+        except (httplib.HTTPException, socket.error), e:
+            logger.error("Error connecting to " + self.device.name + ": " + str(e))
+            return 0
+        if response.status != 200:
+            logger.error("eAPI on " + self.device.name + " returned " + str(response.status) + " " +
+                         response.reason)
+            return 0
+        try:
+            reply = json.loads(body)
+        except ValueError:
+            logger.error("eAPI on " + self.device.name + " returned an invalid reply")
+            return 0
+        if "error" in reply:
+            error = reply["error"]
+            # JSON-RPC errors are objects, but a device may return a bare message instead
+            if isinstance(error, dict):
+                error = error.get("message")
+            logger.error("eAPI on " + self.device.name + " returned an error: " + str(error))
+            return 0
+        try:
+            config = reply["result"][-1]["output"]
+        except (KeyError, IndexError, TypeError):
+            logger.error("eAPI on " + self.device.name + " returned no output")
+            return 0
+
+        # the config only replaces the archived one once it is complete
+        path = self.netconfigit.archive_path(self.device, config_type)
+        try:
+            with open(path + ".part", "w") as part:
+                part.write(config.encode("utf-8"))
+            os.rename(path + ".part", path)
+        except (IOError, OSError), e:
+            logger.error("Could not write the " + config_type + " of " + self.device.name + ": " + str(e))
+            return 0
+        return 1
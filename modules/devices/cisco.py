@@ -5,10 +5,24 @@ Netconfigit Cisco device class
 
 import logging
 import os
-import time
+import re
+from modules import expect
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# device prompt, ie. "router>" or "router#"
+PROMPT = re.compile(r"(^|[\r\n])[\w\-\.\(\)/:@]+[>#]\s*$")
+# questions asked by the copy command, ie. "Destination filename [running-config]?"
+QUESTION = re.compile(r"(\?|\[confirm\])\s*$")
+PASSWORD = re.compile(r"[Pp]assword:\s*$")
+DENIED = re.compile("% ?(Access denied|Bad secrets)")
+SUCCESS = re.compile("bytes copied")
+FAILURE = re.compile("Error")
+# header lines of the config, which are updated whenever the config is changed or saved
+CHANGED = re.compile("! (Last configuration change|NVRAM config last updated) at")
+# error shown instead of the output of a command
+INVALID = re.compile(r"(^|[\r\n])% ?(Invalid|Incomplete|Ambiguous)")
+
 
 class Cisco(object):
     """Cisco device class
@@ -26,11 +40,18 @@ class Cisco(object):
         """
         self.device = _device
         self.netconfigit = _netconfigit
+        self.session = None
 
         self.command_copy_startup = "copy startup-config tftp://" + self.netconfigit.transfer_ip + \
                                     "/" + self.device.name + "/startup-config\n"
         self.command_copy_running = "copy running-config tftp://" + self.netconfigit.transfer_ip + \
                                     "/" + self.device.name + "/running-config\n"
+        self.command_show_startup = "show startup-config\n"
+        self.command_show_running = "show running-config\n"
+        # the running config fetched over NETCONF is archived alongside the one from the command line
+        self.netconf_actions = {"netconf-running-config": ("running", "running-config.xml")}
+        self.probe_commands = {"running-config": "show running-config | include Last configuration change\n",
+                               "startup-config": "show running-config | include NVRAM config last updated\n"}
 
     def run_action(self, action):
         """Defines and runs actions for the device associated with the class
@@ -42,80 +63,108 @@ class Cisco(object):
         status = 0
         connected = 0
 
-        if self.device.access_type == "ssh":
+        if self.device.access_type in ("ssh", "telnet"):
             try:
-                self.client, self.channel = self.netconfigit.get_ssh_client_channel(self.device)
-                connected = 1
+                self.session = self.netconfigit.get_session(self.device, self.login_dialogs)
+                if self.session is not None:
+                    connected = 1
             except:
                 logger.error("Error connecting to " + self.device.name)
                 status = 0
 
             if connected == 1:
-                if action == "running-config":
-                    status = self.get_config("running-config")
-                elif action == "startup-config":
-                    status = self.get_config("startup-config")
+                netconf = self.netconf_action(action)
+                if netconf is not None:
+                    source, _file = netconf
+                    status = self.netconfigit.netconf_get_config(self.device, source, _file)
+                # a config which hasn't changed since it was last archived isn't transferred again
+                elif self.netconfigit.check_unchanged(self.device, action, self) == 1:
+                    return
                 else:
-                    logger.error("Action " + action + " not implemented for " +
-                                 self.device.manufacturer.title() + " devices.")
-                    status = 0
-                self.client.close()
+                    dialog = self.action_dialog(action)
+                    if dialog is not None:
+                        status = self.session.run(dialog)
         else:
             logger.error("Access method " + self.device.access_type + " not implemented for " +
                          self.device.manufacturer.title() + " devices.\n")
             status = 0
 
-        if status == 1:
-            self.netconfigit.success_list.append({self.device.name: action})
-        if status == 0:
-            self.netconfigit.failure_list.append({self.device.name: action})
+        self.netconfigit.record_result(self.device, action, status)
+
+    def action_dialog(self, action):
+        """Defines the dialog which runs an action on the device
+
+        Checks for valid action names
+        :param action: the action to run
+        :return: the dialog, or None if the action is not implemented
+        """
+        if action == "running-config":
+            return self.get_config("running-config")
+        elif action == "startup-config":
+            return self.get_config("startup-config")
+        logger.error("Action " + action + " not implemented for " +
+                     self.device.manufacturer.title() + " devices.")
+        return None
+
+    def change_probe(self, action):
+        """Defines the dialog which probes for changes to the config archived by an action
+
+        Shows the header line of the running config updated when the config is changed or saved
+        :param action: the action
+        :return: the dialog, or None if the action has no probe
+        """
+        if action in self.probe_commands:
+            return expect.OutputDialog(self.probe_commands[action], PROMPT, success=CHANGED)
+        return None
+
+    def netconf_action(self, action):
+        """Defines the NETCONF datastore fetched by an action
+
+        :param action: the action
+        :return: (datastore, filename archived as) tuple, or None if the action doesn't use NETCONF
+        """
+        return self.netconf_actions.get(action)
+
+    def login_dialogs(self):
+        """Defines the dialogs run once after connecting to the device
+
+        Waits for the first prompt, enters enable mode and disables paging for in-band capture
+        :return: list of dialogs
+        """
+        dialogs = [self.netconfigit.login_dialog(self.device, PROMPT)]
+        if self.device.enable_password != "NULL":
+            dialogs.append(expect.Dialog("enable\n", PROMPT,
+                                         answers=[(PASSWORD, self.device.enable_password + "\n")], failure=DENIED))
+        if self.device.capture == "inband":
+            dialogs.append(expect.Dialog("terminal length 0\n", PROMPT, failure=INVALID))
+        return dialogs
 
     def get_config(self, config_type):
-        """Transfers configurations from device via ssh and tftp
+        """Defines the transfer of configurations from device via ssh and tftp
 
         Issues commands to device via ssh to transfer configs to local tftp server
         :param config_type: the configuration type (ie. startup-config, running-config)
-        :return: boolean, 0 means transfer failed, 1 means transfer was successful
+        :return: the dialog which transfers the config
         """
-        output = ""
-        success = 0
-
-        time.sleep(5)
-        if self.device.enable_password != "NULL":
-            self.channel.send("enable\n")
-            while not self.channel.recv_ready():
-                time.sleep(5)
-            output += self.channel.recv(1024)
-            self.channel.send(self.device.enable_password + "\n")
-            while not self.channel.recv_ready():
-                time.sleep(5)
-            output += self.channel.recv(1024)
+        if self.device.capture == "inband":
+            return self.get_config_inband(config_type)
         if config_type == "startup-config":
-            self.channel.send(self.command_copy_startup)
-        elif config_type == "running-config":
-            self.channel.send(self.command_copy_running)
-        while not self.channel.recv_ready():
-            time.sleep(5)
-        output += self.channel.recv(1024)
-        self.channel.send("\n")
-        while not self.channel.recv_ready():
-            time.sleep(1)
-        output += self.channel.recv(1024)
-        self.channel.send("\n")
-        while not self.channel.recv_ready():
-            time.sleep(1)
-        output += self.channel.recv(1024)
-        self.channel.send("\n")
-        while not self.channel.recv_ready():
-            time.sleep(5)
-        output += self.channel.recv(1024)
-        if self.netconfigit.verbose == 1:
-            print output
-
-        if "bytes copied" in output:
-            success = 1
-        if "Error" in output:
-            success = 0
-
-        return success
+            command = self.command_copy_startup
+        else:
+            command = self.command_copy_running
+        return expect.Dialog(command, PROMPT, answers=[(QUESTION, "\n")], success=SUCCESS, failure=FAILURE,
+                             timeout=expect.TRANSFER_TIMEOUT)
 
+    def get_config_inband(self, config_type):
+        """Defines the capture of configurations from device over the ssh session
+
+        Shows the config on the device and streams the output straight into the repository
+        :param config_type: the configuration type (ie. startup-config, running-config)
+        :return: the dialog which captures the config
+        """
+        if config_type == "startup-config":
+            command = self.command_show_startup
+        else:
+            command = self.command_show_running
+        return expect.CaptureDialog(command, PROMPT, self.netconfigit.archive_path(self.device, config_type),
+                                    failure=INVALID)
@@ -5,10 +5,20 @@ Netconfigit Dell device class
 
 import logging
 import os
-import time
+import re
+from modules import expect
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# device prompt, ie. "console>" or "console#"
+PROMPT = re.compile(r"(^|[\r\n])[\w\-\.\(\)/:@]+[>#]\s*$")
+PASSWORD = re.compile(r"[Pp]assword:\s*$")
+DENIED = re.compile("% ?(Access denied|Bad secrets)")
+SUCCESS = re.compile("bytes successfully copied")
+FAILURE = re.compile("Error")
+# error shown instead of the output of a command
+INVALID = re.compile(r"(^|[\r\n])% ?(Invalid|Incomplete|Ambiguous)")
+
 
 class Dell(object):
     """Dell device class
@@ -26,11 +36,16 @@ class Dell(object):
         """
         self.device = _device
         self.netconfigit = _netconfigit
+        self.session = None
 
         self.command_copy_startup = "copy startup-config tftp://" + self.netconfigit.transfer_ip + \
                                     "/" + self.device.name + "/startup-config\n"
         self.command_copy_running = "copy running-config tftp://" + self.netconfigit.transfer_ip + \
                                     "/" + self.device.name + "/running-config\n"
+        self.command_show_startup = "show startup-config\n"
+        self.command_show_running = "show running-config\n"
+        # the running config fetched over NETCONF is archived alongside the one from the command line
+        self.netconf_actions = {"netconf-running-config": ("running", "running-config.xml")}
 
     def run_action(self, action):
         """Defines and runs actions for the device associated with the class
@@ -42,64 +57,91 @@ class Dell(object):
         status = 0
         connected = 0
 
-        if self.device.access_type == "ssh":
+        if self.device.access_type in ("ssh", "telnet"):
             try:
-                self.client, self.channel = self.netconfigit.get_ssh_client_channel(self.device)
-                connected = 1
+                self.session = self.netconfigit.get_session(self.device, self.login_dialogs)
+                if self.session is not None:
+                    connected = 1
             except:
                 logger.error("Error connecting to " + self.device.name)
 
             if connected == 1:
-                if action == "running-config":
-                    status = self.get_config("running-config")
-                elif action == "startup-config":
-                    status = self.get_config("startup-config")
+                netconf = self.netconf_action(action)
+                if netconf is not None:
+                    source, _file = netconf
+                    status = self.netconfigit.netconf_get_config(self.device, source, _file)
                 else:
-                    logger.error("Action " + action + " not implemented for " +
-                                 self.device.manufacturer.title() + " devices.")
-                self.client.close()
+                    dialog = self.action_dialog(action)
+                    if dialog is not None:
+                        status = self.session.run(dialog)
         else:
             logger.error("Access method " + self.device.access_type + " not implemented for " +
                          self.device.manufacturer.title() + " devices.")
 
-        if status == 1:
-            self.netconfigit.success_list.append({self.device.name: action})
-        if status == 0:
-            self.netconfigit.failure_list.append({self.device.name: action})
+        self.netconfigit.record_result(self.device, action, status)
+
+    def action_dialog(self, action):
+        """Defines the dialog which runs an action on the device
+
+        Checks for valid action names
+        :param action: the action to run
+        :return: the dialog, or None if the action is not implemented
+        """
+        if action == "running-config":
+            return self.get_config("running-config")
+        elif action == "startup-config":
+            return self.get_config("startup-config")
+        logger.error("Action " + action + " not implemented for " +
+                     self.device.manufacturer.title() + " devices.")
+        return None
+
+    def netconf_action(self, action):
+        """Defines the NETCONF datastore fetched by an action
+
+        :param action: the action
+        :return: (datastore, filename archived as) tuple, or None if the action doesn't use NETCONF
+        """
+        return self.netconf_actions.get(action)
+
+    def login_dialogs(self):
+        """Defines the dialogs run once after connecting to the device
+
+        Waits for the first prompt, enters enable mode and disables paging for in-band capture
+        :return: list of dialogs
+        """
+        dialogs = [self.netconfigit.login_dialog(self.device, PROMPT)]
+        if self.device.enable_password != "NULL":
+            dialogs.append(expect.Dialog("enable\n", PROMPT,
+                                         answers=[(PASSWORD, self.device.enable_password + "\n")], failure=DENIED))
+        if self.device.capture == "inband":
+            dialogs.append(expect.Dialog("terminal length 0\n", PROMPT, failure=INVALID))
+        return dialogs
 
     def get_config(self, config_type):
-        """Transfers configurations from device via ssh and tftp
+        """Defines the transfer of configurations from device via ssh and tftp
 
         Issues commands to device via ssh to transfer configs to local tftp server
         :param config_type: the configuration type (ie. startup-config, running-config)
-        :return: boolean, 0 means transfer failed, 1 means transfer was successful
+        :return: the dialog which transfers the config
         """
-        output = ""
-        success = 0
+        if self.device.capture == "inband":
+            return self.get_config_inband(config_type)
+        if config_type == "startup-config":
+            command = self.command_copy_startup
+        else:
+            command = self.command_copy_running
+        return expect.Dialog(command, PROMPT, success=SUCCESS, failure=FAILURE, timeout=expect.TRANSFER_TIMEOUT)
 
-        time.sleep(5)
-        if self.device.enable_password != "NULL":
-            self.channel.send("enable\n")
-            while not self.channel.recv_ready():
-                time.sleep(5)
-            output += self.channel.recv(1024)
-            self.channel.send(self.device.enable_password + "\n")
-            while not self.channel.recv_ready():
-                time.sleep(5)
-            output += self.channel.recv(1024)
+    def get_config_inband(self, config_type):
+        """Defines the capture of configurations from device over the ssh session
+
+        Shows the config on the device and streams the output straight into the repository
+        :param config_type: the configuration type (ie. startup-config, running-config)
+        :return: the dialog which captures the config
+        """
         if config_type == "startup-config":
-            self.channel.send(self.command_copy_startup)
-        elif config_type == "running-config":
-            self.channel.send(self.command_copy_running)
-        while not self.channel.recv_ready():
-            time.sleep(10)
-        output += self.channel.recv(1024)
-        if self.netconfigit.verbose == 1:
-            print output
-
-        if "bytes successfully copied" in output:
-            success = 1
-        if "Error" in output:
-            success = 0
-
-        return success
\ No newline at end of file
+            command = self.command_show_startup
+        else:
+            command = self.command_show_running
+        return expect.CaptureDialog(command, PROMPT, self.netconfigit.archive_path(self.device, config_type),
+                                    failure=INVALID)
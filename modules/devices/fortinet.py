@@ -5,10 +5,78 @@ Netconfigit Fortinet device class
 
 import logging
 import os
-import time
+import re
+import socket
+import httplib
+from modules import expect
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# device prompt, ie. "FGT60D # " or "FGT60D (root) # "
+PROMPT = re.compile(r"(^|[\r\n])[\w\-\.]+( \([\w\-\.]+\))? [#\$]\s*$")
+SUCCESS = re.compile("Send config file to tftp server OK")
+FAILURE = re.compile("Error")
+# checksum of the whole configuration, ie. "all: 9c 4b 3f ..."
+CHANGED = re.compile(r"all: [0-9a-f]{2}( [0-9a-f]{2})+")
+# error shown instead of the output of a command
+INVALID = re.compile(r"Command fail|Unknown action")
+# REST API endpoint which downloads the configuration, and the header line every configuration begins with
+REST_BACKUP_PATH = "/api/v2/monitor/system/config/backup?scope=global"
+REST_CONFIG_HEADER = "#config-version="
+# sent once the device starts answering a command which needs confirming
+CONFIRM = "\n"
+
+
+class ConfirmDialog(expect.Dialog):
+    """A dialog which confirms its command with a newline once the device starts answering
+
+    The device returns to its prompt once after the command and once more after the confirmation,
+    so the dialog ends at the second prompt and leaves nothing behind for the next dialog.
+    :param command: the command to confirm
+    :param success: compiled regex which must be seen for the dialog to succeed
+    :param failure: compiled regex which fails the dialog when it is seen before the prompt
+    :param timeout: seconds allowed between one expected response and the next
+    """
+
+    def __init__(self, command, success=None, failure=None, timeout=None):
+        """Class constructor
+
+        :param command: the command to confirm
+        :param success: compiled regex which must be seen for the dialog to succeed
+        :param failure: compiled regex which fails the dialog when it is seen before the prompt
+        :param timeout: seconds allowed between one expected response and the next
+        """
+        expect.Dialog.__init__(self, command, PROMPT, success=success, failure=failure, timeout=timeout)
+        self.confirmed = 0          # set once the confirmation has been sent
+        self.prompts = 0            # prompts seen since the command was sent
+
+    def feed(self, data):
+        """Matches data received from the device, sending the confirmation with the first of it
+
+        Each line is matched on its own, so both prompts are seen when they arrive together.
+        :param data: text received from the device
+        :return: the text to send back to the device, or None
+        """
+        for line in data.splitlines(True):
+            expect.Dialog.feed(self, line)
+            if self.done == 1:
+                return None
+        if self.confirmed == 0:
+            self.confirmed = 1
+            return CONFIRM
+        return None
+
+    def finish(self, status):
+        """Marks the dialog as complete once the device returned to its prompt after the confirmation
+
+        :param status: 0 means the dialog failed, 1 means it succeeded
+        """
+        if self.prompts == 0 and self.expired == 0:
+            self.prompts = 1
+            self.window = ""
+            return
+        expect.Dialog.finish(self, status)
+
 
 class Fortinet(object):
     """Fortinet device class
@@ -26,10 +94,15 @@ class Fortinet(object):
         """
         self.device = _device
         self.netconfigit = _netconfigit
+        self.session = None
 
         self.command_copy_current = "exec backup config tftp " + self.device.name + "/current-config " \
                                     + self.netconfigit.transfer_ip + "\n"
         self.command_clear_dhcp_leases = "execute dhcp lease-clear all" + "\n"
+        self.command_show_current = "show full-configuration\n"
+        self.probe_commands = {"current-config": "diagnose sys ha checksum show\n"}
+        # the console only stops paging once its output mode is set to standard
+        self.commands_disable_paging = ["config system console\n", "set output standard\n", "end\n"]
 
     def run_action(self, action):
         """Defines and runs actions for the device associated with the class
@@ -41,73 +114,128 @@ class Fortinet(object):
         status = 0
         connected = 0
 
-        if self.device.access_type == "ssh":
+        if self.device.access_type in ("ssh", "telnet"):
             try:
-                self.client, self.channel = self.netconfigit.get_ssh_client_channel(self.device)
-                connected = 1
+                self.session = self.netconfigit.get_session(self.device, self.login_dialogs)
+                if self.session is not None:
+                    connected = 1
             except:
                 logger.error("Error connecting to " + self.device.name)
 
             if connected == 1:
-                if action == "current-config":
-                    status = self.get_config()
-                elif action == "clear-dhcp-leases":
-                    status = self.clear_dhcp_leases()
-                else:
-                    logger.error("Action " + action + " not implemented for " +
-                                 self.device.manufacturer.title() + " devices.")
-                self.client.close()
+                # a config which hasn't changed since it was last archived isn't transferred again
+                if self.netconfigit.check_unchanged(self.device, action, self) == 1:
+                    return
+                dialog = self.action_dialog(action)
+                if dialog is not None:
+                    status = self.session.run(dialog)
+        elif self.device.access_type == "rest":
+            if action == "current-config":
+                status = self.get_config_rest()
+            else:
+                logger.error("Action " + action + " not implemented for " +
+                             self.device.manufacturer.title() + " devices over the REST API.")
         else:
             logger.error("Access method " + self.device.access_type + " not implemented for " +
                          self.device.manufacturer.title() + " devices.")
 
-        if status == 1:
-            self.netconfigit.success_list.append({self.device.name: action})
-        if status == 0:
-            self.netconfigit.failure_list.append({self.device.name: action})
+        self.netconfigit.record_result(self.device, action, status)
+
+    def action_dialog(self, action):
+        """Defines the dialog which runs an action on the device
+
+        Checks for valid action names
+        :param action: the action to run
+        :return: the dialog, or None if the action is not implemented
+        """
+        if action == "current-config":
+            return self.get_config()
+        elif action == "clear-dhcp-leases":
+            return self.clear_dhcp_leases()
+        logger.error("Action " + action + " not implemented for " +
+                     self.device.manufacturer.title() + " devices.")
+        return None
+
+    def change_probe(self, action):
+        """Defines the dialog which probes for changes to the config archived by an action
+
+        Shows the checksums of the configuration, which change with any change to it
+        :param action: the action
+        :return: the dialog, or None if the action has no probe
+        """
+        if action in self.probe_commands:
+            return expect.OutputDialog(self.probe_commands[action], PROMPT, success=CHANGED)
+        return None
+
+    def login_dialogs(self):
+        """Defines the dialogs run once after connecting to the device
+
+        Waits for the first prompt and disables paging for in-band capture
+        :return: list of dialogs
+        """
+        dialogs = [self.netconfigit.login_dialog(self.device, PROMPT)]
+        if self.device.capture == "inband":
+            for command in self.commands_disable_paging:
+                dialogs.append(expect.Dialog(command, PROMPT, failure=INVALID))
+        return dialogs
 
     def get_config(self):
-        """Transfers configurations from device via ssh and tftp
+        """Defines the transfer of configurations from device via ssh and tftp
 
         Issues commands to device via ssh to transfer configs to local tftp server
         :param config_type: the configuration type (ie. startup-config, running-config)
-        :return: boolean, 0 means transfer failed, 1 means transfer was successful
+        :return: the dialog which transfers the config
         """
-        output = ""
-        success = 0
+        if self.device.capture == "inband":
+            return self.get_config_inband()
+        return ConfirmDialog(self.command_copy_current, success=SUCCESS, failure=FAILURE,
+                             timeout=expect.TRANSFER_TIMEOUT)
 
-        time.sleep(5)
-        self.channel.send(self.command_copy_current)
-        while not self.channel.recv_ready():
-            time.sleep(7)
-        output += self.channel.recv(1024)
-        self.channel.send("\n")
-        while not self.channel.recv_ready():
-            time.sleep(12)
-        output += self.channel.recv(1024)
-        if self.netconfigit.verbose == 1:
-            print output
+    def get_config_inband(self):
+        """Defines the capture of configurations from device over the ssh session
 
-        if "Send config file to tftp server OK" in output:
-            success = 1
-        if "Error" in output:
-            success = 0
+        Shows the full config on the device and streams the output straight into the repository
+        :return: the dialog which captures the config
+        """
+        return expect.CaptureDialog(self.command_show_current, PROMPT,
+                                    self.netconfigit.archive_path(self.device, "current-config"), failure=INVALID)
 
-        return success
+    def clear_dhcp_leases(self):
+        """Defines the clearing of all DHCP leases
+        :return: the dialog which clears the leases
+        """
+        # there is no output for this command so returning to the prompt means success
+        return ConfirmDialog(self.command_clear_dhcp_leases)
 
+    def get_config_rest(self):
+        """Fetches the configuration from device via the REST API
 
-    def clear_dhcp_leases(self):
-        """Clears all DHCP leases
-        :return: boolean, 0 means failure, 1 means success
+        Streams the configuration backup into the repository in chunks, authenticated by the REST API token
+        given as the device's password. The device's connection is kept open for all of its actions.
+        :return: 0/1 for fail/success
         """
-        output = ""
-        success = 0
-        time.sleep(5)
-        self.channel.send(self.command_clear_dhcp_leases)
-        while not self.channel.recv_ready():
-            time.sleep(5)
-        output += self.channel.recv(1024)
-        self.channel.send("\n")
-        # there is no  output for this command so success is always true
-        success = 1
-        return success
\ No newline at end of file
+        path = self.netconfigit.archive_path(self.device, "current-config")
+        status = 0
+        try:
+            client = self.netconfigit.get_http_client(self.device)
+            with open(path + ".part", "w") as part:
+                if client.download("GET", REST_BACKUP_PATH, part,
+                                   headers={"Authorization": "Bearer " + self.device.login_pass}) == 200:
+                    status = 1
+            if status == 1:
+                # an error page isn't a configuration
+                with open(path + ".part") as part:
+                    if part.read(len(REST_CONFIG_HEADER)) != REST_CONFIG_HEADER:
+                        logger.error("REST API on " + self.device.name + " did not return the configuration")
+                        status = 0
+            if status == 1:
+                os.rename(path + ".part", path)
+        except (httplib.HTTPException, socket.error), e:
+            logger.error("Error connecting to " + self.device.name + ": " + str(e))
+            status = 0
+        except (IOError, OSError), e:
+            logger.error("Could not write the current-config of " + self.device.name + ": " + str(e))
+            status = 0
+        if status == 0 and os.path.exists(path + ".part"):
+            os.remove(path + ".part")
+        return status
@@ -5,12 +5,64 @@ Netconfigit H3C device class
 
 import logging
 import os
-import time
+import re
 import shutil
-import telnetlib
+from modules import expect
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# device prompt, ie. "<switch>" or "[switch]"
+PROMPT = re.compile(r"(^|[\r\n])[<\[][\w\-\.]+[>\]]\s*$")
+SUCCESS = re.compile("finished!")
+FAILURE = re.compile("(Error|[Ff]ailed)")
+TERMINAL_TYPE = "vt100\n\r"     # answer to the terminal type question asked before the login prompts
+NEWLINE = "\n\r"                # line ending of the answers to the login prompts
+
+
+class BackupDialog(expect.Dialog):
+    """A dialog which backs up the startup configuration to the local tftp server
+
+    H3C can't specify a directory for the tftp upload, so once the backup succeeds the uploaded file
+    is moved from the temporary directory root into the device's subfolder.
+    :param command: the backup command
+    :param device: the device
+    :param tempdir: the temporary directory the tftp server writes to
+    """
+
+    def __init__(self, command, device, tempdir):
+        """Class constructor
+
+        :param command: the backup command
+        :param device: the device
+        :param tempdir: the temporary directory the tftp server writes to
+        """
+        expect.Dialog.__init__(self, command, PROMPT, success=SUCCESS, failure=FAILURE,
+                               timeout=expect.TRANSFER_TIMEOUT)
+        self.device = device
+        self.tempdir = tempdir
+
+    def finish(self, status):
+        """Marks the dialog as complete
+
+        Moves the uploaded file into the device's subfolder if the backup succeeded
+        :param status: 0 means the dialog failed, 1 means it succeeded
+        """
+        if status == 1:
+            dst_dir = self.tempdir + "/" + self.device.name
+            src_file = dst_dir + ".cfg"
+            dst_file = dst_dir + "/" + "startup-configuration.cfg"
+            try:
+                # make the named subfolder if it doesn't exist
+                if not os.path.exists(dst_dir):
+                    os.mkdir(dst_dir)
+                # rename and move the downloaded file from the temporary directory root to the named subfolder
+                shutil.move(src_file, dst_dir)
+                os.rename(dst_dir + "/" + self.device.name + ".cfg", dst_file)
+            except (IOError, OSError), e:
+                logger.error("Could not move the startup configuration of %s: %s", self.device.name, str(e))
+                status = 0
+        expect.Dialog.finish(self, status)
+
 
 class H3C(object):
     """H3C device class
@@ -28,6 +80,7 @@ class H3C(object):
         """
         self.device = _device
         self.netconfigit = _netconfigit
+        self.session = None
         self.command_copy_startup = "backup startup-configuration to " + self.netconfigit.transfer_ip + \
                                     " " + self.device.name + ".cfg\n"
 
@@ -41,64 +94,51 @@ class H3C(object):
         status = 0
         connected = 0
 
-        if self.device.access_type == "telnet":
+        if self.device.access_type in ("ssh", "telnet"):
             try:
-                self.client = telnetlib.Telnet(self.device.ip)
-                connected = 1
+                self.session = self.netconfigit.get_session(self.device, self.login_dialogs)
+                if self.session is not None:
+                    connected = 1
             except:
                 logger.error("Error connecting to " + self.device.name)
+                status = 0
 
             if connected == 1:
-                if action == "startup-config":
-                    status = self.get_config_telnet()
-                else:
-                    logger.error("Action " + action + " not implemented for " +
-                                 self.device.manufacturer.title() + " devices.")
-                self.client.close()
+                dialog = self.action_dialog(action)
+                if dialog is not None:
+                    status = self.session.run(dialog)
         else:
             logger.error("Access method " + self.device.access_type + " not implemented for " +
                          self.device.manufacturer.title() + " devices.")
 
-        if status == 1:
-            self.netconfigit.success_list.append({self.device.name: action})
-        if status == 0:
-            self.netconfigit.failure_list.append({self.device.name: action})
+        self.netconfigit.record_result(self.device, action, status)
 
-    def get_config_telnet(self):
-        """Transfers configurations from device via telnet and tftp
+    def action_dialog(self, action):
+        """Defines the dialog which runs an action on the device
 
-        Issues commands to device via telnet to transfer configs to local tftp server
-        :return: boolean, 0 means transfer failed, 1 means transfer was successful
+        Checks for valid action names
+        :param action: the action to run
+        :return: the dialog, or None if the action is not implemented
         """
-        output = ""
-        success = 0
-        self.client.write("vt100".encode('ascii') + "\n\r".encode('ascii'))
-        self.client.read_until('Username:')
-        self.client.write(self.device.login_user.encode('ascii') + "\n\r".encode('ascii'))
-        self.client.read_until("Password:")
-        self.client.write(self.device.login_pass.encode('ascii') + "\n\r".encode('ascii'))
-        self.client.read_until(">")
-        self.client.write(self.command_copy_startup.encode('ascii'))
-        self.client.write("quit\n\r".encode('ascii'))
-        output = self.client.read_all()
-
-        if self.netconfigit.verbose == 1:
-            print output
-
-        if "finished!" in output:
-            success = 1
-            # H3C can't specify directory for tftp download
-            # move the downloaded file to the named subdirectory in the temporary directory
-            dst_dir = self.netconfigit.tempdir + "/" + self.device.name
-            src_file = dst_dir + ".cfg"
-            dst_file = dst_dir + "/" + "startup-configuration.cfg"
-            # make the named subfolder if it doesn't exist
-            if not os.path.exists(dst_dir):
-                os.mkdir(dst_dir)
-            # rename and move the downloaded file from the temporary directory root to the named subfolder
-            shutil.move(src_file, dst_dir)
-            os.rename(dst_dir + "/" + self.device.name + ".cfg", dst_file)
-        else:
-            success = 0
+        if action == "startup-config":
+            return self.get_config()
+        logger.error("Action " + action + " not implemented for " +
+                     self.device.manufacturer.title() + " devices.")
+        return None
+
+    def login_dialogs(self):
+        """Defines the dialogs run once after connecting to the device
+
+        Logs in and waits for the first prompt. Comware asks telnet sessions for their terminal type
+        before the username, and the answers to its login prompts end in a newline and a carriage return.
+        :return: list of dialogs
+        """
+        return [self.netconfigit.login_dialog(self.device, PROMPT, command=TERMINAL_TYPE, newline=NEWLINE)]
 
-        return success
\ No newline at end of file
+    def get_config(self):
+        """Defines the transfer of configurations from device via tftp
+
+        Issues the backup command to transfer the startup configuration to the local tftp server
+        :return: the dialog which transfers the config
+        """
+        return BackupDialog(self.command_copy_startup, self.device, self.netconfigit.tempdir)
@@ -5,10 +5,24 @@ Netconfigit Solace device class
 
 import logging
 import os
-import time
+import re
+import socket
+import httplib
+from modules import expect
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# device prompt, ie. "solace1> " or "solace1# "
+PROMPT = re.compile(r"(^|[\r\n])[\w\-\.\(\)/:@]+[>#]\s*$")
+PASSWORD = re.compile(r"[Pp]assword:\s*$")
+SUCCESS = re.compile("bytes copied")
+FAILURE = re.compile("Error")
+# path of the SEMP endpoint, the request which shows the config and the result which ends a successful reply
+SEMP_PATH = "/SEMP"
+SEMP_SHOW_CONFIG = "<rpc><show><current-config/></show></rpc>"
+SEMP_OK = re.compile(r'<execute-result\s+code="ok"')
+SEMP_TAIL = 4096            # bytes at the end of a reply searched for its result
+
 
 class Solace(object):
     """Solace Systems device class
@@ -26,6 +40,7 @@ class Solace(object):
         """
         self.device = _device
         self.netconfigit = _netconfigit
+        self.session = None
 
         self.command_copy_current = "copy current-config scp://" + self.netconfigit.scp_username + "@" + \
                                     self.netconfigit.transfer_ip + "/" + self.netconfigit.repo_path + \
@@ -41,63 +56,95 @@ class Solace(object):
         status = 0
         connected = 0
 
-        if self.device.access_type == "ssh":
+        if self.device.access_type in ("ssh", "telnet"):
             try:
-                self.client, self.channel = self.netconfigit.get_ssh_client_channel(self.device)
-                connected = 1
+                self.session = self.netconfigit.get_session(self.device, self.login_dialogs)
+                if self.session is not None:
+                    connected = 1
             except:
                 logger.error("Error connecting to " + self.device.name)
 
             if connected == 1:
-                if action == "current-config":
-                    status = self.get_config()
-                else:
-                    logger.error("Action " + action + " not implemented for " +
-                                 self.device.manufacturer.title() + " devices.")
-                self.client.close()
+                dialog = self.action_dialog(action)
+                if dialog is not None:
+                    status = self.session.run(dialog)
+        elif self.device.access_type == "semp":
+            if action == "current-config":
+                status = self.get_config_semp()
+            else:
+                logger.error("Action " + action + " not implemented for " +
+                             self.device.manufacturer.title() + " devices.")
         else:
             logger.error("Access method " + self.device.access_type + " not implemented for " +
                          self.device.manufacturer.title() + " devices.")
 
-        if status == 1:
-            self.netconfigit.success_list.append({self.device.name: action})
-        if status == 0:
-            self.netconfigit.failure_list.append({self.device.name: action})
+        self.netconfigit.record_result(self.device, action, status)
+
+    def action_dialog(self, action):
+        """Defines the dialog which runs an action on the device
+
+        Checks for valid action names
+        :param action: the action to run
+        :return: the dialog, or None if the action is not implemented
+        """
+        if action == "current-config":
+            return self.get_config()
+        logger.error("Action " + action + " not implemented for " +
+                     self.device.manufacturer.title() + " devices.")
+        return None
+
+    def login_dialogs(self):
+        """Defines the dialogs run once after connecting to the device
+
+        Waits for the first prompt and enters enable mode
+        :return: list of dialogs
+        """
+        dialogs = [self.netconfigit.login_dialog(self.device, PROMPT)]
+        if self.device.enable_password != "NULL":
+            dialogs.append(expect.Dialog("enable\n", PROMPT, failure=FAILURE))
+        return dialogs
 
     def get_config(self):
-        """Transfers configurations from device via ssh and scp
+        """Defines the transfer of configurations from device via ssh and scp
 
         Issues commands to device via ssh to transfer configs to local scp server
         :param config_type: the configuration type (ie. startup-config, running-config)
-        :return: boolean, 0 means transfer failed, 1 means transfer was successful
+        :return: the dialog which transfers the config
         """
-        output = ""
-        success = 0
+        # the router asks for the password of the local scp account
+        return expect.Dialog(self.command_copy_current, PROMPT,
+                             answers=[(PASSWORD, self.netconfigit.scp_password + "\n")],
+                             success=SUCCESS, failure=FAILURE, timeout=expect.TRANSFER_TIMEOUT)
 
-        time.sleep(10)
-        if self.device.enable_password != "NULL":
-            self.channel.send("enable\n")
-            while not self.channel.recv_ready():
-                time.sleep(5)
-            output += self.channel.recv(1024)
-        self.channel.send(self.command_copy_current)
-        while not self.channel.recv_ready():
-            time.sleep(10)
-        output += self.channel.recv(1024)
-        self.channel.send(self.netconfigit.scp_password + "\n")
-        while not self.channel.recv_ready():
-            time.sleep(5)
-        output += self.channel.recv(1024)
-        self.channel.send("exit\nexit\n")
-        while not self.channel.recv_ready():
-            time.sleep(5)
-        output += self.channel.recv(1024)
-        if self.netconfigit.verbose == 1:
-            print output
-
-        if "bytes copied" in output:
-            success = 1
-        if "Error" in output:
-            success = 0
-
-        return success
\ No newline at end of file
+    def get_config_semp(self):
+        """Fetches the configuration from device via SEMP
+
+        Streams the reply to the show current-config request into the repository.
+        The device's SEMP connection is kept open for all of its actions.
+        :return: 0/1 for fail/success
+        """
+        path = self.netconfigit.archive_path(self.device, "current-config")
+        status = 0
+        try:
+            client = self.netconfigit.get_http_client(self.device)
+            with open(path + ".part", "w") as part:
+                if client.download("POST", SEMP_PATH, part, SEMP_SHOW_CONFIG, {"Content-Type": "text/xml"}) == 200:
+                    status = 1
+            if status == 1:
+                # the reply reports its result once the config has been sent
+                with open(path + ".part") as part:
+                    part.seek(max(0, os.path.getsize(path + ".part") - SEMP_TAIL))
+                    if SEMP_OK.search(part.read()) is None:
+                        logger.error("SEMP on " + self.device.name + " did not return the current-config")
+                        status = 0
+            if status == 1:
+                os.rename(path + ".part", path)
+        except (httplib.HTTPException, socket.error), e:
+            logger.error("Error connecting to " + self.device.name + ": " + str(e))
+            status = 0
+        except (IOError, OSError), e:
+            logger.error("Could not write the current-config of " + self.device.name + ": " + str(e))
+            status = 0
+        if status == 0 and os.path.exists(path + ".part"):
+            os.remove(path + ".part")
+        return status
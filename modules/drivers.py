@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+DriverRegistry class
+
+Discovers the manufacturer device classes in the devices subfolder
+"""
+
+import os
+import logging
+import importlib
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+DEVICES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "devices")
+DEVICES_PACKAGE = "modules.devices"
+
+
+class DriverRegistry(object):
+    """The manufacturer device classes, loaded once at startup
+
+    Each module in the devices subfolder is named after its manufacturer and defines a class
+    named after the manufacturer in title case, ie. devices/cisco.py defines Cisco.
+    Modules declare their prompt, success and failure patterns as module level regexes,
+    so they are compiled once when the registry loads them.
+    :param path: the folder containing the device modules
+    :param package: the package name the device modules are imported from
+    """
+
+    def __init__(self, path=DEVICES_PATH, package=DEVICES_PACKAGE):
+        """Class constructor
+
+        Imports and validates the device modules
+        :param path: the folder containing the device modules
+        :param package: the package name the device modules are imported from
+        """
+        self.path = path
+        self.package = package
+        self.drivers = {}                   # manufacturer name to device class
+        self.load()
+
+    def load(self):
+        """Imports each device module and registers its device class
+
+        Modules which fail to import or don't define a usable device class are logged and skipped.
+        """
+        for filename in sorted(os.listdir(self.path)):
+            manufacturer, extension = os.path.splitext(filename)
+            if extension != ".py" or manufacturer.startswith("_"):
+                continue
+            try:
+                module = importlib.import_module(self.package + "." + manufacturer)
+            except Exception, e:
+                logger.error("Could not load device module %s: %s", filename, str(e))
+                continue
+            if not hasattr(getattr(module, "PROMPT", None), "search"):
+                logger.error("Device module %s does not declare a compiled PROMPT pattern", filename)
+                continue
+            device_class = getattr(module, manufacturer.title(), None)
+            if device_class is None or not hasattr(device_class, "run_action"):
+                logger.error("Device module %s does not define a %s class with a run_action method",
+                             filename, manufacturer.title())
+                continue
+            self.drivers[manufacturer] = device_class
+        logger.info("Loaded device classes for %s", ", ".join(sorted(self.drivers.keys())))
+
+    def supports(self, manufacturer):
+        """Checks whether a manufacturer has a device class
+
+        :param manufacturer: the manufacturer name, in any case
+        :return: boolean, True if the manufacturer is implemented
+        """
+        return manufacturer.lower() in self.drivers
+
+    def create(self, _device, _netconfigit):
+        """Creates the manufacturer object for a device
+
+        :param _device: the device
+        :param _netconfigit: the netconfigit object containing the configuration
+        :return: the manufacturer object
+        """
+        return self.drivers[_device.manufacturer.lower()](_device, _netconfigit)
@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+"""
+EventLoop, Call and Exchange classes
+
+Drives many device sessions from a single thread. Tasks are generators which yield the
+operations they are waiting on and are resumed with the results.
+"""
+
+import os
+import sys
+import heapq
+import select
+import logging
+import time
+from Queue import Queue, Empty
+from collections import deque
+
+import expect
+import threadpool
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class Call(object):
+    """A blocking function call run in the event loop's executor
+
+    The task is resumed with the function's return value, or the exception it raised is thrown into the task.
+    :param func: the function to call
+    :param args: arguments passed to the function
+    """
+
+    def __init__(self, func, *args):
+        """Class constructor
+
+        :param func: the function to call
+        :param args: arguments passed to the function
+        """
+        self.func = func
+        self.args = args
+
+
+class Exchange(object):
+    """A dialog run over a session by the event loop
+
+    The task is resumed with the dialog's status.
+    :param session: the session the dialog is run over
+    :param dialog: the dialog to run
+    """
+
+    def __init__(self, session, dialog):
+        """Class constructor
+
+        :param session: the session the dialog is run over
+        :param dialog: the dialog to run
+        """
+        self.session = session
+        self.dialog = dialog
+        self.task = None
+        self.fd = None
+        self.deadline = 0
+        self.extended = 0           # later deadline set by data received since, taken up once the deadline passes
+
+
+class EventLoop(object):
+    """Runs tasks until all of them are complete
+
+    Channels are polled for input so that waiting sessions don't hold a thread,
+    while blocking calls such as connecting and authenticating are run on a small thread pool.
+    :param executor_threads: the number of threads used for blocking calls
+    :param limit: optional threadpool.AdaptiveLimit on the number of tasks in progress
+    :param bulkheads: optional dictionary of group to the maximum number of the group's tasks in progress
+    """
+
+    def __init__(self, executor_threads, limit=None, bulkheads=None):
+        """Class constructor
+
+        :param executor_threads: the number of threads used for blocking calls
+        :param limit: optional threadpool.AdaptiveLimit on the number of tasks in progress
+        :param bulkheads: optional dictionary of group to the maximum number of the group's tasks in progress
+        """
+        self.executor_threads = executor_threads
+        self.limit = limit
+        self.executor = None                # thread pool running blocking calls
+        self.tasks = threadpool.BulkheadQueue(bulkheads or {})  # tasks waiting to be started
+        self.task_groups = {}               # groups of the tasks in progress
+        self.task_count = 0                 # tasks started and not yet complete
+        self.calls = deque()                # calls waiting for a free executor thread
+        self.calls_running = 0              # calls currently running in the executor
+        self.completed = Queue()            # results of calls returned by the executor
+        self.cancelled = Queue()            # sessions whose exchanges were cancelled from other threads
+        self.exchanges = {}                 # exchanges waiting for input, keyed by channel file descriptor
+        self.deadlines = []                 # heap of (deadline, file descriptor) for the waiting exchanges
+        self.poller = None
+        self.wakeup_read = None             # pipe written to by the executor when a call completes
+        self.wakeup_write = None
+
+    def spawn(self, task, groups=(), delay=0, priority=0):
+        """Adds a task to the loop
+
+        :param task: a generator which yields Call and Exchange objects
+        :param groups: the bulkhead groups the task is a member of
+        :param delay: seconds before the task is started
+        :param priority: tasks with a higher number are only started once no lower numbered task can be
+        """
+        self.tasks.put(task, groups, delay, priority)
+
+    def run(self):
+        """Runs all tasks to completion
+
+        """
+        self.executor = threadpool.ThreadPool(self.executor_threads)
+        self.poller = select.poll()
+        self.wakeup_read, self.wakeup_write = os.pipe()
+        self.poller.register(self.wakeup_read, select.POLLIN)
+
+        while True:
+            self.start_tasks()
+            if self.task_count == 0 and len(self.tasks) == 0:
+                break
+            # wake for the first dialog timeout or the first deferred task, whichever is sooner
+            wakeups = [deadline for deadline, fd in self.deadlines[:1]]
+            ready = self.tasks.next_ready()
+            if ready is not None:
+                wakeups.append(ready)
+            timeout = None
+            if wakeups:
+                timeout = max(0, int((min(wakeups) - time.time()) * 1000) + 1)
+            for fd, event in self.poller.poll(timeout):
+                if fd == self.wakeup_read:
+                    os.read(self.wakeup_read, 4096)
+                    self.collect_calls()
+                    self.collect_cancellations()
+                elif fd in self.exchanges:
+                    self.read(self.exchanges[fd])
+            self.expire(time.time())
+
+        self.poller.unregister(self.wakeup_read)
+        os.close(self.wakeup_read)
+        os.close(self.wakeup_write)
+        self.wakeup_write = None
+
+    def cancel(self, session):
+        """Ends the exchange running over a session
+
+        May be called from any thread - the exchange is ended by the loop's own thread.
+        Does nothing if the session has no exchange running.
+        :param session: the session
+        """
+        if self.wakeup_write is None:
+            return
+        self.cancelled.put(session)
+        try:
+            os.write(self.wakeup_write, "x")
+        except OSError:
+            pass
+
+    def collect_cancellations(self):
+        """Ends the exchanges of the sessions cancelled from other threads
+
+        """
+        while True:
+            try:
+                session = self.cancelled.get_nowait()
+            except Empty:
+                break
+            for exchange in self.exchanges.values():
+                if exchange.session is session:
+                    logger.warning("Cancelled waiting for a response")
+                    self.expire_exchange(exchange)
+                    break
+
+    def start_tasks(self):
+        """Starts waiting tasks while the limit and their bulkheads allow it
+
+        """
+        while len(self.tasks) > 0:
+            if self.limit is not None and self.limit.try_acquire() == 0:
+                break
+            waiting = self.tasks.get_nowait()
+            if waiting is None:
+                if self.limit is not None:
+                    self.limit.release()
+                break
+            task, groups = waiting
+            self.task_groups[task] = groups
+            self.task_count += 1
+            self.resume(task)
+
+    def finish_task(self, task):
+        """Counts a task as complete
+
+        :param task: the task
+        """
+        self.task_count -= 1
+        self.tasks.done(self.task_groups.pop(task))
+        if self.limit is not None:
+            self.limit.release()
+
+    def resume(self, task, value=None, error=None):
+        """Resumes a task until it yields its next operation or completes
+
+        :param task: the task
+        :param value: the result of the task's previous operation
+        :param error: exc_info of the exception raised by the task's previous operation
+        """
+        try:
+            if error is not None:
+                operation = task.throw(*error)
+            else:
+                operation = task.send(value)
+        except StopIteration:
+            self.finish_task(task)
+            return
+        except Exception, e:
+            # tasks record the errors of their own actions, this only keeps a stray error from stopping the loop
+            logger.error("Task failed: %s", str(e))
+            self.finish_task(task)
+            return
+
+        if isinstance(operation, Call):
+            self.calls.append((task, operation))
+            self.start_calls()
+        elif isinstance(operation, Exchange):
+            operation.task = task
+            self.start_exchange(operation)
+        else:
+            self.resume(task, error=(TypeError, TypeError("Tasks must yield Call or Exchange objects"), None))
+
+    def start_calls(self):
+        """Hands waiting calls to the executor while it has free threads
+
+        """
+        while self.calls and self.calls_running < self.executor_threads:
+            task, call = self.calls.popleft()
+            self.calls_running += 1
+            self.executor.add_task(self.run_call, task, call)
+
+    def run_call(self, task, call):
+        """Runs a call on an executor thread and passes its result back to the loop
+
+        :param task: the task waiting on the call
+        :param call: the call
+        """
+        try:
+            self.completed.put((task, call.func(*call.args), None))
+        except:
+            self.completed.put((task, None, sys.exc_info()))
+        os.write(self.wakeup_write, "c")
+
+    def collect_calls(self):
+        """Resumes the tasks whose calls have completed
+
+        """
+        while True:
+            try:
+                task, value, error = self.completed.get_nowait()
+            except Empty:
+                break
+            self.calls_running -= 1
+            self.resume(task, value, error)
+        self.start_calls()
+
+    def start_exchange(self, exchange):
+        """Sends an exchange's command and waits for input on its channel
+
+        :param exchange: the exchange
+        """
+        channel = exchange.session.channel
+        try:
+            command = exchange.dialog.start()
+            if command is not None:
+                channel.send(command)
+            exchange.fd = channel.fileno()
+            self.exchanges[exchange.fd] = exchange
+            self.poller.register(exchange.fd, select.POLLIN)
+        except Exception, e:
+            self.fail_exchange(exchange, e)
+            return
+        self.set_deadline(exchange)
+
+    def set_deadline(self, exchange):
+        """Restarts the dialog timeout of an exchange
+
+        :param exchange: the exchange
+        """
+        exchange.deadline = time.time() + exchange.session.timeout(exchange.dialog)
+        exchange.extended = exchange.deadline
+        heapq.heappush(self.deadlines, (exchange.deadline, exchange.fd))
+
+    def extend_deadline(self, exchange):
+        """Restarts the dialog timeout of an exchange which has received data
+
+        The heap isn't touched for every read of a streaming exchange, the later deadline only replaces
+        the exchange's entry once the earlier one passes.
+        :param exchange: the exchange
+        """
+        exchange.extended = time.time() + exchange.session.timeout(exchange.dialog)
+
+    def read(self, exchange):
+        """Feeds the input available on an exchange's channel to its dialog
+
+        :param exchange: the exchange
+        """
+        channel = exchange.session.channel
+        dialog = exchange.dialog
+        try:
+            if channel.recv_ready():
+                response = dialog.feed(exchange.session.drain(channel.recv(expect.RECV_SIZE)))
+                if response is not None:
+                    channel.send(response)
+                    self.set_deadline(exchange)
+                else:
+                    self.extend_deadline(exchange)
+            elif channel.closed or channel.eof_received:
+                logger.warning("Channel closed while waiting for a response")
+                dialog.expire()
+        except Exception, e:
+            self.fail_exchange(exchange, e)
+            return
+        if dialog.done:
+            self.finish_exchange(exchange)
+
+    def expire(self, now):
+        """Ends the exchanges whose dialogs have timed out
+
+        Heap entries left behind by restarted or finished exchanges are discarded,
+        and exchanges which received data since their deadline was set move on to the extended one.
+        :param now: the current time
+        """
+        while self.deadlines and self.deadlines[0][0] <= now:
+            deadline, fd = heapq.heappop(self.deadlines)
+            exchange = self.exchanges.get(fd)
+            if exchange is None or exchange.deadline != deadline:
+                continue
+            if exchange.extended > now:
+                exchange.deadline = exchange.extended
+                heapq.heappush(self.deadlines, (exchange.deadline, fd))
+                continue
+            logger.warning("Timed out waiting for a response")
+            self.expire_exchange(exchange)
+
+    def fail_exchange(self, exchange, error):
+        """Ends an exchange whose channel or dialog raised an error
+
+        The dialog is expired and the exchange's task resumed with its status, so one session's error
+        only fails that session's dialog and never stops the loop.
+        :param exchange: the exchange
+        :param error: the exception raised
+        """
+        logger.warning("Session error while waiting for a response: %s", str(error))
+        self.expire_exchange(exchange)
+
+    def expire_exchange(self, exchange):
+        """Ends an exchange whose dialog didn't complete and resumes its task with the dialog's status
+
+        :param exchange: the exchange
+        """
+        if not exchange.dialog.done:
+            try:
+                exchange.dialog.expire()
+            except Exception, e:
+                logger.error("Could not end the dialog: %s", str(e))
+        self.finish_exchange(exchange)
+
+    def finish_exchange(self, exchange):
+        """Stops waiting on a completed exchange and resumes its task with the dialog's status
+
+        :param exchange: the exchange
+        """
+        if exchange.fd is not None and self.exchanges.get(exchange.fd) is exchange:
+            self.poller.unregister(exchange.fd)
+            del self.exchanges[exchange.fd]
+        self.resume(exchange.task, exchange.session.finished(exchange.dialog))
@@ -0,0 +1,445 @@
+# -*- coding: utf-8 -*-
+"""
+Dialog, LoginDialog, CaptureDialog, OutputDialog, Expect and Session classes
+
+Drives command/response exchanges with network devices over an interactive channel
+"""
+
+import os
+import re
+import socket
+import logging
+import time
+from StringIO import StringIO
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+RECV_SIZE = 32768           # maximum number of bytes read from the channel at once
+DRAIN_SIZE = 262144         # maximum number of bytes drained from the channel before they are matched
+STEP_TIMEOUT = 30           # default seconds allowed between one expected response and the next
+TRANSFER_TIMEOUT = 300      # default seconds allowed for a device to finish transferring a file
+MATCH_OVERLAP = 256         # characters of already scanned text rescanned for matches spanning two reads
+
+# login prompts of devices which leave authentication to the command line, ie. over telnet
+LOGIN = re.compile(r"([Ll]ogin|[Uu]ser ?[Nn]ame):\s*$")
+PASSWORD = re.compile(r"[Pp]assword:\s*$")
+
+
+class Dialog(object):
+    """A command sent to a device and the responses expected back from it
+
+    The dialog does no I/O of its own - received data is passed to feed() which decides what,
+    if anything, should be sent back to the device and when the exchange is complete.
+    Only newly received text is scanned, so matching costs the same however long the output grows.
+    Seeing the failure pattern ends the dialog at once, without waiting for the prompt.
+    :param command: the text sent to the device when the dialog starts, None to only wait for the prompt
+    :param prompt: compiled regex matching the device prompt which ends the dialog
+    :param answers: list of (compiled regex, response) pairs - the response is sent whenever the regex matches
+    :param success: compiled regex which must be seen before the prompt for the dialog to succeed
+    :param failure: compiled regex which fails the dialog when it is seen before the prompt
+    :param timeout: seconds allowed between one expected response and the next, None for the session's step timeout
+    :param sink: file object the command's output is streamed to instead of being kept in memory
+    """
+
+    def __init__(self, command, prompt, answers=None, success=None, failure=None, timeout=None, sink=None):
+        """Class constructor
+
+        :param command: the text sent to the device when the dialog starts
+        :param prompt: compiled regex matching the device prompt which ends the dialog
+        :param answers: list of (compiled regex, response) pairs
+        :param success: compiled regex which must be seen for the dialog to succeed
+        :param failure: compiled regex which fails the dialog when it is seen before the prompt
+        :param timeout: seconds allowed between one expected response and the next
+        :param sink: file object the command's output is streamed to
+        """
+        self.command = command
+        self.prompt = prompt
+        self.answers = answers or []
+        self.success = success
+        self.failure = failure
+        self.timeout = timeout
+        self.sink = sink
+        self.echoed = 0             # set once the echo of the command has been skipped when streaming
+        self.window = ""            # the tail of the received text which may still be part of a match
+        self.succeeded = 0          # set once the success pattern has been seen
+        self.failed = 0             # set once the failure pattern has been seen
+        self.done = 0               # set once the dialog is complete
+        self.expired = 0            # set if the dialog ended without the device returning to its prompt
+        self.status = 0             # 0 means the dialog failed, 1 means it succeeded
+
+    def start(self):
+        """Starts the dialog
+
+        :return: the text to send to the device, or None
+        """
+        return self.command
+
+    def feed(self, data):
+        """Matches data received from the device against the expected responses
+
+        :param data: text received from the device
+        :return: the text to send back to the device, or None
+        """
+        self.window += data
+
+        start = self.scan_start(data)
+        if self.failure is not None and self.failure.search(self.window, start) is not None:
+            self.abort()
+            return None
+        if self.success is not None and self.success.search(self.window, start) is not None:
+            self.succeeded = 1
+        if self.sink is not None:
+            self.stream()
+        start = self.scan_start(data)
+        for pattern, response in self.answers:
+            match = pattern.search(self.window, start)
+            if match is not None:
+                self.window = self.window[match.end():]
+                return response
+        if self.prompt.search(self.window, start) is not None:
+            self.finish(self.result())
+            return None
+        if self.sink is None:
+            self.window = self.window[-MATCH_OVERLAP - len(data):]
+        return None
+
+    def scan_start(self, data):
+        """Returns where matching starts in the window
+
+        Text received before the latest data has already been scanned, except for a short overlap
+        which may hold the start of a match completed by the latest data.
+        :param data: the latest text received from the device
+        :return: the index in the window
+        """
+        return max(0, len(self.window) - len(data) - MATCH_OVERLAP)
+
+    def abort(self):
+        """Ends the dialog when the device reports a failure
+
+        The device hasn't returned to its prompt, so the dialog counts as expired as well as failed.
+        """
+        self.failed = 1
+        self.expired = 1
+        self.finish(0)
+
+    def stream(self):
+        """Writes the complete lines of received output to the sink
+
+        The echo of the command is skipped and the last, incomplete, line is held back
+        since it may turn out to be the prompt.
+        """
+        if self.echoed == 0:
+            end = self.window.find("\n")
+            if end < 0:
+                return
+            self.window = self.window[end + 1:]
+            self.echoed = 1
+        end = self.window.rfind("\n")
+        if end >= 0:
+            self.sink.write(self.window[:end + 1].replace("\r\n", "\n"))
+            self.window = self.window[end + 1:]
+
+    def expire(self):
+        """Ends the dialog when the device has not answered in time
+
+        A dialog that already saw its success pattern is still considered successful.
+        """
+        self.expired = 1
+        if self.success is None:
+            self.finish(0)
+        else:
+            self.finish(self.result())
+
+    def result(self):
+        """Determines the outcome of the dialog from the patterns seen so far
+
+        :return: boolean, 0 means the dialog failed, 1 means it succeeded
+        """
+        if self.failed == 1:
+            return 0
+        if self.success is None:
+            return 1
+        return self.succeeded
+
+    def finish(self, status):
+        """Marks the dialog as complete
+
+        :param status: 0 means the dialog failed, 1 means it succeeded
+        """
+        self.done = 1
+        self.status = status
+
+
+class LoginDialog(Dialog):
+    """A dialog which logs in to a device's command line and waits for the first prompt
+
+    Being asked for more credentials than the username and password means they were refused.
+    :param prompt: compiled regex matching the device prompt which ends the dialog
+    :param username: the login username
+    :param password: the login password
+    :param timeout: seconds allowed between one expected response and the next
+    :param command: optional text sent as soon as the connection opens, ie. a terminal type
+    :param newline: the line ending sent after the username and password
+    """
+
+    def __init__(self, prompt, username, password, timeout=None, command=None, newline="\n"):
+        """Class constructor
+
+        :param prompt: compiled regex matching the device prompt which ends the dialog
+        :param username: the login username
+        :param password: the login password
+        :param timeout: seconds allowed between one expected response and the next
+        :param command: optional text sent as soon as the connection opens, ie. a terminal type
+        :param newline: the line ending sent after the username and password
+        """
+        Dialog.__init__(self, command, prompt, answers=[(LOGIN, username + newline), (PASSWORD, password + newline)],
+                        timeout=timeout)
+        self.attempts = 0           # the number of login prompts answered
+
+    def feed(self, data):
+        """Matches data received from the device against the login prompts and the device prompt
+
+        :param data: text received from the device
+        :return: the text to send back to the device, or None
+        """
+        response = Dialog.feed(self, data)
+        if response is None:
+            return None
+        self.attempts += 1
+        if self.attempts > len(self.answers):
+            logger.warning("Login was refused")
+            self.abort()
+            return None
+        return response
+
+
+class CaptureDialog(Dialog):
+    """A dialog which streams the output of its command into a file
+
+    The output is written to a partial file which only replaces the file when the dialog succeeds.
+    :param command: the text sent to the device when the dialog starts
+    :param prompt: compiled regex matching the device prompt which ends the dialog
+    :param path: the file the output is captured to
+    :param failure: compiled regex which fails the dialog when it is seen before the prompt
+    :param timeout: seconds allowed between one expected response and the next
+    """
+
+    def __init__(self, command, prompt, path, failure=None, timeout=TRANSFER_TIMEOUT):
+        """Class constructor
+
+        :param command: the text sent to the device when the dialog starts
+        :param prompt: compiled regex matching the device prompt which ends the dialog
+        :param path: the file the output is captured to
+        :param failure: compiled regex which fails the dialog when it is seen before the prompt
+        :param timeout: seconds allowed between one expected response and the next
+        """
+        Dialog.__init__(self, command, prompt, failure=failure, timeout=timeout)
+        self.path = path
+        self.part_path = path + ".part"
+
+    def start(self):
+        """Starts the dialog
+
+        Opens the partial file the output is streamed to
+        :return: the text to send to the device
+        """
+        self.sink = open(self.part_path, "w")
+        return Dialog.start(self)
+
+    def finish(self, status):
+        """Marks the dialog as complete
+
+        Moves the partial file over the captured file if the dialog succeeded, otherwise discards it.
+        A capture which can't be moved into place fails the dialog.
+        :param status: 0 means the dialog failed, 1 means it succeeded
+        """
+        Dialog.finish(self, status)
+        # the partial file may not have been opened if the dialog failed to start
+        if self.sink is None:
+            return
+        self.sink.close()
+        try:
+            if status == 1:
+                os.rename(self.part_path, self.path)
+            else:
+                os.remove(self.part_path)
+        except OSError, e:
+            logger.error("Could not save the capture to %s: %s", self.path, str(e))
+            self.status = 0
+
+
+class OutputDialog(Dialog):
+    """A dialog which keeps the output of its command, for commands whose output is short
+
+    :param command: the text sent to the device when the dialog starts
+    :param prompt: compiled regex matching the device prompt which ends the dialog
+    :param success: compiled regex which must be seen before the prompt for the dialog to succeed
+    :param timeout: seconds allowed between one expected response and the next
+    """
+
+    def __init__(self, command, prompt, success=None, timeout=None):
+        """Class constructor
+
+        :param command: the text sent to the device when the dialog starts
+        :param prompt: compiled regex matching the device prompt which ends the dialog
+        :param success: compiled regex which must be seen before the prompt for the dialog to succeed
+        :param timeout: seconds allowed between one expected response and the next
+        """
+        Dialog.__init__(self, command, prompt, success=success, timeout=timeout, sink=StringIO())
+
+    def output(self):
+        """Returns the output of the command received so far, less the echo of the command and the prompt
+
+        :return: the output
+        """
+        return self.sink.getvalue()
+
+
+class Expect(object):
+    """Runs dialogs over an interactive channel
+
+    Reads from the channel until a dialog is complete instead of sleeping for fixed intervals.
+    :param channel: the paramiko channel connected to the device
+    :param transcript: optional file object everything received from the device is written to
+    """
+
+    def __init__(self, channel, transcript=None):
+        """Class constructor
+
+        :param channel: the paramiko channel connected to the device
+        :param transcript: optional file object everything received from the device is written to
+        """
+        self.channel = channel
+        self.transcript = transcript
+        self.step_timeout = STEP_TIMEOUT    # seconds allowed for each response of dialogs without their own timeout
+        self.deadline = None                # time by which the current action must be complete, if any
+
+    def timeout(self, dialog):
+        """Returns the seconds allowed for the dialog's next response
+
+        The dialog's own timeout, or the step timeout, cut short by the action deadline
+        :param dialog: the dialog
+        :return: seconds
+        """
+        timeout = dialog.timeout
+        if timeout is None:
+            timeout = self.step_timeout
+        if self.deadline is not None:
+            timeout = min(timeout, max(0, self.deadline - time.time()))
+        return timeout
+
+    def run(self, dialog):
+        """Runs a dialog to completion
+
+        Sends the dialog's command and answers, and waits up to the timeout for each response.
+        Any data received restarts the timeout, so long output streamed without a prompt isn't cut short.
+        :param dialog: the dialog to run
+        :return: boolean, 0 means the dialog failed, 1 means it succeeded
+        """
+        command = dialog.start()
+        if command is not None:
+            self.channel.send(command)
+        deadline = time.time() + self.timeout(dialog)
+
+        while not dialog.done:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                logger.warning("Timed out waiting for a response")
+                dialog.expire()
+                break
+            self.channel.settimeout(remaining)
+            try:
+                data = self.channel.recv(RECV_SIZE)
+            except socket.timeout:
+                continue
+            if not data:
+                logger.warning("Channel closed while waiting for a response")
+                dialog.expire()
+                break
+            response = dialog.feed(self.drain(data))
+            if response is not None:
+                self.channel.send(response)
+            deadline = time.time() + self.timeout(dialog)
+
+        return self.finished(dialog)
+
+    def drain(self, data):
+        """Reads whatever else has already arrived on the channel
+
+        Chatty devices are matched in a few large blocks rather than many small ones.
+        The data is written to the transcript, if any.
+        :param data: the data just received from the channel
+        :return: the data followed by everything else available, up to DRAIN_SIZE bytes
+        """
+        chunks = [data]
+        size = len(data)
+        while size < DRAIN_SIZE and self.channel.recv_ready():
+            data = self.channel.recv(RECV_SIZE)
+            if not data:
+                break
+            chunks.append(data)
+            size += len(data)
+        data = "".join(chunks)
+        if self.transcript is not None:
+            self.transcript.write(data)
+        return data
+
+    def finished(self, dialog):
+        """Handles a completed dialog
+
+        :param dialog: the completed dialog
+        :return: boolean, 0 means the dialog failed, 1 means it succeeded
+        """
+        return dialog.status
+
+
+class Session(Expect):
+    """An open connection to a device over which any number of dialogs are run
+
+    :param client: the ssh or telnet client which owns the channel
+    :param channel: the channel connected to the device
+    :param transcript: optional file object everything received from the device is written to
+    """
+
+    def __init__(self, client, channel, transcript=None):
+        """Class constructor
+
+        :param client: the ssh or telnet client which owns the channel
+        :param channel: the channel connected to the device
+        :param transcript: optional file object everything received from the device is written to
+        """
+        Expect.__init__(self, channel, transcript)
+        self.client = client
+        self.synchronized = 1       # cleared when a dialog ends without the device returning to its prompt
+
+    def finished(self, dialog):
+        """Handles a completed dialog
+
+        A dialog which ends without seeing the prompt leaves unread output on the channel,
+        so the session can't be trusted for further dialogs.
+        :param dialog: the completed dialog
+        :return: boolean, 0 means the dialog failed, 1 means it succeeded
+        """
+        if dialog.expired == 1:
+            self.synchronized = 0
+        return Expect.finished(self, dialog)
+
+    def active(self):
+        """Checks whether the session can still be used
+
+        :return: boolean, 0 means the session is dead or out of step with the device, 1 means it is usable
+        """
+        transport = self.client.get_transport()
+        if transport is None or not transport.is_active():
+            return 0
+        if self.channel.closed or self.synchronized == 0:
+            return 0
+        return 1
+
+    def close(self):
+        """Closes the session and its transcript
+
+        """
+        self.client.close()
+        if self.transcript is not None:
+            self.transcript.close()
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+HTTPClient class
+
+Keep-alive HTTP and HTTPS connections to the management APIs of network devices
+"""
+
+import ssl
+import socket
+import base64
+import httplib
+import logging
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+CHUNK_SIZE = 65536          # bytes read from a response at once when it is streamed to a file
+
+
+class HTTPClient(object):
+    """A connection to a device's management API which is kept open for all of the device's requests
+
+    The connection is opened by the first request and reopened if the device has closed it in the meantime.
+    Requests are authenticated with HTTP basic authentication when a username is given,
+    unless they carry their own Authorization header, ie. an API token.
+    :param host: the device's address
+    :param port: the API's port
+    :param scheme: "https" or "http"
+    :param username: optional username
+    :param password: optional password
+    :param verify: boolean, 0 accepts any certificate, ie. a device's self-signed one
+    :param timeout: optional seconds allowed to connect
+    :param read_timeout: optional seconds allowed for each read once connected
+    """
+
+    def __init__(self, host, port, scheme="https", username=None, password=None, verify=1, timeout=None,
+                 read_timeout=None):
+        """Class constructor
+
+        :param host: the device's address
+        :param port: the API's port
+        :param scheme: "https" or "http"
+        :param username: optional username
+        :param password: optional password
+        :param verify: boolean, 0 accepts any certificate, ie. a device's self-signed one
+        :param timeout: optional seconds allowed to connect
+        :param read_timeout: optional seconds allowed for each read once connected
+        """
+        self.host = host
+        self.port = port
+        self.scheme = scheme
+        self.username = username
+        self.password = password
+        self.verify = verify
+        self.timeout = timeout
+        self.read_timeout = read_timeout
+        self.connection = None
+        self.requests = 0                   # requests made over the current connection
+
+    def connect(self):
+        """Opens the connection
+
+        """
+        if self.scheme == "https":
+            context = ssl.create_default_context()
+            if self.verify == 0:
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+            self.connection = httplib.HTTPSConnection(self.host, self.port, timeout=self.timeout, context=context)
+        else:
+            self.connection = httplib.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        self.connection.connect()
+        if self.read_timeout is not None:
+            self.connection.sock.settimeout(self.read_timeout)
+        self.requests = 0
+
+    def request(self, method, path, body=None, headers=None):
+        """Sends a request and returns the response
+
+        A request which fails on a connection that has already been used is retried once on a new connection,
+        since the device may have closed the idle connection. The response must be read before the next request.
+        :param method: the HTTP method, ie. "GET"
+        :param path: the path of the request, including any query string
+        :param body: optional request body
+        :param headers: optional dictionary of request headers
+        :return: the httplib.HTTPResponse
+        """
+        headers = dict(headers or {})
+        if self.username is not None and "Authorization" not in headers:
+            credentials = self.username + ":" + self.password
+            if isinstance(credentials, unicode):
+                credentials = credentials.encode("utf-8")
+            headers["Authorization"] = "Basic " + base64.b64encode(credentials)
+        while True:
+            # httplib drops the socket of a connection the device said it would close
+            if self.connection is None or self.connection.sock is None:
+                self.connect()
+            try:
+                self.connection.request(method, path, body, headers)
+                response = self.connection.getresponse()
+            except (httplib.HTTPException, socket.error), e:
+                reused = self.requests > 0
+                self.close()
+                if not reused:
+                    raise
+                logger.debug("Reconnecting to %s after %s", self.host, str(e))
+                continue
+            self.requests += 1
+            return response
+
+    def download(self, method, path, _file, body=None, headers=None):
+        """Sends a request and streams the body of a successful response into a file
+
+        :param method: the HTTP method, ie. "GET"
+        :param path: the path of the request, including any query string
+        :param _file: the file object the body is written to
+        :param body: optional request body
+        :param headers: optional dictionary of request headers
+        :return: the HTTP status of the response
+        :raises httplib.HTTPException: if the body ends before its Content-Length
+        """
+        response = self.request(method, path, body, headers)
+        if response.status != 200:
+            logger.error("%s %s on %s returned %s %s", method, path, self.host, response.status, response.reason)
+            response.read()
+            return response.status
+        while True:
+            chunk = response.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            _file.write(chunk)
+        # httplib ends a body the device cut short as if it were complete
+        if response.length:
+            self.close()
+            raise httplib.HTTPException("the response ended %s bytes early" % response.length)
+        return response.status
+
+    def close(self):
+        """Closes the connection
+
+        May be called from another thread to end a request waiting on the connection.
+        """
+        connection = self.connection
+        self.connection = None
+        if connection is None:
+            return
+        if connection.sock is not None:
+            # shutting the socket down wakes a read waiting on it, closing it alone doesn't
+            try:
+                connection.sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+        connection.close()
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+NetconfClient and MessageReader classes
+
+NETCONF over ssh, run on a subsystem channel of a device's existing ssh connection
+"""
+
+import socket
+import logging
+from xml.dom import minidom
+from xml.parsers.expat import ExpatError
+from xml.sax.saxutils import escape
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+SUBSYSTEM = "netconf"
+BASE_NS = "urn:ietf:params:xml:ns:netconf:base:1.0"
+BASE_10 = "urn:ietf:params:netconf:base:1.0"
+BASE_11 = "urn:ietf:params:netconf:base:1.1"
+EOM = "]]>]]>"              # end of message delimiter of the 1.0 framing
+CHUNK_END = "\n##\n"        # end of message marker of the 1.1 chunked framing
+MAX_CHUNK_HEADER = 13       # longest chunk header, ie. "\n#4294967295\n"
+RPC_ERROR = "rpc-error>"    # end of the rpc-error tag, with or without a namespace prefix
+READ_SIZE = 65536           # bytes read from the channel at once
+
+
+class NetconfError(Exception):
+    """A device broke the NETCONF protocol or returned an error"""
+    pass
+
+
+class MessageReader(object):
+    """Splits the data received from a device into NETCONF messages
+
+    Data is decoded as it arrives, so a message never has to be held whole.
+    :param chunked: boolean, 1 for the chunked framing of NETCONF 1.1, 0 for end of message delimiters
+    """
+
+    def __init__(self, chunked=0):
+        """Class constructor
+
+        :param chunked: boolean, 1 for the chunked framing of NETCONF 1.1, 0 for end of message delimiters
+        """
+        self.chunked = chunked
+        self.buffer = ""            # received data not yet decoded
+        self.remaining = 0          # bytes of the current chunk not yet decoded
+        self.complete = 0           # set once the end of the current message has been decoded
+
+    def start(self):
+        """Starts reading the next message
+
+        """
+        self.complete = 0
+
+    def feed(self, data):
+        """Decodes received data
+
+        Data received after the end of the message is kept for the next one.
+        :param data: the data received from the device
+        :return: the part of the message contained in the data
+        :raises NetconfError: if the chunked framing is broken
+        """
+        self.buffer += data
+        if self.chunked == 1:
+            return self.feed_chunked()
+        end = self.buffer.find(EOM)
+        if end >= 0:
+            message = self.buffer[:end]
+            self.buffer = self.buffer[end + len(EOM):]
+            self.complete = 1
+            return message
+        # the tail may be the start of the delimiter
+        keep = len(EOM) - 1
+        message = self.buffer[:-keep]
+        self.buffer = self.buffer[-keep:]
+        return message
+
+    def feed_chunked(self):
+        """Decodes the buffered data of a message in the chunked framing
+
+        :return: the part of the message decoded
+        :raises NetconfError: if the framing is broken
+        """
+        message = []
+        while self.complete == 0 and len(self.buffer) > 0:
+            if self.remaining > 0:
+                data = self.buffer[:self.remaining]
+                self.buffer = self.buffer[len(data):]
+                self.remaining -= len(data)
+                message.append(data)
+                continue
+            if self.buffer.startswith(CHUNK_END):
+                self.buffer = self.buffer[len(CHUNK_END):]
+                self.complete = 1
+                break
+            end = self.buffer.find("\n", 2)
+            if end < 0:
+                if len(self.buffer) > MAX_CHUNK_HEADER or not "\n#".startswith(self.buffer[:2]):
+                    raise NetconfError("invalid chunk header")
+                break
+            header = self.buffer[:end + 1]
+            if not header.startswith("\n#") or not header[2:-1].isdigit() or int(header[2:-1]) == 0:
+                raise NetconfError("invalid chunk header " + repr(header[:MAX_CHUNK_HEADER]))
+            self.remaining = int(header[2:-1])
+            self.buffer = self.buffer[end + 1:]
+        return "".join(message)
+
+
+class NetconfClient(object):
+    """A NETCONF session on a device's ssh connection
+
+    :param client: the connected sshclient.SSHClient
+    :param timeout: optional seconds each read waits for data
+    """
+
+    def __init__(self, client, timeout=None):
+        """Class constructor
+
+        :param client: the connected sshclient.SSHClient
+        :param timeout: optional seconds each read waits for data
+        """
+        self.client = client
+        self.timeout = timeout
+        self.channel = None
+        self.reader = MessageReader()
+        self.message_id = 0
+        self.cancelled = 0              # set by cancel(), which may run before the channel is open
+
+    def connect(self):
+        """Opens the netconf subsystem and exchanges hellos with the device
+
+        The chunked framing is used if both ends support NETCONF 1.1
+        :raises NetconfError: if the device's hello is invalid, or the session was cancelled
+        """
+        self.channel = self.client.invoke_subsystem(SUBSYSTEM)
+        if self.cancelled == 1:
+            self.channel.close()
+            raise NetconfError("session cancelled")
+        self.channel.settimeout(self.timeout)
+        self.send('<?xml version="1.0" encoding="UTF-8"?><hello xmlns="' + BASE_NS + '"><capabilities>'
+                  '<capability>' + BASE_10 + '</capability><capability>' + BASE_11 + '</capability>'
+                  '</capabilities></hello>')
+        hello = []
+        self.read(hello.append)
+        try:
+            document = minidom.parseString("".join(hello))
+        except ExpatError, e:
+            raise NetconfError("invalid hello: " + str(e))
+        capabilities = [node.firstChild.data.strip()
+                        for node in document.getElementsByTagNameNS(BASE_NS, "capability") if node.firstChild is not None]
+        if BASE_10 not in capabilities and BASE_11 not in capabilities:
+            raise NetconfError("no supported NETCONF version in hello")
+        if BASE_11 in capabilities:
+            self.reader.chunked = 1
+
+    def send(self, message):
+        """Sends a message in the session's framing
+
+        :param message: the message
+        """
+        if isinstance(message, unicode):
+            message = message.encode("utf-8")
+        if self.reader.chunked == 1:
+            message = "\n#" + str(len(message)) + "\n" + message + CHUNK_END
+        else:
+            message += EOM
+        self.channel.sendall(message)
+
+    def read(self, write):
+        """Reads a message
+
+        :param write: called with each part of the message as it is decoded
+        :raises NetconfError: if the device closes the session before the message ends
+        :raises socket.timeout: if no data arrives within the session's timeout
+        """
+        self.reader.start()
+        # data left over from the previous message may already hold this one
+        write(self.reader.feed(""))
+        while self.reader.complete == 0:
+            data = self.channel.recv(READ_SIZE)
+            if not data:
+                raise NetconfError("session closed by the device")
+            write(self.reader.feed(data))
+
+    def get_config(self, source, _file):
+        """Gets a configuration datastore and writes the reply to a file
+
+        :param source: the datastore, ie. "running"
+        :param _file: the file object the rpc-reply is written to
+        :return: 0/1 for fail/success, the reply of a failed rpc holds an rpc-error
+        """
+        self.message_id += 1
+        self.send('<?xml version="1.0" encoding="UTF-8"?><rpc message-id="' + str(self.message_id) +
+                  '" xmlns="' + BASE_NS + '"><get-config><source><' + escape(source) + '/></source>'
+                  '</get-config></rpc>')
+        # the reply is written as it arrives, keeping just enough of it to spot an error split between reads
+        state = {"tail": "", "error": 0}
+
+        def write(data):
+            _file.write(data)
+            window = state["tail"] + data
+            if RPC_ERROR in window:
+                state["error"] = 1
+            state["tail"] = window[-(len(RPC_ERROR) - 1):]
+
+        self.read(write)
+        if state["error"] == 1:
+            return 0
+        return 1
+
+    def cancel(self):
+        """Ends the NETCONF session without closing it cleanly, leaving the ssh connection open
+
+        May be called from another thread to end a read waiting on the channel.
+        """
+        self.cancelled = 1
+        channel = self.channel
+        if channel is not None:
+            channel.close()
+
+    def close(self):
+        """Closes the NETCONF session, leaving the ssh connection open
+
+        """
+        if self.channel is None:
+            return
+        try:
+            self.message_id += 1
+            self.send('<?xml version="1.0" encoding="UTF-8"?><rpc message-id="' + str(self.message_id) +
+                      '" xmlns="' + BASE_NS + '"><close-session/></rpc>')
+            self.read(lambda data: None)
+        except (NetconfError, socket.error), e:
+            logger.debug("Error closing the NETCONF session: %s", str(e))
+        self.channel.close()
+        self.channel = None
@@ -5,13 +5,16 @@ Netconfigit and NetworkDevice classes
 
 import os
 import sys
+import json
 import time
 import shutil
+import socket
 import logging
 import os.path
-import inspect
 import threading
+import multiprocessing
 import telnetlib
+from Queue import Empty
 from xml.dom import minidom
 from datetime import datetime
 
@@ -19,6 +22,14 @@ import paramiko
 from git import *
 
 import aescrypt
+import drivers
+import expect
+import eventloop
+import httpapi
+import netconf
+import reachability
+import sshclient
+import telnet
 import threadpool
 from modules import tftpy
 
@@ -26,6 +37,11 @@ from modules import tftpy
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+MAX_TFTP_BACKLOG = 50       # active tftp sessions above which fewer devices are run at once
+WATCHDOG_INTERVAL = 1       # seconds between the watchdog's checks for overdue actions
+RETRY_PRIORITY = 1          # queue priority of retries, which are only started once no first attempt can be
+PROBES_FILE = ".netconfigit_probes"     # change probe results of the archived configs, kept in the repository
+HTTP_ACCESS_TYPES = ("eapi", "semp", "rest")    # access types which use a device's HTTP management API
 
 class Netconfigit(object):
     """Contains configuration data and execution functions for archiving network device configs
@@ -54,10 +70,50 @@ class Netconfigit(object):
         self.device_count = 0               # the number of devices defined in the configuration file
         self.success_list = []              # the list of device actions that have succeeded
         self.failure_list = []                 # the list of device actions that have failed
+        self.unchanged_list = []            # the list of device actions skipped since the config is unchanged
+        self.failure_reasons = {}           # reasons for failed actions, keyed by (device name, action)
+        self.action_attempts = {}           # attempts made at each completed action, keyed by (device name, action)
+        self.results_lock = threading.Lock()    # guards the results and the actions in progress
+        self.actions_running = {}           # (device, action, deadline) of the action in progress, by device name
+        self.watchdog_thread = None         # thread cancelling actions which overrun the action timeout
+        self.watchdog_stopped = threading.Event()   # set at the end of the run to stop the watchdog
+        self.connect_timeout = 30           # seconds allowed to connect to a device
+        self.auth_timeout = 30              # seconds allowed to authenticate to a device
+        self.step_timeout = expect.STEP_TIMEOUT     # seconds allowed for each response from a device
+        self.action_timeout = 900           # seconds allowed for each action, including connecting
+        self.retries = 2                    # times a device's failed actions are retried
+        self.retry_backoff = 30             # seconds before the first retry, doubled for each further retry
+        self.sweep_timeout = reachability.SWEEP_TIMEOUT     # seconds allowed to reach each device before the run
+        self.change_probe = 0               # boolean, 1 skips archiving configs whose change probe is unchanged
+        self.probes = {}                    # change probe results of the archived configs, by device and action
+        self.new_probes = {}                # change probe results of the configs archived in this run
+        self.sweep_time = None              # seconds taken by the reachability sweep, None if it wasn't run
+        self.sweep_count = 0                # the number of devices probed by the reachability sweep
+        self.unreachable_count = 0          # the number of devices the reachability sweep found unreachable
         self.config = 0                     # the minidom XML configuration data structure
         self.config_devices = 0             # pointer to the device elements in the config minidom structure
         self.tftp_thread = 0                # thread pool for running the local tftp server
         self.device_threadpool = 0          # thread pool for running device actions
+        self.engine = "threads"             # how device actions are run - on the thread pool or an event loop
+        self.executor_threads = 8           # threads used by the event loop for blocking calls such as connecting
+        self.event_loop = None              # event loop for running device actions when the engine is "async"
+        self.min_devices = 5                # lowest number of devices the concurrency limit allows in progress
+        self.max_devices = 100              # highest number of devices the concurrency limit allows in progress
+        self.device_limit = None            # adaptive limit on the number of devices in progress
+        self.bulkheads = {}                 # limits on devices in progress per manufacturer and per site
+        self.device_queue = None            # devices waiting for their bulkheads to allow them to run
+        self.tftp_instance = None           # the local tftp server
+        self.known_hosts = None             # host keys shared by all ssh connections made during the run
+        self.drivers = None                 # registry of the manufacturer device classes
+        self.ssh_profiles = {}              # ssh transport profiles by name
+        self.manufacturer_profiles = {}     # ssh transport profiles used by default for each manufacturer
+        self.jump_hosts = {}                # jump hosts by name
+        self.site_jump_hosts = {}           # jump hosts used by default for the devices of each site
+        self.login_rate = None              # limit on the rate of new sessions to all devices
+        self.aaa_login_rates = {}           # limits on the rate of new sessions to the devices of each AAA group
+        self.processes = 1                  # number of worker processes the devices are split across
+        self.shard_processes = []           # worker processes each running the actions of a share of the devices
+        self.shard_results = None           # queue on which worker processes return their success and failure lists
         self.password = ""                  # decryption password
         self.verbose = 0                    # verbose logging flag
         self.logfile = "./Netconfigit.log"  # logfile relative path
@@ -88,9 +144,16 @@ class Netconfigit(object):
         self.config = minidom.parse(config_file)
         logging.info("\nUsing %s", config_file)
 
+        # load the known host keys once for all ssh connections, including those to jump hosts
+        self.known_hosts = sshclient.KnownHosts()
+
         # check and load options from XML
         self.options = self.load_options()
 
+        # load the change probe results of the configs already archived
+        if self.change_probe == 1:
+            self.load_probes()
+
         # check existence of devices in configuration
         if self.config.getElementsByTagName('device'):
             self.config_devices = self.config.getElementsByTagName('device')
@@ -98,6 +161,9 @@ class Netconfigit(object):
             print "\nNo devices specified - quitting"
             exit(1)
 
+        # load the manufacturer device classes once, so devices of unknown manufacturers are rejected here
+        self.drivers = drivers.DriverRegistry()
+
         # load devices from XML configuration into device_list
         load_err = self.load_devices_xml()
 
@@ -119,28 +185,203 @@ class Netconfigit(object):
         self.tftp_thread.add_task(self.tftp_server)
 
         # initialize the thread pool used by device actions
-        logger.info("Creating %s device threads", 20)
-        self.device_threadpool = threadpool.ThreadPool(20)
+        # when the devices are split across worker processes each process creates its own
+        if self.processes == 1:
+            self.create_device_pool()
+
+    def create_device_pool(self):
+        """Creates the thread pool used by device actions
+
+        With the async engine a single thread runs the event loop which drives all devices
+        The number of devices in progress adapts to connect latency, connect errors and the tftp backlog
+        Starts the watchdog which cancels overdue actions
+        """
+        logger.info("Running between %s and %s devices at once", self.min_devices, self.max_devices)
+        self.device_limit = threadpool.AdaptiveLimit(self.min_devices, self.max_devices,
+                                                     backlog=self.tftp_backlog, max_backlog=MAX_TFTP_BACKLOG)
+        self.watchdog_thread = threading.Thread(target=self.watchdog)
+        self.watchdog_thread.daemon = True
+        self.watchdog_thread.start()
+        if self.engine == "async":
+            logger.info("Creating event loop with %s executor threads", self.executor_threads)
+            self.event_loop = eventloop.EventLoop(self.executor_threads, self.device_limit, self.bulkheads)
+            self.device_threadpool = threadpool.ThreadPool(1)
+        else:
+            logger.info("Creating %s device threads", self.max_devices)
+            self.device_queue = threadpool.BulkheadQueue(self.bulkheads)
+            self.device_threadpool = threadpool.ThreadPool(self.max_devices)
 
     def run_nc(self):
         """Runs the jobs associated with each device
 
+        Sweeps the devices for reachability first, unless the sweep is turned off.
+        Runs the devices on the device thread pool, or splits them across worker processes.
+        """
+        if self.sweep_timeout > 0:
+            self.device_list = self.sweep_devices()
+        if self.processes > 1:
+            self.run_shards()
+        else:
+            self.run_devices()
+
+    def sweep_devices(self):
+        """Checks that the enabled devices accept connections on their access ports
+
+        All devices are probed at once, before any device takes a place in the pool.
+        Devices reached through a jump host aren't probed. Unreachable devices have their actions recorded as failed.
+        :return: list of the devices to run
+        """
+        probed = [device for device in self.device_list if device.enabled != "0" and device.jump is None]
+        started = time.time()
+        results = reachability.ReachabilitySweep(self.sweep_timeout).run(
+            [(device.ip, self.device_port(device)) for device in probed])
+        self.sweep_time = time.time() - started
+        self.sweep_count = len(probed)
+
+        unreachable = [device for device in probed if results[(device.ip, self.device_port(device))] is None]
+        self.unreachable_count = len(unreachable)
+        logger.info("Swept %s devices in %.2f seconds, %s unreachable", self.sweep_count, self.sweep_time,
+                    self.unreachable_count)
+        with self.results_lock:
+            for device in unreachable:
+                logger.error("%s is unreachable at %s:%s", device.name, device.ip, self.device_port(device))
+                for action in device.actions:
+                    self.failure_list.append({device.name: action})
+                    self.failure_reasons[(device.name, action)] = "unreachable"
+        unreachable = set(unreachable)
+        return [device for device in self.device_list if device not in unreachable]
+
+    @staticmethod
+    def device_port(_device):
+        """Returns the port a device is accessed on
+
+        :param _device: the device
+        :return: the port number, the access type's usual port if the device doesn't specify one
+        """
+        if _device.port != "NULL":
+            return int(_device.port)
+        if _device.access_type == "telnet":
+            return 23
+        if _device.access_type in HTTP_ACCESS_TYPES:
+            if _device.scheme == "http":
+                return 80
+            return 443
+        return 22
+
+    def run_devices(self):
+        """Runs the jobs associated with each device in this process
+
         Creates a new threaded task for each device.
+        With the async engine each device is a task on the event loop, which is run on the device thread pool.
         """
+        if self.engine == "async":
+            for device in self.device_list:
+                self.event_loop.spawn(self.process_actions_async(device), self.device_groups(device))
+            self.device_threadpool.add_task(self.event_loop.run)
+            return
+
         # process each device in its own threaded task
+        # the task runs whichever waiting device its bulkheads allow, rather than a fixed device
         for device in self.device_list:
-            self.device_threadpool.add_task(self.process_actions, device)
+            self.device_queue.put(device, self.device_groups(device))
+            self.device_threadpool.add_task(self.process_device)
+
+    def run_shards(self):
+        """Splits the devices across worker processes
+
+        Devices are dealt out in turn so each process gets a similar mix of devices.
+        The local tftp server keeps running in this process.
+        """
+        logger.info("Creating %s worker processes", self.processes)
+        self.shard_results = multiprocessing.Queue()
+        for shard in range(self.processes):
+            shard_devices = self.device_list[shard::self.processes]
+            process = multiprocessing.Process(target=self.run_shard, args=(shard_devices,))
+            process.start()
+            self.shard_processes.append(process)
+
+    def run_shard(self, _devices):
+        """Runs the jobs associated with a share of the devices in a worker process
+
+        Creates the process' own device thread pool and waits for it to finish.
+        Returns the process' success and failure lists to the parent process.
+        :param _devices: the devices run by this process
+        """
+        self.device_list = _devices
+        # the tftp server runs in the parent process so its backlog can't be seen from here
+        self.tftp_instance = None
+        # results recorded before the fork, ie. by the reachability sweep, are already in the parent's lists
+        self.success_list = []
+        self.failure_list = []
+        self.unchanged_list = []
+        self.failure_reasons = {}
+        self.action_attempts = {}
+        self.new_probes = {}
+        # each process is allowed its share of the login rates
+        for rate in self.login_rates():
+            rate.rate /= self.processes
+            rate.burst = max(1, rate.burst / self.processes)
+            rate.tokens = rate.burst
+        try:
+            self.create_device_pool()
+            self.run_devices()
+            self.device_threadpool.wait_completion()
+        finally:
+            self.stop_watchdog()
+            self.close_jump_hosts()
+            self.shard_results.put((self.success_list, self.failure_list, self.failure_reasons,
+                                    self.action_attempts, self.known_hosts.learned,
+                                    [rate.stats() for rate in self.login_rates()], self.unchanged_list,
+                                    self.new_probes))
+
+    def join_shards(self):
+        """Waits for all worker processes to finish
+
+        Merges the success, failure and unchanged lists, failure reasons, attempts, host keys learned,
+        login rate waits and change probe results returned by each process.
+        """
+        collected = 0
+        while collected < len(self.shard_processes):
+            try:
+                success_list, failure_list, failure_reasons, action_attempts, learned, login_waits, \
+                    unchanged_list, new_probes = self.shard_results.get(timeout=5)
+            except Empty:
+                # stop waiting if a worker process died without returning its results
+                if not any(process.is_alive() for process in self.shard_processes):
+                    logger.error("%s worker processes exited without returning results",
+                                 len(self.shard_processes) - collected)
+                    break
+                continue
+            self.success_list.extend(success_list)
+            self.failure_list.extend(failure_list)
+            self.failure_reasons.update(failure_reasons)
+            self.action_attempts.update(action_attempts)
+            self.known_hosts.merge(learned)
+            for rate, stats in zip(self.login_rates(), login_waits):
+                rate.merge(stats)
+            self.unchanged_list.extend(unchanged_list)
+            self.new_probes.update(new_probes)
+            collected += 1
+        for process in self.shard_processes:
+            process.join()
 
     def stop_nc(self):
         """Cleans up after the running of all device actions
 
         Waits until all device threads are finished.
-        Copies the configs from the temporary location into the repo location.
+        Saves the host keys learned during the run.
+        Copies the configs from the temporary location into the repo location and saves their change probe results.
         Removes the temporary folder structure.
         """
-        # wait until all worker threads are finished
-        self.device_threadpool.wait_completion()
+        # wait until all worker threads, or worker processes, are finished
+        if self.processes > 1:
+            self.join_shards()
+        else:
+            self.device_threadpool.wait_completion()
+            self.stop_watchdog()
+            self.close_jump_hosts()
         self.tftp_thread.tasks.empty()
+        self.known_hosts.save()
 
         # count downloaded files
         # TODO: count downloaded files
@@ -157,6 +398,9 @@ class Netconfigit(object):
                     os.remove(dst_file)
                 shutil.move(src_file, dst_dir)
 
+        if self.change_probe == 1:
+            self.save_probes()
+
         # delete the temporary directory structure
         try:
             shutil.rmtree(self.tempdir)
@@ -179,6 +423,21 @@ class Netconfigit(object):
             print "Elapsed time: " + str(running_time)
             results.write("Elapsed Time: " + str(running_time) + "\n\n")
 
+            # time taken to sweep the devices for reachability
+            if self.sweep_time is not None:
+                sweep = "Reachability sweep: %s devices in %.2f seconds, %s unreachable" % \
+                        (self.sweep_count, self.sweep_time, self.unreachable_count)
+                print sweep
+                results.write(sweep + "\n\n")
+
+            # time sessions waited on the login rate limits
+            for rate in self.login_rates():
+                count, waited, total_wait, max_wait = rate.stats()
+                login_waits = "Login rate for %s: %s logins, %s waited, %.1f seconds in total, longest %.1f seconds" \
+                              % (rate.name, count, waited, total_wait, max_wait)
+                print login_waits
+                results.write(login_waits + "\n")
+
             # completed actions
             print "\nCompleted:"
             results.write("Completed:\n")
@@ -188,9 +447,25 @@ class Netconfigit(object):
             else:
                 for success in self.success_list:
                     for success_device, success_action in success.items():
+                        attempts = self.action_attempts.get((success_device, success_action), 1)
+                        if attempts > 1:
+                            success_action += " (" + str(attempts) + " attempts)"
                         print "\t" + success_device + " - " + success_action
                         results.write("\t" + success_device + " - " + success_action + "\n")
 
+            # actions skipped since the config is unchanged
+            if self.change_probe == 1:
+                print "\nUnchanged:"
+                results.write("\nUnchanged:\n")
+                if len(self.unchanged_list) == 0:
+                    print "\tNONE"
+                    results.write("\tNONE\n")
+                else:
+                    for unchanged in self.unchanged_list:
+                        for unchanged_device, unchanged_action in unchanged.items():
+                            print "\t" + unchanged_device + " - " + unchanged_action
+                            results.write("\t" + unchanged_device + " - " + unchanged_action + "\n")
+
             # failed actions
             print "\nFailed:"
             results.write("\nFailed:\n")
@@ -200,6 +475,15 @@ class Netconfigit(object):
             else:
                 for failure in self.failure_list:
                     for failure_device, failure_action in failure.items():
+                        notes = []
+                        attempts = self.action_attempts.get((failure_device, failure_action), 1)
+                        if attempts > 1:
+                            notes.append(str(attempts) + " attempts")
+                        reason = self.failure_reasons.get((failure_device, failure_action))
+                        if reason is not None:
+                            notes.append(reason)
+                        if len(notes) > 0:
+                            failure_action += " (" + ", ".join(notes) + ")"
                         print "\t" + failure_device + " - " + failure_action
                         results.write("\t" + failure_device + " - " + failure_action + "\n")
 
@@ -220,6 +504,120 @@ class Netconfigit(object):
         self.repo_path = self.get_element_attribute(self.config, "repository", "path")
         self.tftp_port = self.get_element_attribute(self.config, "transfer", "tftp_port")
         self.tftp_root = self.get_element_attribute(self.config, "transfer", "tftp_root")
+        engine = self.get_element_attribute(self.config, "options", "engine")
+        executor_threads = self.get_element_attribute(self.config, "options", "executor_threads")
+        processes = self.get_element_attribute(self.config, "options", "processes")
+        min_devices = self.get_element_attribute(self.config, "options", "min_devices")
+        max_devices = self.get_element_attribute(self.config, "options", "max_devices")
+        timeouts = {}
+        for timeout in ("connect_timeout", "auth_timeout", "step_timeout", "action_timeout"):
+            timeouts[timeout] = self.get_element_attribute(self.config, "options", timeout)
+        retries = self.get_element_attribute(self.config, "options", "retries")
+        sweep_timeout = self.get_element_attribute(self.config, "options", "sweep_timeout")
+        change_probe = self.get_element_attribute(self.config, "options", "change_probe")
+        retry_backoff = self.get_element_attribute(self.config, "options", "retry_backoff")
+
+        # check the engine used to run device actions
+        if engine != "NULL":
+            if engine != "threads" and engine != "async":
+                print "Engine must be threads or async."
+                exit(1)
+            self.engine = engine
+        if executor_threads != "NULL":
+            if not executor_threads.isdigit() or int(executor_threads) < 1:
+                print "Executor threads must be a positive number."
+                exit(1)
+            self.executor_threads = int(executor_threads)
+        if processes != "NULL":
+            if not processes.isdigit() or int(processes) < 1:
+                print "Processes must be a positive number."
+                exit(1)
+            self.processes = int(processes)
+
+        # check the floor and ceiling of the number of devices run at once
+        if min_devices != "NULL":
+            if not min_devices.isdigit() or int(min_devices) < 1:
+                print "Minimum devices must be a positive number."
+                exit(1)
+            self.min_devices = int(min_devices)
+        if max_devices != "NULL":
+            if not max_devices.isdigit() or int(max_devices) < 1:
+                print "Maximum devices must be a positive number."
+                exit(1)
+            self.max_devices = int(max_devices)
+        if self.min_devices > self.max_devices:
+            print "Minimum devices must not be greater than maximum devices."
+            exit(1)
+
+        # check the timeouts for connecting, authenticating, each response and each action
+        for timeout, value in timeouts.items():
+            if value != "NULL":
+                if not value.isdigit() or int(value) < 1:
+                    print timeout.replace("_", " ").capitalize() + " must be a positive number of seconds."
+                    exit(1)
+                setattr(self, timeout, int(value))
+
+        # check the number of retries of failed actions and the wait before the first one
+        if retries != "NULL":
+            if not retries.isdigit():
+                print "Retries must be zero or a positive number."
+                exit(1)
+            self.retries = int(retries)
+        if retry_backoff != "NULL":
+            if not retry_backoff.isdigit():
+                print "Retry backoff must be zero or a positive number of seconds."
+                exit(1)
+            self.retry_backoff = int(retry_backoff)
+
+        # check the time allowed to reach each device before the run, 0 turns the sweep off
+        if sweep_timeout != "NULL":
+            if not sweep_timeout.isdigit():
+                print "Sweep timeout must be zero or a positive number of seconds."
+                exit(1)
+            self.sweep_timeout = int(sweep_timeout)
+
+        # check whether configs are only archived when their change probe shows a change
+        if change_probe != "NULL":
+            if change_probe != "yes" and change_probe != "no":
+                print "Change probe must be yes or no."
+                exit(1)
+            self.change_probe = int(change_probe == "yes")
+
+        # read the bulkheads limiting the devices in progress per manufacturer and per site
+        for limit in self.config.getElementsByTagName('limit'):
+            max_devices = limit.getAttribute('max_devices')
+            if not max_devices.isdigit() or int(max_devices) < 1:
+                print "Limit max_devices must be a positive number."
+                exit(1)
+            if limit.hasAttribute('manufacturer'):
+                self.bulkheads["manufacturer:" + limit.getAttribute('manufacturer').lower()] = int(max_devices)
+            elif limit.hasAttribute('site'):
+                self.bulkheads["site:" + limit.getAttribute('site')] = int(max_devices)
+            else:
+                print "Limit must specify a manufacturer or a site."
+                exit(1)
+
+        # read the ssh transport profiles
+        for config_profile in self.config.getElementsByTagName('ssh_profile'):
+            profile = self.load_ssh_profile(config_profile)
+            self.ssh_profiles[profile.name] = profile
+            if config_profile.hasAttribute('manufacturer'):
+                self.manufacturer_profiles[config_profile.getAttribute('manufacturer').lower()] = profile
+
+        # read the limits on the rate of new sessions, to all devices and to the devices of each AAA group
+        for config_rate in self.config.getElementsByTagName('login_rate'):
+            if config_rate.hasAttribute('aaa_group'):
+                aaa_group = config_rate.getAttribute('aaa_group')
+                self.aaa_login_rates[aaa_group] = self.load_login_rate(config_rate, "AAA group " + aaa_group)
+            else:
+                self.login_rate = self.load_login_rate(config_rate, "all devices")
+
+        # read the jump hosts devices are reached through
+        for config_jump in self.config.getElementsByTagName('jump'):
+            jump = self.load_jump_host(config_jump)
+            self.jump_hosts[jump.name] = jump
+            if config_jump.hasAttribute('site'):
+                self.site_jump_hosts[config_jump.getAttribute('site')] = jump
 
         # check for existence of repo path and assign it as the tftp server's root
         if self.repo_path != "NULL":
@@ -266,12 +664,145 @@ class Netconfigit(object):
 
         return err
 
+    @staticmethod
+    def load_ssh_profile(config_profile):
+        """Loads an ssh transport profile from its XML element
+
+        :param config_profile: the ssh_profile element
+        :return: the SSHProfile
+        """
+        name = config_profile.getAttribute('name')
+        if name == "":
+            print "SSH profile must have a name."
+            exit(1)
+
+        profile = sshclient.SSHProfile(name)
+        if config_profile.hasAttribute('kex'):
+            profile.kex = config_profile.getAttribute('kex').split(",")
+        if config_profile.hasAttribute('ciphers'):
+            profile.ciphers = config_profile.getAttribute('ciphers').split(",")
+        if config_profile.hasAttribute('macs'):
+            profile.macs = config_profile.getAttribute('macs').split(",")
+        unsupported = profile.unsupported()
+        if len(unsupported) > 0:
+            print "SSH profile " + name + " uses unsupported algorithms: " + ", ".join(unsupported)
+            exit(1)
+
+        compression = config_profile.getAttribute('compression')
+        if compression == "yes":
+            profile.compression = 1
+        elif compression != "" and compression != "no":
+            print "SSH profile compression must be yes or no."
+            exit(1)
+        for attribute in ('window_size', 'packet_size'):
+            if config_profile.hasAttribute(attribute):
+                size = config_profile.getAttribute(attribute)
+                if not size.isdigit() or int(size) < 1:
+                    print "SSH profile " + attribute + " must be a positive number."
+                    exit(1)
+                setattr(profile, attribute, int(size))
+        return profile
+
+    @staticmethod
+    def load_login_rate(config_rate, name):
+        """Loads a limit on the rate of new sessions from its XML element
+
+        :param config_rate: the login_rate element
+        :param name: the name the limit is reported as
+        :return: the threadpool.TokenBucket
+        """
+        try:
+            rate = float(config_rate.getAttribute('rate'))
+        except ValueError:
+            rate = 0
+        if rate <= 0:
+            print "Login rate must be a positive number of logins per second."
+            exit(1)
+        burst = "1"
+        if config_rate.hasAttribute('burst'):
+            burst = config_rate.getAttribute('burst')
+        if not burst.isdigit() or int(burst) < 1:
+            print "Login rate burst must be a positive number."
+            exit(1)
+        return threadpool.TokenBucket(name, rate, int(burst))
+
+    def login_rates(self):
+        """Returns the limits on the rate of new sessions
+
+        :return: list of threadpool.TokenBucket
+        """
+        rates = [self.aaa_login_rates[aaa_group] for aaa_group in sorted(self.aaa_login_rates.keys())]
+        if self.login_rate is not None:
+            rates.insert(0, self.login_rate)
+        return rates
+
+    def wait_for_login(self, _device):
+        """Waits until the login rate limits allow a new session to a device
+
+        A token is reserved from the limit on all devices and from the limit of the device's AAA group,
+        and the session waits for whichever is available last
+        :param _device: the device
+        """
+        rates = []
+        if self.login_rate is not None:
+            rates.append(self.login_rate)
+        if _device.aaa_group != "NULL":
+            rates.append(self.aaa_login_rates[_device.aaa_group])
+        if len(rates) == 0:
+            return
+        wait = max([rate.reserve() for rate in rates])
+        if wait > 0:
+            logger.debug("Waiting %.2f seconds to log in to %s", wait, _device.name)
+            time.sleep(wait)
+
+    def load_jump_host(self, config_jump):
+        """Loads a jump host from its XML element
+
+        Decrypts the jump host's password
+        :param config_jump: the jump element
+        :return: the sshclient.JumpHost
+        """
+        name = config_jump.getAttribute('name')
+        if name == "":
+            print "Jump host must have a name."
+            exit(1)
+        ip = config_jump.getAttribute('ip')
+        username = config_jump.getAttribute('username')
+        password = config_jump.getAttribute('password')
+        if ip == "" or username == "" or password == "":
+            print "Jump host " + name + " must specify an ip, username and password."
+            exit(1)
+
+        jump = sshclient.JumpHost(name, self.known_hosts, ip, username=username, password=password)
+        for attribute in ('port', 'max_channels'):
+            if config_jump.hasAttribute(attribute):
+                value = config_jump.getAttribute(attribute)
+                if not value.isdigit() or int(value) < 1:
+                    print "Jump host " + attribute + " must be a positive number."
+                    exit(1)
+                setattr(jump, attribute, int(value))
+        if config_jump.hasAttribute('ssh_profile'):
+            jump.profile = self.ssh_profiles.get(config_jump.getAttribute('ssh_profile'))
+            if jump.profile is None:
+                print "SSH profile " + config_jump.getAttribute('ssh_profile') + " is not defined for jump host " + name
+                exit(1)
+
+        # decrypt the jump host password
+        if self.plaintext_passwords != "true":
+            if len(jump.password) != 24:
+                print "Encrypted passwords must be a multiple of 16 bytes in length."
+                exit(1)
+            else:
+                jump.password = self.password.decode(jump.password)
+        return jump
+
     def tftp_server(self):
         """Creates and starts a local tftp server
 
         Creates a TftpServer object and starts it bound to the IP and port of the calling object
         """
         server = tftpy.TftpServer(self.tempdir)
+        self.tftp_instance = server
         try:
             logger.info("Starting tftp server on %s:%s with root %s",
                         self.transfer_ip, int(self.tftp_port), self.tempdir)
@@ -284,6 +815,15 @@ class Netconfigit(object):
         except KeyboardInterrupt:
             pass
 
+    def tftp_backlog(self):
+        """Returns the number of transfers in progress on the local tftp server
+
+        :return: the number of active tftp sessions
+        """
+        if self.tftp_instance is None:
+            return 0
+        return len(self.tftp_instance.sessions)
+
     @staticmethod
     def get_element_attribute(parent_element, element, attribute):
         """Reads and returns the value of an XML attribute under a given parent node
@@ -352,6 +892,8 @@ class Netconfigit(object):
             # populate member variables from XML
             device.type = config_device.attributes['type'].value
             device.manufacturer = config_device.attributes['manufacturer'].value
+            if config_device.hasAttribute('site'):
+                device.site = config_device.attributes['site'].value
             device.ip = self.get_element_attribute(config_device, "access", "ip")
             device.hostname = self.get_element_attribute(config_device, "access", "hostname")
             device.access_type = self.get_element_attribute(config_device, "access", "type")
@@ -359,6 +901,12 @@ class Netconfigit(object):
             device.login_user = self.get_element_attribute(config_device, "access", "username")
             device.login_pass = self.get_element_attribute(config_device, "access", "password")
             device.enable_password = self.get_element_attribute(config_device, "access", "enable")
+            device.capture = self.get_element_attribute(config_device, "access", "capture")
+            scheme = self.get_element_attribute(config_device, "access", "scheme")
+            verify = self.get_element_attribute(config_device, "access", "verify")
+            ssh_profile = self.get_element_attribute(config_device, "access", "ssh_profile")
+            jump = self.get_element_attribute(config_device, "access", "jump")
+            device.aaa_group = self.get_element_attribute(config_device, "access", "aaa_group")
             device.actions = self.get_all_element_attribute_values(config_device, "action", "type")
 
             # decrypt passwords
@@ -375,18 +923,67 @@ class Netconfigit(object):
                 elif len(device.enable_password) == 24:
                     device.enable_password = self.password.decode(device.enable_password)
 
+            # configs are transferred by the device unless captured in-band over the session
+            if device.capture == "NULL":
+                device.capture = "transfer"
+
+            # the device's own ssh profile overrides its manufacturer's
+            if ssh_profile != "NULL":
+                device.ssh_profile = self.ssh_profiles.get(ssh_profile)
+            else:
+                device.ssh_profile = self.manufacturer_profiles.get(device.manufacturer.lower())
+
+            # management APIs are reached over https unless the device says otherwise
+            if scheme != "NULL":
+                device.scheme = scheme
+            device.verify = int(verify != "no")
+
+            # the device's own jump host overrides its site's
+            if jump != "NULL":
+                device.jump = self.jump_hosts.get(jump)
+            else:
+                device.jump = self.site_jump_hosts.get(device.site)
+
             # check for errors in config
             if device.manufacturer == "NULL":
                 logger.warning("Must specify device manufacturer for device %s", str(device.name))
                 err = "Must specify device manufacturer for device " + str(device.name)
+                continue
+            if not self.drivers.supports(device.manufacturer):
+                logger.warning("Device manufacturer %s not implemented for device %s", device.manufacturer,
+                               str(device.name))
+                err = "Device manufacturer " + device.manufacturer + " not implemented for device " + str(device.name)
+                continue
             if device.ip == "NULL":
                 logger.warning("Must specify either an IP address or hostname for device %s", str(device.name))
                 err = "Must specify either an IP address or hostname for device " + str(device.name)
                 continue
-            if device.login_user == "NULL" or device.login_pass == "NULL":
+            # the REST API authenticates with the token given as the password alone
+            if (device.login_user == "NULL" and device.access_type != "rest") or device.login_pass == "NULL":
                 logger.warning("Must supply username and password for device %s", str(device.name))
                 err = "Must supply username and password for device " + str(device.name)
                 continue
+            if device.capture != "transfer" and device.capture != "inband":
+                logger.warning("Capture method must be transfer or inband for device %s", str(device.name))
+                err = "Capture method must be transfer or inband for device " + str(device.name)
+                continue
+            if ssh_profile != "NULL" and device.ssh_profile is None:
+                logger.warning("SSH profile %s is not defined for device %s", ssh_profile, str(device.name))
+                err = "SSH profile " + ssh_profile + " is not defined for device " + str(device.name)
+                continue
+            if device.scheme != "https" and device.scheme != "http":
+                logger.warning("Scheme must be https or http for device %s", str(device.name))
+                err = "Scheme must be https or http for device " + str(device.name)
+                continue
+            if jump != "NULL" and device.jump is None:
+                logger.warning("Jump host %s is not defined for device %s", jump, str(device.name))
+                err = "Jump host " + jump + " is not defined for device " + str(device.name)
+                continue
+            if device.aaa_group != "NULL" and device.aaa_group not in self.aaa_login_rates:
+                logger.warning("Login rate is not defined for AAA group %s of device %s", device.aaa_group,
+                               str(device.name))
+                err = "Login rate is not defined for AAA group " + device.aaa_group + " of device " + str(device.name)
+                continue
 
             # add the device to the list of devices
             self.device_list.append(device)
@@ -435,81 +1032,622 @@ class Netconfigit(object):
         """
         err = 0
         # create an ssh connection to the local machine
-        client = paramiko.SSHClient()
-        client.get_transport()
-        client.load_system_host_keys()
-        client.set_missing_host_key_policy(paramiko.WarningPolicy())
-        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        client.connect(self.transfer_ip, self.ssh_port, username=self.scp_username, password=self.scp_password)
+        client = sshclient.SSHClient(self.known_hosts)
+        client.connect(self.transfer_ip, int(self.ssh_port), username=self.scp_username, password=self.scp_password)
         chown_command = "chown " + self.scp_chown + ":" + self.scp_chown + " " \
             + self.repo_path + "/" + _device.name + "/" + _file
         logger.info("chown %s with %s", _device.name, self.scp_chown)
         try:
             #issue the chown command
-            client.exec_command(chown_command)
+            client.exec_command(chown_command).recv_exit_status()
         except:
             logger.error("Could not chown %s with %s", _device.name, self.scp_chown)
+        client.close()
         return err
 
-    @staticmethod
-    def get_ssh_client_channel(_device):
+    def get_ssh_client_channel(self, _device):
         """Creates an SSH session to a device
 
-        Creates an SSHClient object and initiates the connection
+        Creates an SSHClient object using the shared host keys and initiates the connection
+        with the device's ssh transport profile, through the device's jump host if it has one
+        Waits for the login rate limits first
+        Records the time taken to connect, or the failure, with the device concurrency limit
         :param _device: the device
         :return: client, channel: the client session and ssh channel
         """
-        client = paramiko.SSHClient()
-        client.get_transport()
-        client.load_system_host_keys()
-        client.set_missing_host_key_policy(paramiko.WarningPolicy())
-        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        client.connect(_device.ip, port=int(_device.port), username=_device.login_user,
-                       password=_device.login_pass, look_for_keys=False)
+        self.wait_for_login(_device)
+        client = sshclient.SSHClient(self.known_hosts)
+        started = time.time()
+        try:
+            client.connect(_device.ip, port=self.device_port(_device), username=_device.login_user,
+                           password=_device.login_pass, profile=_device.ssh_profile,
+                           timeout=self.connect_timeout, auth_timeout=self.auth_timeout, jump=_device.jump)
+        except:
+            self.device_limit.record(time.time() - started, 1)
+            raise
+        self.device_limit.record(time.time() - started, 0)
         channel = client.invoke_shell()
         return client, channel
 
+    def get_telnet_client_channel(self, _device):
+        """Creates a telnet session to a device
+
+        Creates a TelnetClient object and initiates the connection, through the device's jump host if it has one
+        Waits for the login rate limits first
+        Records the time taken to connect, or the failure, with the device concurrency limit
+        :param _device: the device
+        :return: client, channel: the client session and telnet channel
+        """
+        self.wait_for_login(_device)
+        client = telnet.TelnetClient()
+        started = time.time()
+        try:
+            client.connect(_device.ip, self.device_port(_device), self.connect_timeout, jump=_device.jump, auth_timeout=self.auth_timeout)
+        except:
+            self.device_limit.record(time.time() - started, 1)
+            raise
+        self.device_limit.record(time.time() - started, 0)
+        return client, client.invoke_shell()
+
+    def close_jump_hosts(self):
+        """Closes the connections to the jump hosts once all devices are done
+
+        """
+        for jump in self.jump_hosts.values():
+            jump.close()
+
+    def get_client_channel(self, _device):
+        """Creates a session to a device using the device's access method
+
+        :param _device: the device
+        :return: client, channel: the client session and channel
+        """
+        if _device.access_type == "telnet":
+            return self.get_telnet_client_channel(_device)
+        return self.get_ssh_client_channel(_device)
+
+    @staticmethod
+    def login_dialog(_device, prompt, command=None, newline="\n"):
+        """Defines the first dialog run after connecting to a device
+
+        Telnet sessions answer the device's login prompts, ssh sessions are already authenticated
+        :param _device: the device
+        :param prompt: compiled regex matching the device's prompt
+        :param command: optional text a telnet session sends as soon as it opens, ie. a terminal type
+        :param newline: the line ending a telnet session sends after the username and password
+        :return: the dialog which waits for the device's first prompt
+        """
+        if _device.access_type == "telnet":
+            return expect.LoginDialog(prompt, _device.login_user, _device.login_pass, command=command,
+                                      newline=newline)
+        return expect.Dialog(None, prompt)
+
+    def get_session(self, _device, login_dialogs):
+        """Returns the open SSH or telnet session to a device
+
+        Reuses the device's session while it is alive, otherwise connects and runs the login dialogs.
+        A new session is closed if its login fails or raises.
+        :param _device: the device
+        :param login_dialogs: callable returning the dialogs run once after connecting (ie. enable)
+        :return: session: the session, or None if the login dialogs failed
+        """
+        if _device.session is not None:
+            if _device.session.active() == 1:
+                _device.session.deadline = self.action_deadline(_device)
+                return _device.session
+            logger.warning("Session to %s was lost - reconnecting", _device.name)
+            self.close_session(_device)
+
+        client, channel = self.get_client_channel(_device)
+        session = self.create_session(_device, client, channel)
+        try:
+            for dialog in login_dialogs():
+                if session.run(dialog) == 0:
+                    logger.error("Login to %s failed", _device.name)
+                    session.close()
+                    return None
+        except:
+            session.close()
+            raise
+        _device.session = session
+        return session
+
+    def create_session(self, _device, client, channel):
+        """Creates the session over a new connection to a device
+
+        Each response is allowed the step timeout, cut short by the deadline of the device's action.
+        The client is closed if the session can't be created.
+        :param _device: the device
+        :param client: the ssh or telnet client
+        :param channel: the channel connected to the device
+        :return: the session
+        """
+        try:
+            transcript = self.open_transcript(_device)
+        except:
+            client.close()
+            raise
+        session = expect.Session(client, channel, transcript)
+        session.step_timeout = self.step_timeout
+        session.deadline = self.action_deadline(_device)
+        return session
+
+    def open_transcript(self, _device):
+        """Opens the file a device's session is recorded to when running verbose
+
+        Transcripts are kept next to the log file, ie. Netconfigit_router1.log
+        :param _device: the device
+        :return: the file object, or None if not running verbose
+        """
+        if self.verbose != 1:
+            return None
+        return open(os.path.splitext(self.logfile)[0] + "_" + _device.name + ".log", "a")
+
+    def get_http_client(self, _device):
+        """Returns the connection to a device's HTTP management API
+
+        The connection is kept open and shared by all of the device's actions
+        :param _device: the device
+        :return: the httpapi.HTTPClient
+        """
+        if _device.http_client is None:
+            self.wait_for_login(_device)
+            # a device without a username authenticates its requests itself, ie. with a REST API token
+            username = _device.login_user
+            if username == "NULL":
+                username = None
+            _device.http_client = httpapi.HTTPClient(_device.ip, self.device_port(_device), _device.scheme,
+                                                     username, _device.login_pass, _device.verify,
+                                                     self.connect_timeout, self.step_timeout)
+        return _device.http_client
+
+    def netconf_get_config(self, _device, source, _file):
+        """Gets a configuration datastore over NETCONF and archives the reply
+
+        The netconf subsystem is opened on the ssh connection of the device's session, which must be open.
+        The reply is streamed into the repository and only replaces the archived one if the rpc succeeded.
+        :param _device: the device
+        :param source: the datastore, ie. "running"
+        :param _file: the filename the reply is archived as
+        :return: 0/1 for fail/success
+        """
+        if _device.access_type != "ssh":
+            logger.error("NETCONF needs ssh access to %s", _device.name)
+            return 0
+        path = self.archive_path(_device, _file)
+        status = 0
+        client = netconf.NetconfClient(_device.session.client, self.step_timeout)
+        # the watchdog cancels the NETCONF session of an overdue action
+        _device.netconf_client = client
+        try:
+            client.connect()
+            with open(path + ".part", "w") as part:
+                status = client.get_config(source, part)
+            client.close()
+            if status == 1:
+                os.rename(path + ".part", path)
+            else:
+                logger.error("NETCONF get-config on %s returned an error", _device.name)
+        except (netconf.NetconfError, paramiko.SSHException, socket.error), e:
+            logger.error("NETCONF on %s failed: %s", _device.name, str(e))
+            status = 0
+        except (IOError, OSError), e:
+            logger.error("Could not write the %s of %s: %s", _file, _device.name, str(e))
+            status = 0
+        finally:
+            _device.netconf_client = None
+        if status == 0 and os.path.exists(path + ".part"):
+            os.remove(path + ".part")
+        return status
+
+    @staticmethod
+    def close_session(_device):
+        """Closes the open session and API connection to a device, if any
+
+        :param _device: the device
+        """
+        if _device.session is not None:
+            _device.session.close()
+            _device.session = None
+        if _device.http_client is not None:
+            _device.http_client.close()
+            _device.http_client = None
+
+    def archive_path(self, _device, _file):
+        """Returns the path a device's config is archived to in the repository
+
+        Creates the device's subfolder in the repository if it doesn't exist
+        :param _device: the device who's config is being archived
+        :param _file: the filename the config is archived as
+        :return: the absolute file path
+        """
+        dst_dir = os.path.join(self.repo_path, _device.name)
+        if not os.path.exists(dst_dir):
+            os.mkdir(dst_dir)
+        return os.path.join(dst_dir, _file)
+
+    def load_driver(self, _device):
+        """Creates the manufacturer object for a device
+
+        The manufacturer's class is taken from the driver registry loaded at startup
+        :param _device: the device
+        :return: manufacturer_init: the manufacturer object, or None if it could not be created
+        """
+        try:
+            return self.drivers.create(_device, self)
+        except Exception, e:
+            logger.error("Could not create %s object for %s: %s", _device.manufacturer.title(), _device.name, str(e))
+            return None
+
+    def process_device(self):
+        """Processes actions associated with the next device the concurrency limit and bulkheads allow
+
+        A device with actions to retry is put back on the queue, and the task goes on to take another device,
+        so there is a task for every device on the queue
+        :return: err: error code
+        """
+        retry = 1
+        while retry == 1:
+            self.device_limit.acquire()
+            try:
+                device, groups = self.device_queue.get()
+                try:
+                    err = self.process_actions(device)
+                finally:
+                    self.device_queue.done(groups)
+            finally:
+                self.device_limit.release()
+            retry = self.retry_device(device)
+        return err
+
+    @staticmethod
+    def device_groups(_device):
+        """Returns the bulkhead groups a device is a member of
+
+        :param _device: the device
+        :return: list of groups, ie. "manufacturer:cisco" and "site:london"
+        """
+        groups = ["manufacturer:" + _device.manufacturer.lower()]
+        if _device.site != "NULL":
+            groups.append("site:" + _device.site)
+        return groups
+
     def process_actions(self, _device):
         """Processes actions associated with a device
 
-        Adds the modules in the devices subfolder to the path
-        Dynamically loads the module defined by the device_manufacturer
-        Creates device object for the manufacturer device
-        Calls run_action() method for the device object for each action associated with the device
+        Loads the manufacturer object for the device
+        Calls run_action() method for the device object for each action of the attempt
+        Closes the session shared by the device's actions
         :param _device: the device
         :return: err: error code
         """
         err = 0
-        manufacturer_init = None
 
         if _device.enabled == "0":
             return err
 
-        # include modules from 'devices' subfolder
-        cmd_subfolder = os.path.realpath(os.path.abspath(os.path.join(os.path.split(
-            inspect.getfile(inspect.currentframe()))[0], "devices")))
-        if cmd_subfolder not in sys.path:
-            sys.path.insert(0, cmd_subfolder)
-
-        # load the manufacturer module dynamically
-        device_class = _device.manufacturer.title()
-        try:
-            dynamic_module = __import__(device_class.lower())
-            # create an object of the manufacturer class dynamically
-            manufacturer_init = getattr(dynamic_module, device_class)(_device, self)
-        except:
-            print "Device manufacturer " + device_class + " not implemented."
+        manufacturer_init = self.load_driver(_device)
+        if manufacturer_init is None:
             err = 1
 
         if err == 0:
             # run each action for the device
-            for action in _device.actions:
+            for action in self.start_attempt(_device):
                 logger.info("Running action %s on %s", action, _device.name)
-                run_action = getattr(manufacturer_init, 'run_action')(action)
-                # TODO: check returned run_action value to determine whether action succeeded
+                self.start_action(_device, action)
+                try:
+                    getattr(manufacturer_init, 'run_action')(action)
+                except Exception, e:
+                    logger.error("Action %s on %s failed: %s", action, _device.name, str(e))
+                    self.record_result(_device, action, 0, str(e))
+                # an action which didn't record its result has failed
+                self.record_result(_device, action, 0, "no result")
+            self.close_session(_device)
 
         return err
 
+    def process_actions_async(self, _device):
+        """Processes actions associated with a device as an event loop task
+
+        Connects in the event loop's executor and runs the dialogs of each action on the event loop
+        Devices whose manufacturer object doesn't define its actions as dialogs are handed to
+        process_actions() in the executor instead
+        A device with actions to retry is spawned again once its backoff is over
+        :param _device: the device
+        """
+        if _device.enabled == "0":
+            return
+
+        manufacturer_init = self.load_driver(_device)
+        if manufacturer_init is None:
+            return
+        if _device.access_type not in ("ssh", "telnet") or not hasattr(manufacturer_init, "action_dialog"):
+            yield eventloop.Call(self.process_actions, _device)
+            self.retry_device(_device)
+            return
+
+        for action in self.start_attempt(_device):
+            logger.info("Running action %s on %s", action, _device.name)
+            self.start_action(_device, action)
+            try:
+                status = 0
+                # NETCONF actions run in the executor on the ssh connection of the device's session
+                netconf_action = None
+                dialog = None
+                if hasattr(manufacturer_init, "netconf_action"):
+                    netconf_action = manufacturer_init.netconf_action(action)
+                if netconf_action is None:
+                    dialog = manufacturer_init.action_dialog(action)
+
+                if dialog is not None or netconf_action is not None:
+                    if _device.session is not None and _device.session.active() == 0:
+                        logger.warning("Session to %s was lost - reconnecting", _device.name)
+                        self.close_session(_device)
+                    if _device.session is None:
+                        try:
+                            client, channel = yield eventloop.Call(self.get_client_channel, _device)
+                        except:
+                            logger.error("Error connecting to " + _device.name)
+                        else:
+                            # the session is the device's from the start, so it is closed if the login fails
+                            _device.session = self.create_session(_device, client, channel)
+                            for login_dialog in manufacturer_init.login_dialogs():
+                                logged_in = yield eventloop.Exchange(_device.session, login_dialog)
+                                if logged_in == 0:
+                                    logger.error("Login to %s failed", _device.name)
+                                    self.close_session(_device)
+                                    break
+                    if _device.session is not None and netconf_action is not None:
+                        status = yield eventloop.Call(self.netconf_get_config, _device, *netconf_action)
+                    elif _device.session is not None:
+                        _device.session.deadline = self.action_deadline(_device)
+                        probe = self.probe_dialog(_device, manufacturer_init, action)
+                        if probe is not None:
+                            if probe.command not in _device.probes:
+                                self.set_probe(_device, probe, (yield eventloop.Exchange(_device.session, probe)))
+                            if self.skip_unchanged(_device, action, probe) == 1:
+                                continue
+                        status = yield eventloop.Exchange(_device.session, dialog)
+
+                self.record_result(_device, action, status)
+            except Exception, e:
+                # a session left in an unknown state isn't used for the device's next action
+                logger.error("Action %s on %s failed: %s", action, _device.name, str(e))
+                self.record_result(_device, action, 0, str(e))
+                self.close_session(_device)
+
+        self.close_session(_device)
+        self.retry_device(_device)
+
+    def start_attempt(self, _device):
+        """Starts an attempt at a device's actions
+
+        The first attempt runs all of the device's actions, retries run those which failed on the previous attempt
+        :param _device: the device
+        :return: list of the actions to run
+        """
+        with self.results_lock:
+            if _device.attempts == 0:
+                actions = _device.actions
+            else:
+                actions = _device.failed_actions
+            _device.failed_actions = []
+            _device.attempts += 1
+        # the device is probed afresh on each attempt
+        _device.probes = {}
+        _device.probe_values = {}
+        return actions
+
+    def retry_device(self, _device):
+        """Puts a device with failed actions back on the queue, or the event loop, to be retried after a backoff
+
+        Retries are queued behind all first attempts. The backoff doubles with each attempt.
+        :param _device: the device
+        :return: boolean, 1 if the device will be retried
+        """
+        with self.results_lock:
+            actions = list(_device.failed_actions)
+        if len(actions) == 0:
+            return 0
+        backoff = self.retry_backoff * 2 ** (_device.attempts - 1)
+        logger.warning("Retrying %s on %s in %s seconds (attempt %s of %s)", ", ".join(actions), _device.name,
+                       backoff, _device.attempts + 1, self.retries + 1)
+        if self.engine == "async":
+            self.event_loop.spawn(self.process_actions_async(_device), self.device_groups(_device), backoff,
+                                  RETRY_PRIORITY)
+        else:
+            self.device_queue.put(_device, self.device_groups(_device), backoff, RETRY_PRIORITY)
+        return 1
+
+    def start_action(self, _device, action):
+        """Marks an action as in progress on a device, to be completed within the action timeout
+
+        :param _device: the device
+        :param action: the action
+        """
+        with self.results_lock:
+            self.actions_running[_device.name] = (_device, action, time.time() + self.action_timeout)
+
+    def action_deadline(self, _device):
+        """Returns the time by which the action in progress on a device must be complete
+
+        :param _device: the device
+        :return: the deadline, or None if no action is in progress
+        """
+        with self.results_lock:
+            running = self.actions_running.get(_device.name)
+        if running is None:
+            return None
+        return running[2]
+
+    def record_result(self, _device, action, status, reason=None):
+        """Records the result of the action in progress on a device
+
+        Only the first result of an action is recorded, so an action the watchdog has already
+        recorded as failed stays failed. Failures after the action's deadline are recorded as timed out.
+        Failures of a device with retries left are kept for the device's next attempt instead.
+        :param _device: the device
+        :param action: the action
+        :param status: 0 means the action failed, 1 means it succeeded
+        :param reason: optional reason the action failed
+        """
+        with self.results_lock:
+            running = self.actions_running.pop(_device.name, None)
+            if running is None:
+                return
+            if reason is None and time.time() >= running[2]:
+                reason = "timed out after " + str(self.action_timeout) + " seconds"
+            if status == 1:
+                self.success_list.append({_device.name: action})
+                self.action_attempts[(_device.name, action)] = _device.attempts
+                if _device.probe_values.get(action, "") != "":
+                    self.new_probes[(_device.name, action)] = _device.probe_values[action]
+            elif _device.attempts <= self.retries:
+                if reason is not None:
+                    logger.warning("Action %s on %s failed: %s", action, _device.name, reason)
+                _device.failed_actions.append(action)
+            else:
+                self.failure_list.append({_device.name: action})
+                self.action_attempts[(_device.name, action)] = _device.attempts
+                if reason is not None:
+                    self.failure_reasons[(_device.name, action)] = reason
+
+    def load_probes(self):
+        """Loads the change probe results of the configs already archived in the repository
+
+        """
+        path = os.path.join(self.repo_path, PROBES_FILE)
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path) as probes:
+                for device, actions in json.load(probes).items():
+                    for action, value in actions.items():
+                        self.probes[(device, action)] = value
+        except (IOError, ValueError), e:
+            logger.error("Could not load change probe results from %s: %s", path, str(e))
+
+    def save_probes(self):
+        """Saves the change probe results of the archived configs, including those archived in this run
+
+        """
+        self.probes.update(self.new_probes)
+        probes = {}
+        for (device, action), value in self.probes.items():
+            probes.setdefault(device, {})[action] = value
+        path = os.path.join(self.repo_path, PROBES_FILE)
+        try:
+            with open(path, "w") as probes_file:
+                json.dump(probes, probes_file, indent=1, sort_keys=True)
+        except IOError, e:
+            logger.error("Could not save change probe results to %s: %s", path, str(e))
+
+    def probe_dialog(self, _device, manufacturer_init, action):
+        """Returns the dialog which probes for changes to the config archived by an action
+
+        :param _device: the device
+        :param manufacturer_init: the manufacturer object
+        :param action: the action
+        :return: the dialog, or None if change probes are off or the action has no probe
+        """
+        if self.change_probe != 1 or not hasattr(manufacturer_init, "change_probe"):
+            return None
+        return manufacturer_init.change_probe(action)
+
+    @staticmethod
+    def set_probe(_device, dialog, status):
+        """Keeps the result of a change probe run on a device
+
+        The probe's output, less blank lines and surrounding whitespace, is its result.
+        A probe which didn't see its success pattern has no result.
+        :param _device: the device
+        :param dialog: the probe expect.OutputDialog
+        :param status: 0 means the probe failed, 1 means it succeeded
+        """
+        value = ""
+        if status == 1:
+            value = "\n".join(line.strip() for line in dialog.output().splitlines() if line.strip() != "")
+        _device.probes[dialog.command] = value
+
+    def skip_unchanged(self, _device, action, dialog):
+        """Records an action as unchanged if its probe result is the same as when its config was last archived
+
+        :param _device: the device
+        :param action: the action
+        :param dialog: the action's probe dialog, which has been run on the device
+        :return: boolean, 1 if the action is skipped
+        """
+        value = _device.probes[dialog.command]
+        _device.probe_values[action] = value
+        if value == "" or self.probes.get((_device.name, action)) != value:
+            return 0
+        logger.info("Config of %s on %s is unchanged", action, _device.name)
+        with self.results_lock:
+            if self.actions_running.pop(_device.name, None) is not None:
+                self.unchanged_list.append({_device.name: action})
+        return 1
+
+    def check_unchanged(self, _device, action, manufacturer_init):
+        """Probes a device over its session for changes to the config archived by an action
+
+        Each probe is run once per attempt, however many of the device's actions share it
+        :param _device: the device
+        :param action: the action
+        :param manufacturer_init: the manufacturer object
+        :return: boolean, 1 if the action is skipped
+        """
+        dialog = self.probe_dialog(_device, manufacturer_init, action)
+        if dialog is None:
+            return 0
+        if dialog.command not in _device.probes:
+            self.set_probe(_device, dialog, _device.session.run(dialog))
+        return self.skip_unchanged(_device, action, dialog)
+
+    def watchdog(self):
+        """Cancels actions which overrun the action timeout
+
+        Runs until the end of the run. Overdue actions are recorded as failed and their sessions are ended,
+        which frees the thread or event loop task waiting on the device.
+        """
+        while not self.watchdog_stopped.wait(WATCHDOG_INTERVAL):
+            now = time.time()
+            with self.results_lock:
+                overdue = [(device, action) for device, action, deadline in self.actions_running.values()
+                           if deadline <= now]
+            for device, action in overdue:
+                logger.error("Action %s on %s timed out after %s seconds", action, device.name, self.action_timeout)
+                self.record_result(device, action, 0)
+                self.cancel_session(device)
+
+    def stop_watchdog(self):
+        """Stops the watchdog and waits for its thread to exit
+
+        """
+        self.watchdog_stopped.set()
+        if self.watchdog_thread is not None:
+            self.watchdog_thread.join()
+
+    def cancel_session(self, _device):
+        """Ends whatever a device's session is waiting on
+
+        The event loop ends the session's exchange itself, other sessions are closed from this thread,
+        as are the device's API connection and NETCONF session, which run outside the event loop.
+        :param _device: the device
+        """
+        http_client = _device.http_client
+        if http_client is not None:
+            http_client.close()
+        netconf_client = _device.netconf_client
+        if netconf_client is not None:
+            netconf_client.cancel()
+        session = _device.session
+        if session is None:
+            return
+        if self.engine == "async":
+            self.event_loop.cancel(session)
+        else:
+            session.close()
+
 
 class NetworkDevice(threading.Thread):
     """Defines remote access to a network device
@@ -533,5 +1671,19 @@ class NetworkDevice(threading.Thread):
         self.login_user = ""            # device login username
         self.login_pass = ""            # device login password
         self.enable_password = ""       # device enable password
+        self.capture = "transfer"       # how configs are retrieved - transferred by the device or captured in-band
+        self.site = "NULL"              # optional site or group the device belongs to - used by bulkheads
+        self.ssh_profile = None         # ssh transport profile used when connecting, None for paramiko's defaults
+        self.jump = None                # jump host the device is reached through, None to connect directly
+        self.aaa_group = "NULL"         # AAA group whose login rate limit the device's sessions wait for
+        self.session = None             # open session shared by all of the device's actions
+        self.scheme = "https"           # scheme of the device's HTTP management API, https or http
+        self.verify = 1                 # boolean, 0 accepts any certificate from the device's management API
+        self.http_client = None         # open connection to the management API shared by all of the device's actions
+        self.netconf_client = None      # NETCONF session in progress on the device's ssh connection, if any
         self.succeeded = 0              # set if device actions succeed after run
         self.actions = []               # list of actions defined in the config associated with the device
+        self.attempts = 0               # number of attempts made at the device's actions
+        self.failed_actions = []        # actions which failed on the latest attempt and are to be retried
+        self.probes = {}                # change probe results of the latest attempt, by probe command
+        self.probe_values = {}          # change probe results of the latest attempt, by action
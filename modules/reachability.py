@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+ReachabilitySweep class
+
+Checks that many hosts accept tcp connections, with the connections made concurrently from a single thread
+"""
+
+import time
+import errno
+import select
+import socket
+import logging
+import threading
+from Queue import Queue, Empty
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+SWEEP_TIMEOUT = 5           # seconds allowed for each connection
+MAX_SOCKETS = 256           # connections in progress at once
+MAX_RESOLVERS = 16          # host names resolved at once
+
+
+class ReachabilitySweep(object):
+    """Connects to a list of addresses with non-blocking sockets and reports which of them answered
+
+    Connections are closed as soon as they are established, nothing is sent.
+    Host names are resolved concurrently before any connection is made.
+    :param timeout: seconds allowed for each connection, and for resolving all host names
+    :param max_sockets: the most connections in progress at once
+    :param max_resolvers: the most host names resolved at once
+    """
+
+    def __init__(self, timeout=SWEEP_TIMEOUT, max_sockets=MAX_SOCKETS, max_resolvers=MAX_RESOLVERS):
+        """Class constructor
+
+        :param timeout: seconds allowed for each connection, and for resolving all host names
+        :param max_sockets: the most connections in progress at once
+        :param max_resolvers: the most host names resolved at once
+        """
+        self.timeout = timeout
+        self.max_sockets = max_sockets
+        self.max_resolvers = max_resolvers
+        self.results = {}                   # address to the seconds taken to connect, or None if unreachable
+        self.pending = {}                   # file descriptor to (socket, address, time started) of connections
+        self.poller = None
+
+    def run(self, addresses):
+        """Connects to each address
+
+        :param addresses: list of (host, port) tuples
+        :return: dictionary of address to the seconds taken to connect, or None if the address is unreachable
+        """
+        self.results = {}
+        self.pending = {}
+        self.poller = select.poll()
+        waiting = list(set(addresses))
+        resolved = self.resolve(waiting)
+        while waiting or self.pending:
+            while waiting and len(self.pending) < self.max_sockets:
+                address = waiting.pop()
+                self.start(address, resolved[address])
+            if not self.pending:
+                continue
+            first = min(started for sock, address, started in self.pending.values())
+            timeout = max(0, int((first + self.timeout - time.time()) * 1000) + 1)
+            for fd, event in self.poller.poll(timeout):
+                sock, address, started = self.pending[fd]
+                error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if error == 0:
+                    self.finish(fd, time.time() - started)
+                else:
+                    logger.debug("%s:%s is unreachable: %s", address[0], address[1], errno.errorcode.get(error, error))
+                    self.finish(fd, None)
+            now = time.time()
+            for fd, (sock, address, started) in self.pending.items():
+                if now - started >= self.timeout:
+                    logger.debug("%s:%s is unreachable: timed out", address[0], address[1])
+                    self.finish(fd, None)
+        return self.results
+
+    def resolve(self, addresses):
+        """Resolves the hosts of addresses
+
+        Numeric addresses are converted at once. Host names are resolved by a few threads at a time, and
+        those not resolved within the sweep's timeout are given up on, as a resolver can't be interrupted.
+        :param addresses: list of (host, port) tuples
+        :return: dictionary of address to its getaddrinfo() entry, or None if it couldn't be resolved
+        """
+        resolved = {}
+        names = Queue()
+        for address in addresses:
+            try:
+                resolved[address] = socket.getaddrinfo(address[0], address[1], 0, socket.SOCK_STREAM, 0,
+                                                       socket.AI_NUMERICHOST)[0]
+            except socket.error:
+                names.put(address)
+        if names.empty():
+            return resolved
+
+        def resolver():
+            while True:
+                try:
+                    address = names.get_nowait()
+                except Empty:
+                    return
+                try:
+                    resolved[address] = socket.getaddrinfo(address[0], address[1], 0, socket.SOCK_STREAM)[0]
+                except socket.error, e:
+                    logger.debug("%s:%s is unreachable: %s", address[0], address[1], str(e))
+                    resolved[address] = None
+
+        threads = [threading.Thread(target=resolver) for i in range(min(self.max_resolvers, names.qsize()))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        deadline = time.time() + self.timeout
+        for thread in threads:
+            thread.join(max(0, deadline - time.time()))
+        results = {}
+        for address in addresses:
+            results[address] = resolved.get(address)
+            if address not in resolved:
+                logger.debug("%s:%s is unreachable: name not resolved in time", address[0], address[1])
+        return results
+
+    def start(self, address, info):
+        """Starts connecting to an address
+
+        Addresses which couldn't be resolved, or which refuse the connection at once, are recorded as unreachable
+        :param address: (host, port) tuple
+        :param info: the address' getaddrinfo() entry, or None if it couldn't be resolved
+        """
+        if info is None:
+            self.results[address] = None
+            return
+        family, socktype, proto, canonname, sockaddr = info
+        try:
+            sock = socket.socket(family, socktype, proto)
+        except socket.error, e:
+            logger.debug("%s:%s is unreachable: %s", address[0], address[1], str(e))
+            self.results[address] = None
+            return
+        sock.setblocking(0)
+        started = time.time()
+        error = sock.connect_ex(sockaddr)
+        if error not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            logger.debug("%s:%s is unreachable: %s", address[0], address[1], errno.errorcode.get(error, error))
+            sock.close()
+            self.results[address] = None
+            return
+        self.pending[sock.fileno()] = (sock, address, started)
+        self.poller.register(sock.fileno(), select.POLLOUT)
+
+    def finish(self, fd, latency):
+        """Records the result of a connection and closes it
+
+        :param fd: the connection's file descriptor
+        :param latency: the seconds taken to connect, or None if the connection failed
+        """
+        sock, address, started = self.pending.pop(fd)
+        self.poller.unregister(fd)
+        sock.close()
+        self.results[address] = latency
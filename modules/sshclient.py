@@ -0,0 +1,450 @@
+# -*- coding: utf-8 -*-
+"""
+KnownHosts, SSHProfile, SSHClient, JumpConnection and JumpHost classes
+
+Opens SSH connections, checking host keys against a known_hosts store which is loaded once per run
+and negotiating with the algorithms and sizes of a transport profile, either directly or through a jump host
+"""
+
+import os
+import sys
+import socket
+import logging
+import threading
+
+import paramiko
+from paramiko.hostkeys import HostKeys, HostKeyEntry
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+KNOWN_HOSTS_FILE = "~/.ssh/known_hosts"     # the system known_hosts file, as read by ssh and paramiko
+MAX_JUMP_CHANNELS = 10      # channels carried at once by each connection to a jump host
+KEEPALIVE_INTERVAL = 30     # seconds between keepalives on the long-lived connections to jump hosts
+
+
+class KnownHosts(object):
+    """Host keys shared by all connections made during a run
+
+    The known_hosts file is parsed once into a dictionary keyed by host name.
+    Keys of hosts which aren't in the file are accepted and remembered, and are appended to the file by save().
+    :param filename: the known_hosts file
+    """
+
+    def __init__(self, filename=KNOWN_HOSTS_FILE):
+        """Class constructor
+
+        Loads the known_hosts file
+        :param filename: the known_hosts file
+        """
+        self.filename = os.path.expanduser(filename)
+        self.keys = {}                      # host name to a dictionary of key type to base64 encoded key
+        self.hashed = []                    # (hashed host name, keys) pairs which can only be found by hashing
+        self.learned = []                   # known_hosts lines of the keys learned during the run
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """Parses the known_hosts file
+
+        Keys are kept base64 encoded rather than decoded, since most of them are never used in a run.
+        Lines with markers (ie. @cert-authority) aren't used.
+        """
+        if not os.path.exists(self.filename):
+            return
+        count = 0
+        with open(self.filename) as known_hosts:
+            for line in known_hosts:
+                fields = line.split()
+                if len(fields) < 3 or fields[0].startswith("#") or fields[0].startswith("@"):
+                    continue
+                for hostname in fields[0].split(","):
+                    if hostname.startswith("|1|"):
+                        self.hashed.append((hostname, {fields[1]: fields[2]}))
+                    else:
+                        self.keys.setdefault(hostname, {})[fields[1]] = fields[2]
+                count += 1
+        logger.info("Loaded %s host keys from %s", count, self.filename)
+
+    def lookup(self, hostname):
+        """Returns the keys known for a host
+
+        Hashed host names are only searched when the host isn't found by name, and the result is remembered.
+        :param hostname: the host name, ie. "10.0.0.1" or "[10.0.0.1]:2222"
+        :return: dictionary of key type to base64 encoded key, or None if the host isn't known
+        """
+        keys = self.keys.get(hostname)
+        if keys is not None:
+            return keys
+        for hashed_name, hashed_keys in self.hashed:
+            if HostKeys.hash_host(hostname, hashed_name) == hashed_name:
+                keys = self.keys.setdefault(hostname, {})
+                keys.update(hashed_keys)
+        return keys
+
+    def check(self, hostname, key):
+        """Checks the key presented by a host
+
+        A host which has no key of the presented type is added to the store
+        :param hostname: the host name, ie. "10.0.0.1" or "[10.0.0.1]:2222"
+        :param key: the paramiko key presented by the host
+        :raises paramiko.BadHostKeyException: if the key doesn't match the one known for the host
+        """
+        key_type = key.get_name()
+        with self.lock:
+            keys = self.lookup(hostname)
+            if keys is None or key_type not in keys:
+                logger.info("Adding %s host key for %s", key_type, hostname)
+                self.keys.setdefault(hostname, {})[key_type] = key.get_base64()
+                self.learned.append(hostname + " " + key_type + " " + key.get_base64() + "\n")
+                return
+            known_key = keys[key_type]
+        if known_key != key.get_base64():
+            expected = HostKeyEntry.from_line(hostname + " " + key_type + " " + known_key).key
+            raise paramiko.BadHostKeyException(hostname, key, expected)
+
+    def merge(self, lines):
+        """Adds keys learned elsewhere, ie. by a worker process, to the keys learned during the run
+
+        :param lines: known_hosts lines
+        """
+        with self.lock:
+            for line in lines:
+                if line not in self.learned:
+                    self.learned.append(line)
+
+    def save(self):
+        """Appends the keys learned during the run to the known_hosts file
+
+        """
+        if len(self.learned) == 0:
+            return
+        try:
+            separator = ""
+            if os.path.exists(self.filename) and os.path.getsize(self.filename) > 0:
+                with open(self.filename) as known_hosts:
+                    known_hosts.seek(-1, os.SEEK_END)
+                    if known_hosts.read(1) != "\n":
+                        separator = "\n"
+            with open(self.filename, "a") as known_hosts:
+                known_hosts.write(separator + "".join(self.learned))
+            logger.info("Saved %s new host keys to %s", len(self.learned), self.filename)
+            self.learned = []
+        except (IOError, OSError), e:
+            logger.error("Could not save new host keys to %s: %s", self.filename, str(e))
+
+
+class SSHProfile(object):
+    """Transport settings used when connecting to a group of devices
+
+    Algorithm lists replace paramiko's preferences, in order, so slow algorithms can be left out
+    for devices known to support faster ones. Settings which are None keep paramiko's defaults.
+    :param name: the profile name
+    :param kex: list of key exchange algorithms
+    :param ciphers: list of ciphers
+    :param macs: list of MAC algorithms
+    :param compression: boolean, 1 asks for zlib compression
+    :param window_size: the channel window size in bytes
+    :param packet_size: the maximum packet size in bytes
+    """
+
+    def __init__(self, name, kex=None, ciphers=None, macs=None, compression=0, window_size=None,
+                 packet_size=None):
+        """Class constructor
+
+        :param name: the profile name
+        :param kex: list of key exchange algorithms
+        :param ciphers: list of ciphers
+        :param macs: list of MAC algorithms
+        :param compression: boolean, 1 asks for zlib compression
+        :param window_size: the channel window size in bytes
+        :param packet_size: the maximum packet size in bytes
+        """
+        self.name = name
+        self.kex = kex
+        self.ciphers = ciphers
+        self.macs = macs
+        self.compression = compression
+        self.window_size = window_size
+        self.packet_size = packet_size
+
+    def unsupported(self):
+        """Returns the algorithms of the profile which paramiko doesn't implement
+
+        :return: list of algorithm names
+        """
+        unsupported = []
+        for algorithms, implemented in ((self.kex, paramiko.Transport._kex_info),
+                                        (self.ciphers, paramiko.Transport._cipher_info),
+                                        (self.macs, paramiko.Transport._mac_info)):
+            for algorithm in algorithms or []:
+                if algorithm not in implemented:
+                    unsupported.append(algorithm)
+        return unsupported
+
+    def transport(self, sock):
+        """Creates a transport using the profile
+
+        :param sock: the socket connected to the host
+        :return: the paramiko transport, not yet started
+        """
+        sizes = {}
+        if self.window_size is not None:
+            sizes["default_window_size"] = self.window_size
+        if self.packet_size is not None:
+            sizes["default_max_packet_size"] = self.packet_size
+        transport = paramiko.Transport(sock, **sizes)
+        options = transport.get_security_options()
+        if self.kex is not None:
+            options.kex = self.kex
+        if self.ciphers is not None:
+            options.ciphers = self.ciphers
+        if self.macs is not None:
+            options.digests = self.macs
+        transport.use_compression(self.compression == 1)
+        return transport
+
+
+class SSHClient(object):
+    """An SSH connection to a host
+
+    Stands in for paramiko.SSHClient, checking the host's key against a shared KnownHosts store
+    instead of loading the known_hosts file for every connection.
+    :param known_hosts: the KnownHosts store
+    """
+
+    def __init__(self, known_hosts):
+        """Class constructor
+
+        :param known_hosts: the KnownHosts store
+        """
+        self.known_hosts = known_hosts
+        self.transport = None
+
+    def connect(self, hostname, port=22, username=None, password=None, profile=None, timeout=None,
+                auth_timeout=None, jump=None):
+        """Connects to a host, checks its key and authenticates with a password
+
+        Keyboard-interactive authentication is tried if the host doesn't allow password authentication.
+        :param hostname: the host's address
+        :param port: the host's ssh port
+        :param username: the login username
+        :param password: the login password
+        :param profile: optional SSHProfile used to negotiate with the host
+        :param timeout: optional seconds allowed for each of the tcp connection and the ssh handshake
+        :param auth_timeout: optional seconds allowed for authentication
+        :param jump: optional JumpHost the host is reached through
+        """
+        if jump is not None:
+            sock = jump.open_channel(hostname, port, timeout, auth_timeout)
+        else:
+            sock = socket.create_connection((hostname, port), timeout)
+        if profile is not None:
+            self.transport = profile.transport(sock)
+        else:
+            self.transport = paramiko.Transport(sock)
+        if timeout is not None:
+            self.transport.banner_timeout = timeout
+        if auth_timeout is not None:
+            self.transport.auth_timeout = auth_timeout
+        try:
+            self.transport.start_client(timeout=timeout)
+            if port == 22:
+                self.known_hosts.check(hostname, self.transport.get_remote_server_key())
+            else:
+                self.known_hosts.check("[" + hostname + "]:" + str(port), self.transport.get_remote_server_key())
+            self.transport.auth_password(username, password)
+        except:
+            self.close()
+            raise
+
+    def invoke_shell(self):
+        """Opens an interactive shell on the host
+
+        :return: the paramiko channel
+        """
+        channel = self.transport.open_session()
+        channel.get_pty()
+        channel.invoke_shell()
+        return channel
+
+    def invoke_subsystem(self, name):
+        """Opens a subsystem on the host, ie. netconf
+
+        :param name: the subsystem's name
+        :return: the paramiko channel the subsystem runs on
+        """
+        channel = self.transport.open_session()
+        channel.invoke_subsystem(name)
+        return channel
+
+    def exec_command(self, command):
+        """Runs a command on the host
+
+        :param command: the command
+        :return: the paramiko channel the command runs on
+        """
+        channel = self.transport.open_session()
+        channel.exec_command(command)
+        return channel
+
+    def get_transport(self):
+        """Returns the connection's transport
+
+        :return: the paramiko transport, or None if not connected
+        """
+        return self.transport
+
+    def close(self):
+        """Closes the connection
+
+        """
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+
+
+class JumpConnection(object):
+    """A connection to a bastion and the channels it carries
+
+    :param client: the SSHClient, which may not be connected yet
+    """
+
+    def __init__(self, client):
+        """Class constructor
+
+        :param client: the SSHClient, which may not be connected yet
+        """
+        self.client = client
+        self.channels = []                  # channels open on the connection
+        self.reserved = 0                   # channels being opened on the connection
+        self.ready = threading.Event()      # set once the connection is logged in, or has failed to
+        self.error = None                   # exc_info of the failed login, if any
+
+
+class JumpHost(object):
+    """A bastion host through which devices are reached
+
+    Devices are connected to over direct-tcpip channels of long-lived ssh connections to the bastion,
+    so the bastion is logged in to once rather than once per device. Each connection carries up to
+    max_channels channels at once and further connections are opened as they are needed.
+    :param name: the jump host name
+    :param known_hosts: the KnownHosts store the bastion's key is checked against
+    :param hostname: the bastion's address
+    :param port: the bastion's ssh port
+    :param username: the login username
+    :param password: the login password
+    :param profile: optional SSHProfile used to negotiate with the bastion
+    :param max_channels: the most channels carried at once by each connection
+    """
+
+    def __init__(self, name, known_hosts, hostname, port=22, username=None, password=None, profile=None,
+                 max_channels=MAX_JUMP_CHANNELS):
+        """Class constructor
+
+        :param name: the jump host name
+        :param known_hosts: the KnownHosts store the bastion's key is checked against
+        :param hostname: the bastion's address
+        :param port: the bastion's ssh port
+        :param username: the login username
+        :param password: the login password
+        :param profile: optional SSHProfile used to negotiate with the bastion
+        :param max_channels: the most channels carried at once by each connection
+        """
+        self.name = name
+        self.known_hosts = known_hosts
+        self.hostname = hostname
+        self.port = port
+        self.username = username
+        self.password = password
+        self.profile = profile
+        self.max_channels = max_channels
+        self.connections = []               # JumpConnection for each connection, including those logging in
+        self.lock = threading.Lock()
+
+    def open_channel(self, hostname, port, timeout=None, auth_timeout=None):
+        """Opens a channel through the bastion to a host
+
+        Only reserving the channel's place on a connection is done under the lock, so a slow login to the
+        bastion or a host which is slow to answer doesn't hold up the channels to other hosts.
+        :param hostname: the host's address
+        :param port: the host's port
+        :param timeout: optional seconds allowed for each of connecting to the bastion and opening the channel
+        :param auth_timeout: optional seconds allowed for authenticating to the bastion
+        :return: the paramiko channel, which is used as the socket to the host
+        """
+        with self.lock:
+            connection, new = self.reserve()
+        try:
+            if new:
+                self.login(connection, timeout, auth_timeout)
+            else:
+                connection.ready.wait()
+                if connection.error is not None:
+                    raise connection.error[0], connection.error[1], connection.error[2]
+            channel = connection.client.get_transport().open_channel("direct-tcpip", (hostname, port),
+                                                                     ("127.0.0.1", 0), timeout=timeout)
+        except:
+            with self.lock:
+                connection.reserved -= 1
+            raise
+        with self.lock:
+            connection.reserved -= 1
+            connection.channels.append(channel)
+        return channel
+
+    def reserve(self):
+        """Reserves a place for a channel on a connection to the bastion with room for it
+
+        Connections the bastion has dropped are discarded. A new connection is added if none has room,
+        which the caller must log in. Must be called with the lock held.
+        :return: connection, new: the JumpConnection, and 1 if it is new or 0 if not
+        """
+        for connection in self.connections[:]:
+            if connection.ready.is_set():
+                transport = connection.client.get_transport()
+                if transport is None or not transport.is_active():
+                    logger.warning("Connection to jump host %s was lost", self.name)
+                    self.connections.remove(connection)
+                    connection.client.close()
+                    continue
+                connection.channels[:] = [channel for channel in connection.channels if not channel.closed]
+            if len(connection.channels) + connection.reserved < self.max_channels:
+                connection.reserved += 1
+                return connection, 0
+
+        connection = JumpConnection(SSHClient(self.known_hosts))
+        connection.reserved = 1
+        self.connections.append(connection)
+        return connection, 1
+
+    def login(self, connection, timeout, auth_timeout):
+        """Connects and logs in a new connection to the bastion
+
+        Channels reserved on the connection meanwhile wait until it is ready. A connection which fails
+        is discarded and its error is raised for each of them.
+        :param connection: the JumpConnection
+        :param timeout: optional seconds allowed for connecting
+        :param auth_timeout: optional seconds allowed for authenticating
+        """
+        try:
+            connection.client.connect(self.hostname, self.port, self.username, self.password,
+                                      profile=self.profile, timeout=timeout, auth_timeout=auth_timeout)
+            connection.client.get_transport().set_keepalive(KEEPALIVE_INTERVAL)
+        except:
+            connection.error = sys.exc_info()
+            with self.lock:
+                if connection in self.connections:
+                    self.connections.remove(connection)
+            raise
+        finally:
+            connection.ready.set()
+        logger.info("Opened a connection to jump host %s", self.name)
+
+    def close(self):
+        """Closes the connections to the bastion
+
+        """
+        with self.lock:
+            for connection in self.connections:
+                connection.client.close()
+            self.connections = []
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+TelnetClient and TelnetChannel classes
+
+Telnet sessions which are read the same way as ssh channels, so the same dialogs run over either
+"""
+
+import select
+import socket
+import logging
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+CONNECT_TIMEOUT = 30        # seconds allowed for the tcp connection to be established
+
+# telnet commands
+IAC = chr(255)
+DONT = chr(254)
+DO = chr(253)
+WONT = chr(252)
+WILL = chr(251)
+SB = chr(250)
+SE = chr(240)
+
+
+class TelnetChannel(object):
+    """A telnet connection with the interface of a paramiko channel
+
+    Reads are bounded in size and wait no longer than the channel's timeout. Telnet option negotiation
+    is stripped from the received data and every option is refused, as telnetlib does by default.
+    :param sock: the socket connected to the device, or a channel through a jump host
+    """
+
+    def __init__(self, sock):
+        """Class constructor
+
+        :param sock: the socket connected to the device
+        """
+        self.sock = sock
+        self.poller = select.poll()
+        self.poller.register(sock.fileno(), select.POLLIN)
+        self.timeout = None             # seconds recv() waits for data, None waits indefinitely
+        self.pending = ""               # received bytes of a telnet command which isn't complete yet
+        self.buffer = ""                # received data not yet returned by recv()
+        self.closed = False
+        self.eof_received = False
+
+    def fileno(self):
+        """Returns the socket's file descriptor, so the channel can be polled
+
+        :return: the file descriptor
+        """
+        return self.sock.fileno()
+
+    def settimeout(self, timeout):
+        """Sets the time recv() waits for data
+
+        :param timeout: seconds, or None to wait indefinitely
+        """
+        self.timeout = timeout
+
+    def send(self, data):
+        """Sends data to the device
+
+        :param data: the text to send, unicode text is sent utf-8 encoded as paramiko does
+        :return: the number of bytes sent
+        """
+        if isinstance(data, unicode):
+            data = data.encode("utf-8")
+        self.sock.sendall(data.replace(IAC, IAC + IAC))
+        return len(data)
+
+    def recv_ready(self):
+        """Checks whether data can be read without waiting
+
+        Reads what is available on the socket, since it may only hold telnet commands.
+        :return: boolean, True if recv() will return data at once
+        """
+        if len(self.buffer) == 0 and not self.eof_received and not self.closed and len(self.poller.poll(0)) > 0:
+            self.fill(4096)
+        return len(self.buffer) > 0
+
+    def recv(self, nbytes):
+        """Receives data from the device
+
+        :param nbytes: the most bytes returned
+        :return: the data, or an empty string once either end has closed the connection
+        :raises socket.timeout: if no data arrives within the channel's timeout
+        """
+        if self.timeout is not None:
+            timeout = int(self.timeout * 1000)
+        else:
+            timeout = None
+        while len(self.buffer) == 0 and not self.eof_received:
+            if len(self.poller.poll(timeout)) == 0:
+                raise socket.timeout("timed out")
+            # the connection may have been closed by another thread, ie. the watchdog
+            if self.closed:
+                break
+            self.fill(nbytes)
+        data = self.buffer[:nbytes]
+        self.buffer = self.buffer[nbytes:]
+        return data
+
+    def fill(self, nbytes):
+        """Reads once from the socket and adds the data, less any telnet commands, to the buffer
+
+        :param nbytes: the most bytes read
+        """
+        try:
+            raw = self.sock.recv(nbytes)
+        except socket.error, e:
+            # a connection reset by the device ends the session like a close does
+            logger.warning("Connection error: %s", str(e))
+            raw = ""
+        if not raw:
+            self.eof_received = True
+            return
+        raw = self.pending + raw
+        self.pending = ""
+        data = []
+        i = 0
+        while i < len(raw):
+            char = raw[i]
+            if char != IAC:
+                if char != "\0":
+                    data.append(char)
+                i += 1
+                continue
+            if i + 1 >= len(raw):
+                self.pending = raw[i:]
+                break
+            command = raw[i + 1]
+            if command == IAC:
+                data.append(IAC)
+                i += 2
+            elif command in (DO, DONT, WILL, WONT):
+                if i + 2 >= len(raw):
+                    self.pending = raw[i:]
+                    break
+                if command in (DO, DONT):
+                    self.sock.sendall(IAC + WONT + raw[i + 2])
+                else:
+                    self.sock.sendall(IAC + DONT + raw[i + 2])
+                i += 3
+            elif command == SB:
+                end = raw.find(IAC + SE, i)
+                if end < 0:
+                    self.pending = raw[i:]
+                    break
+                i = end + 2
+            else:
+                i += 2
+        self.buffer += "".join(data)
+
+    def close(self):
+        """Closes the connection
+
+        May be called from another thread to end a recv() waiting on the connection.
+        """
+        if not self.closed:
+            self.closed = True
+            # shutting the socket down wakes a poll waiting on it, closing it alone doesn't
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            self.sock.close()
+
+
+class TelnetClient(object):
+    """A telnet connection to a device
+
+    Has the interface of sshclient.SSHClient so sessions can be run over either. Logging in is left to
+    the session's first dialog, since telnet has no authentication of its own.
+    """
+
+    def __init__(self):
+        """Class constructor
+
+        """
+        self.channel = None
+
+    def connect(self, hostname, port=23, timeout=CONNECT_TIMEOUT, jump=None, auth_timeout=None):
+        """Connects to a device
+
+        :param hostname: the device's address
+        :param port: the device's telnet port
+        :param timeout: seconds allowed for the connection to be established
+        :param jump: optional sshclient.JumpHost the device is reached through
+        :param auth_timeout: optional seconds allowed for authenticating to the jump host
+        """
+        if jump is not None:
+            sock = jump.open_channel(hostname, port, timeout, auth_timeout)
+        else:
+            sock = socket.create_connection((hostname, port), timeout)
+        sock.settimeout(None)
+        self.channel = TelnetChannel(sock)
+
+    def invoke_shell(self):
+        """Returns the channel to the device's command line
+
+        :return: the TelnetChannel
+        """
+        return self.channel
+
+    def get_transport(self):
+        """Returns the connection itself, which stands in for the transport of an ssh client
+
+        :return: the TelnetClient, or None if not connected
+        """
+        if self.channel is None:
+            return None
+        return self
+
+    def is_active(self):
+        """Checks whether the connection is open
+
+        :return: boolean, False once either end has closed the connection
+        """
+        return self.channel is not None and not self.channel.closed and not self.channel.eof_received
+
+    def close(self):
+        """Closes the connection
+
+        """
+        if self.channel is not None:
+            self.channel.close()
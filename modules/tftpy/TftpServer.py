@@ -4,12 +4,64 @@ requests. Logging is performed via a standard logging object set in
 TftpShared."""
 
 import socket, os, time
-import select
+import select, heapq
 from TftpShared import *
 from TftpPacketTypes import *
 from TftpPacketFactory import TftpPacketFactory
 from TftpContexts import TftpContextServer
 
+class TftpPoller(object):
+    """This class waits for input on the server's sockets. Each socket is
+    registered once, along with the data returned when it has input, so the
+    owner of a ready socket is found without searching the sessions. It uses
+    epoll where available and poll otherwise, neither of which is limited to
+    FD_SETSIZE sockets like select is."""
+
+    def __init__(self):
+        if hasattr(select, 'epoll'):
+            self.poller = select.epoll()
+            self.mask = select.EPOLLIN | select.EPOLLERR | select.EPOLLHUP
+            # epoll takes its timeout in seconds
+            self.scale = 1
+        else:
+            self.poller = select.poll()
+            self.mask = select.POLLIN | select.POLLERR | select.POLLHUP
+            # poll takes its timeout in milliseconds
+            self.scale = 1000
+        # A dict of the data of each registered socket, keyed by its file
+        # descriptor.
+        self.registered = {}
+
+    def register(self, sock, data):
+        """Start waiting for input on a socket. The data is returned by
+        poll() when the socket has input."""
+        fd = sock.fileno()
+        self.poller.register(fd, self.mask)
+        self.registered[fd] = data
+        return fd
+
+    def unregister(self, fd):
+        """Stop waiting for input on the socket with the given file
+        descriptor. This must be done before the socket is closed."""
+        if fd in self.registered:
+            self.poller.unregister(fd)
+            del self.registered[fd]
+
+    def poll(self, timeout):
+        """Wait up to timeout seconds for input, and return the data of each
+        socket that has some."""
+        ready = []
+        for fd, event in self.poller.poll(timeout * self.scale):
+            if fd in self.registered:
+                ready.append(self.registered[fd])
+        return ready
+
+    def close(self):
+        """Stop waiting on all sockets."""
+        if hasattr(self.poller, 'close'):
+            self.poller.close()
+        self.registered = {}
+
 class TftpServer(TftpSession):
     """This class implements a tftp server object. Run the listen() method to
     listen for client requests.  It takes two optional arguments. tftproot is
@@ -28,6 +80,12 @@ class TftpServer(TftpSession):
         # A dict of sessions, where each session is keyed by a string like
         # ip:tid for the remote end.
         self.sessions = {}
+        # The file descriptors of the sessions' sockets, keyed like sessions.
+        self.fds = {}
+        # A heap of the times at which sessions may time out, as tuples of
+        # (time, session key, session). Each session has one entry.
+        self.timers = []
+        self.poller = None
 
         self.shutdown_gracefully = False
         self.shutdown_immediately = False
@@ -74,41 +132,44 @@ class TftpServer(TftpSession):
             # Reraise it for now.
             raise
 
+        # The main socket is registered with no session key, and each
+        # session's socket with its key as it is created.
+        self.poller = TftpPoller()
+        self.poller.register(self.sock, None)
+
         log.info("Starting receive loop...")
         while True:
             if self.shutdown_immediately:
                 log.warn("Shutting down now. Session count: %d" % len(self.sessions))
+                self.poller.close()
                 self.sock.close()
                 for key in self.sessions:
                     self.sessions[key].end()
-                self.sessions = []
+                self.sessions = {}
+                self.fds = {}
+                self.timers = []
                 break
 
             elif self.shutdown_gracefully:
                 if not self.sessions:
                     log.warn("In graceful shutdown mode and all sessions complete.")
+                    self.poller.close()
                     self.sock.close()
                     break
 
-            # Build the inputlist array of sockets to select() on.
-            inputlist = []
-            inputlist.append(self.sock)
-            for key in self.sessions:
-                inputlist.append(self.sessions[key].sock)
-
-            # Block until some socket has input on it.
-            log.debug("Performing select on this inputlist: %s", inputlist)
-            readyinput, readyoutput, readyspecial = select.select(inputlist,
-                                                                  [],
-                                                                  [],
-                                                                  SOCK_TIMEOUT)
+            # Block until some socket has input on it, or the first session
+            # may time out.
+            wait = SOCK_TIMEOUT
+            if self.timers:
+                wait = max(0, min(wait, self.timers[0][0] - time.time()))
+            readykeys = self.poller.poll(wait)
 
             deletion_list = []
 
             # Handle the available data, if any. Maybe we timed-out.
-            for readysock in readyinput:
+            for readykey in readykeys:
                 # Is the traffic on the main server socket? ie. new session?
-                if readysock == self.sock:
+                if readykey is None:
                     log.debug("Data ready on our main socket")
                     buffer, (raddress, rport) = self.sock.recvfrom(MAX_BLKSIZE)
 
@@ -130,8 +191,13 @@ class TftpServer(TftpSession):
                                                                timeout,
                                                                self.root,
                                                                self.dyn_file_func)
+                        self.fds[key] = self.poller.register(self.sessions[key].sock, key)
                         try:
                             self.sessions[key].start(buffer)
+                            heapq.heappush(self.timers,
+                                           (self.sessions[key].last_update + timeout,
+                                            key,
+                                            self.sessions[key]))
                         except TftpException, err:
                             deletion_list.append(key)
                             log.error("Fatal exception thrown from "
@@ -139,49 +205,50 @@ class TftpServer(TftpSession):
                     else:
                         log.warn("received traffic on main socket for "
                                  "existing session??")
-                    log.info("Currently handling these sessions:")
-                    for session_key, session in self.sessions.items():
-                        log.info("    %s" % session)
+                    log.info("Currently handling %d sessions", len(self.sessions))
 
-                else:
-                    # Must find the owner of this traffic.
-                    for key in self.sessions:
-                        if readysock == self.sessions[key].sock:
-                            log.info("Matched input to session key %s"
-                                % key)
-                            try:
-                                self.sessions[key].cycle()
-                                if self.sessions[key].state == None:
-                                    log.info("Successful transfer.")
-                                    deletion_list.append(key)
-                            except TftpException, err:
-                                deletion_list.append(key)
-                                log.error("Fatal exception thrown from "
-                                          "session %s: %s"
-                                          % (key, str(err)))
-                            # Break out of for loop since we found the correct
-                            # session.
-                            break
+                elif self.sessions.has_key(readykey):
+                    # The socket was registered with its session's key.
+                    key = readykey
+                    log.debug("Matched input to session key %s", key)
+                    try:
+                        self.sessions[key].cycle()
+                        if self.sessions[key].state == None:
+                            log.info("Successful transfer.")
+                            deletion_list.append(key)
+                    except TftpException, err:
+                        deletion_list.append(key)
+                        log.error("Fatal exception thrown from "
+                                  "session %s: %s"
+                                  % (key, str(err)))
 
-                    else:
-                        log.error("Can't find the owner for this packet. "
-                                  "Discarding.")
+                else:
+                    log.error("Can't find the owner for this packet. "
+                              "Discarding.")
 
-            log.debug("Looping on all sessions to check for timeouts")
+            # Only the sessions whose timers are due are checked. A session
+            # which has had traffic since its timer was set is given a new
+            # timer, and one which hasn't has its last packet resent and is
+            # checked again after another timeout.
             now = time.time()
-            for key in self.sessions:
-                try:
-                    self.sessions[key].checkTimeout(now)
-                except TftpTimeout, err:
-                    log.error(str(err))
-                    self.sessions[key].retry_count += 1
-                    if self.sessions[key].retry_count >= TIMEOUT_RETRIES:
-                        log.debug("hit max retries on %s, giving up",
-                            self.sessions[key])
-                        deletion_list.append(key)
-                    else:
-                        log.debug("resending on session %s", self.sessions[key])
-                        self.sessions[key].state.resendLast()
+            while self.timers and self.timers[0][0] <= now:
+                when, key, session = heapq.heappop(self.timers)
+                if self.sessions.get(key) is not session or key in deletion_list:
+                    # The session has already ended.
+                    continue
+                expires = session.last_update + session.timeout
+                if expires > now:
+                    heapq.heappush(self.timers, (expires, key, session))
+                    continue
+                log.error("Timeout waiting for traffic on session %s", key)
+                session.retry_count += 1
+                if session.retry_count >= TIMEOUT_RETRIES:
+                    log.debug("hit max retries on %s, giving up", session)
+                    deletion_list.append(key)
+                else:
+                    log.debug("resending on session %s", session)
+                    session.state.resendLast()
+                    heapq.heappush(self.timers, (now + session.timeout, key, session))
 
             log.debug("Iterating deletion list.")
             for key in deletion_list:
@@ -189,6 +256,8 @@ class TftpServer(TftpSession):
                 log.info("Session %s complete" % key)
                 if self.sessions.has_key(key):
                     log.debug("Gathering up metrics from session before deleting")
+                    # The socket is closed by end(), so stop polling it first.
+                    self.poller.unregister(self.fds.pop(key))
                     self.sessions[key].end()
                     metrics = self.sessions[key].metrics
                     if metrics.duration == 0:
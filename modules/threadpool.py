@@ -1,10 +1,14 @@
 # -*- coding: utf-8 -*-
 """
-ThreadPool and Worker classes
+ThreadPool, Worker, AdaptiveLimit, BulkheadQueue and TokenBucket classes
 """
 
+import time
 from Queue import Queue
-from threading import Thread
+from threading import Thread, Condition, Lock
+
+ERROR_RATE = 0.2            # share of failed samples in a window which is treated as overload
+LATENCY_FACTOR = 3          # window latency, as a multiple of the best seen, which is treated as overload
 
 
 class Worker(Thread):
@@ -66,4 +70,333 @@ class ThreadPool(object):
         """Wait for completion of all of the tasks in the queue
 
         """
-        self.tasks.join()
\ No newline at end of file
+        self.tasks.join()
+
+
+class AdaptiveLimit(object):
+    """Limits the number of tasks in progress and adapts the limit to how the tasks are faring
+
+    Starts at the floor and doubles the limit after each healthy window of samples until the first sign of
+    overload, after which it grows by one per healthy window. A window with too many errors, latency well above
+    the best seen so far, or a backlog over its maximum halves the limit. The limit stays between floor and ceiling.
+    :param floor: the lowest limit
+    :param ceiling: the highest limit
+    :param window: the number of samples the limit is adjusted after
+    :param backlog: optional callable returning the current backlog of work downstream of the tasks
+    :param max_backlog: the backlog above which the tasks are considered to be overloading downstream
+    """
+
+    def __init__(self, floor, ceiling, window=10, backlog=None, max_backlog=0):
+        """Class constructor
+
+        :param floor: the lowest limit
+        :param ceiling: the highest limit
+        :param window: the number of samples the limit is adjusted after
+        :param backlog: optional callable returning the current backlog of work downstream of the tasks
+        :param max_backlog: the backlog above which the tasks are considered to be overloading downstream
+        """
+        self.floor = floor
+        self.ceiling = ceiling
+        self.window = window
+        self.backlog = backlog
+        self.max_backlog = max_backlog
+        self.limit = floor
+        self.in_progress = 0
+        self.slow_start = 1
+        self.best_latency = None
+        self.latencies = []
+        self.errors = 0
+        self.condition = Condition()
+
+    def acquire(self):
+        """Waits until a task can be started and counts it as in progress
+
+        """
+        self.condition.acquire()
+        try:
+            while self.in_progress >= self.limit:
+                self.condition.wait()
+            self.in_progress += 1
+        finally:
+            self.condition.release()
+
+    def try_acquire(self):
+        """Counts a task as in progress if the limit allows it
+
+        :return: boolean, 1 means the task can be started, 0 means the limit has been reached
+        """
+        self.condition.acquire()
+        try:
+            if self.in_progress >= self.limit:
+                return 0
+            self.in_progress += 1
+            return 1
+        finally:
+            self.condition.release()
+
+    def release(self):
+        """Counts a task as finished
+
+        """
+        self.condition.acquire()
+        try:
+            self.in_progress -= 1
+            self.condition.notify()
+        finally:
+            self.condition.release()
+
+    def record(self, latency, error):
+        """Records a sample and adjusts the limit when a window of samples is complete
+
+        :param latency: seconds taken by the sampled operation
+        :param error: boolean, 1 means the sampled operation failed
+        """
+        self.condition.acquire()
+        try:
+            self.latencies.append(latency)
+            self.errors += error
+            if len(self.latencies) >= self.window:
+                self.adjust()
+        finally:
+            self.condition.release()
+
+    def adjust(self):
+        """Adjusts the limit from the current window of samples and starts a new window
+
+        Must be called with the condition held.
+        """
+        latency = sum(self.latencies) / len(self.latencies)
+        overloaded = self.errors > ERROR_RATE * len(self.latencies)
+        if self.best_latency is not None and latency > self.best_latency * LATENCY_FACTOR:
+            overloaded = True
+        if self.backlog is not None and self.backlog() > self.max_backlog:
+            overloaded = True
+        if self.best_latency is None or latency < self.best_latency:
+            self.best_latency = latency
+
+        if overloaded:
+            self.slow_start = 0
+            self.limit = max(self.floor, self.limit / 2)
+        elif self.slow_start == 1:
+            self.limit = min(self.ceiling, self.limit * 2)
+        else:
+            self.limit = min(self.ceiling, self.limit + 1)
+        self.condition.notify_all()
+
+        self.latencies = []
+        self.errors = 0
+
+
+
+class BulkheadQueue(object):
+    """Queue of items which are each a member of groups with their own limit on items in progress
+
+    Items are taken in order of priority and then in the order they were added, skipping those with a group
+    at its limit, so items of a slow group can't hold up the others. Items may be deferred, ie. retries
+    which wait out a backoff, and are skipped over until they are ready.
+    :param limits: dictionary of group to the maximum number of its items in progress
+    """
+
+    def __init__(self, limits):
+        """Class constructor
+
+        :param limits: dictionary of group to the maximum number of its items in progress
+        """
+        self.limits = limits
+        self.in_progress = {}
+        self.items = []                     # (priority, ready time, item, groups) in the order items are taken
+        self.condition = Condition()
+
+    def put(self, item, groups, delay=0, priority=0):
+        """Adds an item to the queue
+
+        :param item: the item
+        :param groups: list of the groups the item is a member of
+        :param delay: seconds before the item can be taken
+        :param priority: items with a higher number are only taken once no lower numbered item can be
+        """
+        self.condition.acquire()
+        try:
+            index = len(self.items)
+            while index > 0 and self.items[index - 1][0] > priority:
+                index -= 1
+            self.items.insert(index, (priority, time.time() + delay, item, groups))
+            self.condition.notify()
+        finally:
+            self.condition.release()
+
+    def get(self):
+        """Waits for the first ready item whose groups are all below their limits and counts it as in progress
+
+        :return: item, groups: the item and the groups it is a member of
+        """
+        self.condition.acquire()
+        try:
+            while True:
+                index = self.available()
+                if index is not None:
+                    return self.start(index)
+                ready = self.next_ready()
+                if ready is None:
+                    self.condition.wait()
+                else:
+                    self.condition.wait(max(0, ready - time.time()))
+        finally:
+            self.condition.release()
+
+    def get_nowait(self):
+        """Takes the first ready item whose groups are all below their limits and counts it as in progress
+
+        :return: item, groups: the item and the groups it is a member of, or None if no item can be started
+        """
+        self.condition.acquire()
+        try:
+            index = self.available()
+            if index is None:
+                return None
+            return self.start(index)
+        finally:
+            self.condition.release()
+
+    def next_ready(self):
+        """Returns when the first deferred item becomes ready
+
+        :return: the time, or None if no item is deferred
+        """
+        self.condition.acquire()
+        try:
+            now = time.time()
+            deferred = [ready for priority, ready, item, groups in self.items if ready > now]
+            if len(deferred) == 0:
+                return None
+            return min(deferred)
+        finally:
+            self.condition.release()
+
+    def done(self, groups):
+        """Counts an item as finished
+
+        :param groups: the groups the item is a member of
+        """
+        self.condition.acquire()
+        try:
+            for group in groups:
+                if group in self.limits:
+                    self.in_progress[group] -= 1
+            self.condition.notify_all()
+        finally:
+            self.condition.release()
+
+    def available(self):
+        """Finds the first ready item whose groups are all below their limits
+
+        Must be called with the condition held.
+        :return: the index of the item, or None
+        """
+        now = time.time()
+        for index in range(len(self.items)):
+            priority, ready, item, groups = self.items[index]
+            if ready > now:
+                continue
+            for group in groups:
+                if group in self.limits and self.in_progress.get(group, 0) >= self.limits[group]:
+                    break
+            else:
+                return index
+        return None
+
+    def start(self, index):
+        """Removes an item from the queue and counts it as in progress in its groups
+
+        Must be called with the condition held.
+        :param index: the index of the item
+        :return: item, groups: the item and the groups it is a member of
+        """
+        priority, ready, item, groups = self.items.pop(index)
+        for group in groups:
+            if group in self.limits:
+                self.in_progress[group] = self.in_progress.get(group, 0) + 1
+        return item, groups
+
+    def __len__(self):
+        """Returns the number of items waiting in the queue, including deferred items
+
+        """
+        return len(self.items)
+
+
+class TokenBucket(object):
+    """Limits the rate at which operations are started, allowing short bursts
+
+    Tokens are added at the given rate up to the burst size and each operation takes one. An operation which
+    finds the bucket empty reserves the next token and waits for it, so waiting operations go in turn.
+    Keeps totals of the time operations waited.
+    :param name: the name the limit is reported as
+    :param rate: tokens added per second
+    :param burst: the most tokens the bucket holds
+    """
+
+    def __init__(self, name, rate, burst=1):
+        """Class constructor
+
+        :param name: the name the limit is reported as
+        :param rate: tokens added per second
+        :param burst: the most tokens the bucket holds
+        """
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.time()
+        self.count = 0                      # operations started
+        self.waited = 0                     # operations which had to wait
+        self.total_wait = 0.0               # seconds waited by all operations
+        self.max_wait = 0.0                 # the longest wait
+        self.lock = Lock()
+
+    def reserve(self):
+        """Takes a token, or reserves the next one if the bucket is empty
+
+        :return: the seconds until the token is available, 0 if it is available now
+        """
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = max(0.0, -self.tokens / self.rate)
+            self.count += 1
+            if wait > 0:
+                self.waited += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+        return wait
+
+    def acquire(self):
+        """Waits until a token is available and takes it
+
+        :return: the seconds waited
+        """
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def merge(self, stats):
+        """Adds the totals of another bucket, ie. one used by a worker process
+
+        :param stats: the other bucket's stats()
+        """
+        with self.lock:
+            self.count += stats[0]
+            self.waited += stats[1]
+            self.total_wait += stats[2]
+            self.max_wait = max(self.max_wait, stats[3])
+
+    def stats(self):
+        """Returns the totals of the time operations waited
+
+        :return: (operations started, operations which waited, total seconds waited, longest wait in seconds)
+        """
+        with self.lock:
+            return self.count, self.waited, self.total_wait, self.max_wait
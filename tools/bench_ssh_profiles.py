@@ -0,0 +1,179 @@
+#!/usr/bin/python
+"""
+SSH profile benchmark
+
+Measures the handshake time and throughput of ssh transport profiles against a local paramiko test server
+"""
+
+import os
+import sys
+import time
+import socket
+import getopt
+import logging
+import threading
+from xml.dom import minidom
+
+import paramiko
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from modules import netconfigit
+from modules import sshclient
+
+USERNAME = "bench"
+PASSWORD = "bench"
+CHUNK = "x" * 32768         # block of data sent by the test server when measuring throughput
+
+
+class BenchServer(paramiko.ServerInterface):
+    """Test server which accepts the benchmark's password and runs any command as a data stream
+
+    """
+
+    def __init__(self):
+        """Class constructor
+
+        """
+        self.command = threading.Event()
+
+    def check_auth_password(self, username, password):
+        if username == USERNAME and password == PASSWORD:
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        self.command.set()
+        return True
+
+
+def serve(listener, host_key, profile, megabytes):
+    """Accepts benchmark connections until the listener is closed
+
+    Each connection that runs a command is sent the given number of megabytes and closed.
+    :param listener: the listening socket
+    :param host_key: the server's host key
+    :param profile: the profile under test, so the server offers the same algorithms
+    :param megabytes: the amount of data sent per command
+    """
+    while True:
+        try:
+            conn, address = listener.accept()
+        except socket.error:
+            return
+        transport = profile.transport(conn)
+        transport.add_server_key(host_key)
+        server = BenchServer()
+        try:
+            transport.start_server(server=server)
+            channel = transport.accept(10)
+            if channel is not None and server.command.wait(10) is not False:
+                for i in range(megabytes * 1048576 / len(CHUNK)):
+                    channel.sendall(CHUNK)
+                channel.send_exit_status(0)
+                channel.close()
+        except (paramiko.SSHException, EOFError, socket.error):
+            pass
+
+
+def bench(profile, host_key, connections, megabytes):
+    """Benchmarks a profile
+
+    :param profile: the SSHProfile
+    :param host_key: the test server's host key
+    :param connections: the number of handshakes timed
+    :param megabytes: the amount of data transferred when measuring throughput
+    :return: (average handshake seconds, fastest handshake seconds, megabytes per second)
+    """
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(5)
+    port = listener.getsockname()[1]
+    server_thread = threading.Thread(target=serve, args=(listener, host_key, profile, megabytes))
+    server_thread.daemon = True
+    server_thread.start()
+    known_hosts = sshclient.KnownHosts(os.devnull)
+
+    handshakes = []
+    for i in range(connections):
+        client = sshclient.SSHClient(known_hosts)
+        started = time.time()
+        client.connect("127.0.0.1", port, USERNAME, PASSWORD, profile=profile)
+        handshakes.append(time.time() - started)
+        client.close()
+
+    client = sshclient.SSHClient(known_hosts)
+    client.connect("127.0.0.1", port, USERNAME, PASSWORD, profile=profile)
+    channel = client.exec_command("stream")
+    received = 0
+    started = time.time()
+    while True:
+        data = channel.recv(65536)
+        if not data:
+            break
+        received += len(data)
+    elapsed = time.time() - started
+    client.close()
+    listener.close()
+
+    return sum(handshakes) / len(handshakes), min(handshakes), received / 1048576.0 / elapsed
+
+
+def usage(error):
+    """Displays command-line argument usage and a specified error message
+
+    :param error: the error message stating what went wrong
+    """
+    print(error)
+    print("\nUsage: %s (-c [configuration file]) (-n [connections]) (-m [megabytes])\n" % sys.argv[0])
+    exit(0)
+
+
+def main():
+    """Benchmarks paramiko's defaults and each profile of the configuration file
+
+    """
+    configuration = ""
+    connections = 20
+    megabytes = 16
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "c:n:m:")
+    except getopt.GetoptError:
+        usage("")
+    for o, a in opts:
+        if o == '-c':       # configuration file whose ssh profiles are benchmarked
+            configuration = a
+        elif o == '-n':     # number of handshakes timed per profile
+            connections = int(a)
+        elif o == '-m':     # megabytes transferred per profile
+            megabytes = int(a)
+
+    profiles = [sshclient.SSHProfile("default")]
+    if configuration != "":
+        if not os.path.isfile(configuration):
+            usage("\nConfiguration file %s does not exist - quitting.\n" % configuration)
+        for config_profile in minidom.parse(configuration).getElementsByTagName('ssh_profile'):
+            profiles.append(netconfigit.Netconfigit.load_ssh_profile(config_profile))
+
+    # connections closed by the benchmark are reported as errors by paramiko
+    logging.getLogger("paramiko").setLevel(logging.CRITICAL)
+    logging.getLogger(sshclient.__name__).setLevel(logging.WARNING)
+
+    host_key = paramiko.RSAKey.generate(2048)
+    print "%-20s %16s %16s %12s" % ("profile", "handshake avg ms", "handshake min ms", "MB/s")
+    for profile in profiles:
+        average, fastest, throughput = bench(profile, host_key, connections, megabytes)
+        print "%-20s %16.1f %16.1f %12.1f" % (profile.name, average * 1000, fastest * 1000, throughput)
+
+
+# application entry point
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/python
+"""
+eAPI stand-in
+
+Runs the running-config and startup-config actions of Arista devices accessed by eAPI against a local HTTP server
+mimicking the runCmds method, and checks the archived configs and the reuse of each device's connection
+"""
+
+import sys
+import json
+import getopt
+import threading
+import SocketServer
+import BaseHTTPServer
+
+import standin
+
+ENABLE_PASSWORD = "standin"
+# the stand-in picks its behaviour by the username a device logs in with
+DEVICES = (("plain", "", "enable without a password"),
+           ("enable", ENABLE_PASSWORD, "enable with a password"),
+           ("error", "", "JSON-RPC error reply"))
+ACTIONS = ("running-config", "startup-config")
+CONFIG = "! Command: show %s\nhostname %s\n" + "".join("interface Ethernet%d\n   description port %d\n" % (i, i)
+                                                      for i in range(20000))
+
+
+class EapiHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Answers runCmds requests with the output of the last command, over keep-alive connections
+
+    """
+    protocol_version = "HTTP/1.1"
+    connections = {}            # username to the client addresses of its connections
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        username = self.headers.get("Authorization", "").split()[-1].decode("base64").split(":")[0]
+        with self.lock:
+            self.connections.setdefault(username, set()).add(self.client_address)
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        commands = request["params"]["cmds"]
+        if username == "error":
+            reply = {"jsonrpc": "2.0", "id": request["id"],
+                     "error": {"code": 1002,
+                               "message": "CLI command 2 of 2 '%s' failed: invalid command" % commands[-1]}}
+        elif (username == "enable") != (commands[0] == {"cmd": "enable", "input": ENABLE_PASSWORD}):
+            reply = {"jsonrpc": "2.0", "id": request["id"],
+                     "error": {"code": 1002, "message": "CLI command 1 of 2 'enable' failed: bad password"}}
+        else:
+            reply = {"jsonrpc": "2.0", "id": request["id"],
+                     "result": [{}, {"output": CONFIG % (commands[-1].split()[-1], username)}]}
+        data = json.dumps(reply)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class EapiServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Stand-in eAPI server, serving each connection on its own thread
+
+    """
+    daemon_threads = True
+
+
+def usage(error):
+    """Displays command-line argument usage and a specified error message
+
+    :param error: the error message stating what went wrong
+    """
+    print(error)
+    print("\nUsage: %s (-e [threads|async])\n" % sys.argv[0])
+    exit(0)
+
+
+def main():
+    """Runs netconfigit against the stand-in and checks what each device archived
+
+    """
+    engine = "threads"
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "e:")
+    except getopt.GetoptError:
+        usage("")
+    for o, a in opts:
+        if o == '-e':       # engine device actions are run on
+            engine = a
+
+    server = EapiServer(("127.0.0.1", 0), EapiHandler)
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+
+    devices = []
+    for name, enable, description in DEVICES:
+        if enable != "":
+            enable = ' enable="%s"' % enable
+        devices.append('<device name="%s" type="switch" manufacturer="arista" enabled="1"><access ip="127.0.0.1" '
+                       'type="eapi" scheme="http" port="%d" username="%s" password="standin"%s/>%s</device>'
+                       % (name, server.server_address[1], name, enable,
+                          "".join('<action type="%s"/>' % action for action in ACTIONS)))
+    archived, failures = standin.run(devices, engine)
+    server.shutdown()
+
+    passed = 1
+    print "\n%-10s %-30s %-12s %s" % ("device", "stand-in", "connections", "result")
+    for name, enable, description in DEVICES:
+        if name == "error":
+            result = all((name, action) in failures for action in ACTIONS)
+        else:
+            result = all(archived.get(name, {}).get(action) == CONFIG % (action, name) for action in ACTIONS)
+        # both actions of a device share its keep-alive connection
+        connections = len(EapiHandler.connections.get(name, ()))
+        result = result and connections == 1
+        if not result:
+            passed = 0
+        print "%-10s %-30s %-12s %s" % (name, description, connections, "ok" if result else "FAILED")
+    if passed == 0:
+        exit(1)
+
+
+# application entry point
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+#!/usr/bin/python
+"""
+Jump host stand-in
+
+Runs the running-config action of Cisco devices reached through a local paramiko jump host, which forwards
+direct-tcpip channels to a local stand-in device, and checks the archived configs and the channels each
+connection to the jump host carried
+"""
+
+import sys
+import time
+import select
+import socket
+import getopt
+import logging
+import threading
+
+import paramiko
+
+import standin
+
+USERNAME = "standin"
+PASSWORD = "standin"
+PROMPT = "standin#"
+UNREACHABLE = "unreachable"     # device whose forwarded connection the jump host refuses
+CONFIG = "hostname %s\n" + "".join("interface GigabitEthernet0/%d\n description port %d\n" % (i, i)
+                                   for i in range(2000))
+
+
+class JumpServer(paramiko.ServerInterface):
+    """Stand-in jump host which accepts its own password and forwards direct-tcpip channels to local ports
+
+    """
+
+    def __init__(self, jump_host):
+        """Class constructor
+
+        :param jump_host: the JumpHost counting logins
+        """
+        self.jump_host = jump_host
+        self.destinations = {}          # channel id to the address the channel is forwarded to
+
+    def check_auth_password(self, username, password):
+        if username == USERNAME and password == PASSWORD:
+            with self.jump_host.lock:
+                self.jump_host.logins += 1
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_direct_tcpip_request(self, chanid, origin, destination):
+        if destination[1] != self.jump_host.device_port:
+            return paramiko.OPEN_FAILED_CONNECT_FAILED
+        self.destinations[chanid] = destination
+        return paramiko.OPEN_SUCCEEDED
+
+
+class JumpHost(object):
+    """Accepts connections to the stand-in jump host and counts the channels each of them carries
+
+    :param device_port: the port of the stand-in device
+    :param host_key: the jump host's host key
+    """
+
+    def __init__(self, device_port, host_key):
+        """Class constructor
+
+        :param device_port: the port of the stand-in device
+        :param host_key: the jump host's host key
+        """
+        self.device_port = device_port
+        self.host_key = host_key
+        self.lock = threading.Lock()
+        self.logins = 0                 # connections which logged in to the jump host
+        self.channels = {}              # connection to [channels open, most channels open at once]
+
+    def serve(self, listener):
+        """Accepts connections until the listener is closed
+
+        :param listener: the listening socket
+        """
+        while True:
+            try:
+                conn, address = listener.accept()
+            except socket.error:
+                return
+            connection_thread = threading.Thread(target=self.connection, args=(conn,))
+            connection_thread.daemon = True
+            connection_thread.start()
+
+    def connection(self, conn):
+        """Serves a connection to the jump host, forwarding each of its channels on a thread of its own
+
+        :param conn: the connected socket
+        """
+        transport = paramiko.Transport(conn)
+        transport.add_server_key(self.host_key)
+        server = JumpServer(self)
+        try:
+            transport.start_server(server=server)
+        except (paramiko.SSHException, EOFError, socket.error):
+            return
+        with self.lock:
+            self.channels[transport] = [0, 0]
+        while transport.is_active():
+            channel = transport.accept(1)
+            if channel is None:
+                continue
+            destination = server.destinations.pop(channel.get_id())
+            forward_thread = threading.Thread(target=self.forward, args=(transport, channel, destination))
+            forward_thread.daemon = True
+            forward_thread.start()
+
+    def forward(self, transport, channel, destination):
+        """Copies data between a forwarded channel and its destination until either end closes
+
+        :param transport: the connection carrying the channel
+        :param channel: the forwarded channel
+        :param destination: the (host, port) the channel is forwarded to
+        """
+        with self.lock:
+            count = self.channels[transport]
+            count[0] += 1
+            count[1] = max(count[1], count[0])
+        try:
+            sock = socket.create_connection(destination)
+            try:
+                while True:
+                    readable, writable, exceptional = select.select([channel, sock], [], [])
+                    if channel in readable:
+                        data = channel.recv(65536)
+                        if not data:
+                            break
+                        sock.sendall(data)
+                    if sock in readable:
+                        data = sock.recv(65536)
+                        if not data:
+                            break
+                        channel.sendall(data)
+            finally:
+                sock.close()
+        except socket.error:
+            pass
+        channel.close()
+        with self.lock:
+            self.channels[transport][0] -= 1
+
+
+class DeviceServer(paramiko.ServerInterface):
+    """Stand-in device which accepts any password and runs a command line showing its config
+
+    """
+
+    def __init__(self):
+        """Class constructor
+
+        """
+        self.username = None
+
+    def check_auth_password(self, username, password):
+        self.username = username
+        return paramiko.AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_pty_request(self, channel, term, width, height, pixelwidth, pixelheight, modes):
+        return True
+
+    def check_channel_shell_request(self, channel):
+        shell_thread = threading.Thread(target=shell, args=(channel, self.username))
+        shell_thread.daemon = True
+        shell_thread.start()
+        return True
+
+
+def shell(channel, name):
+    """Answers show running-config with the device's config and echoes any other command, followed by the prompt
+
+    A short pause before each answer keeps the device's channel open alongside the others.
+    :param channel: the shell channel
+    :param name: the name of the device, which is the username it logged in with
+    """
+    try:
+        commands = channel.makefile()
+        channel.sendall("\r\n" + PROMPT)
+        for command in commands:
+            time.sleep(0.2)
+            channel.sendall(command.strip() + "\r\n")
+            if command.strip() == "show running-config":
+                channel.sendall((CONFIG % name).replace("\n", "\r\n"))
+            channel.sendall(PROMPT)
+    except socket.error:
+        pass
+
+
+def serve_devices(listener, host_key):
+    """Accepts connections to the stand-in device until the listener is closed
+
+    :param listener: the listening socket
+    :param host_key: the device's host key
+    """
+    while True:
+        try:
+            conn, address = listener.accept()
+        except socket.error:
+            return
+        transport = paramiko.Transport(conn)
+        transport.add_server_key(host_key)
+        try:
+            transport.start_server(server=DeviceServer())
+        except (paramiko.SSHException, EOFError, socket.error):
+            pass
+
+
+def listen():
+    """Opens a listening socket on a free local port
+
+    :return: (the socket, the port)
+    """
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(50)
+    return listener, listener.getsockname()[1]
+
+
+def usage(error):
+    """Displays command-line argument usage and a specified error message
+
+    :param error: the error message stating what went wrong
+    """
+    print(error)
+    print("\nUsage: %s (-e [threads|async]) (-n [devices]) (-m [max_channels])\n" % sys.argv[0])
+    exit(0)
+
+
+def main():
+    """Runs netconfigit against the stand-in and checks what each device archived
+
+    """
+    engine = "threads"
+    count = 12
+    max_channels = 4
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "e:n:m:")
+    except getopt.GetoptError:
+        usage("")
+    for o, a in opts:
+        if o == '-e':       # engine device actions are run on
+            engine = a
+        elif o == '-n':     # number of devices reached through the jump host
+            count = int(a)
+        elif o == '-m':     # most device connections carried by each connection to the jump host
+            max_channels = int(a)
+
+    # connections closed by the stand-ins are reported as errors by paramiko
+    logging.getLogger("paramiko").setLevel(logging.CRITICAL)
+
+    host_key = paramiko.RSAKey.generate(2048)
+    device_listener, device_port = listen()
+    device_thread = threading.Thread(target=serve_devices, args=(device_listener, host_key))
+    device_thread.daemon = True
+    device_thread.start()
+    jump_listener, jump_port = listen()
+    jump_host = JumpHost(device_port, host_key)
+    jump_thread = threading.Thread(target=jump_host.serve, args=(jump_listener,))
+    jump_thread.daemon = True
+    jump_thread.start()
+    # a port nothing listens on, which the jump host refuses to forward to
+    closed_listener, closed_port = listen()
+    closed_listener.close()
+
+    names = ["device%d" % i for i in range(count)]
+    devices = ['<jump name="standin" ip="127.0.0.1" port="%d" username="%s" password="%s" max_channels="%d"/>'
+               % (jump_port, USERNAME, PASSWORD, max_channels)]
+    for name in names + [UNREACHABLE]:
+        devices.append('<device name="%s" type="switch" manufacturer="cisco" enabled="1"><access ip="127.0.0.1" '
+                       'type="ssh" port="%d" username="%s" password="standin" capture="inband" jump="standin"/>'
+                       '<action type="running-config"/></device>'
+                       % (name, closed_port if name == UNREACHABLE else device_port, name))
+    archived, failures = standin.run(devices, engine)
+    jump_listener.close()
+    device_listener.close()
+
+    passed = 1
+    archived_count = len([name for name in names
+                          if (CONFIG % name) in archived.get(name, {}).get("running-config", "").replace("\r", "")])
+    most_channels = max([channels[1] for channels in jump_host.channels.values()] or [0])
+    # no more connections to the jump host are opened than it takes to carry every device at once
+    most_logins = (count + 1 + max_channels - 1) / max_channels
+    checks = (("configs archived", "%d of %d" % (archived_count, count), archived_count == count),
+              ("unreachable device failed", (UNREACHABLE, "running-config") in failures,
+               (UNREACHABLE, "running-config") in failures),
+              ("jump host logins", "%d, at most %d" % (jump_host.logins, most_logins),
+               0 < jump_host.logins <= most_logins),
+              ("most channels per login", "%d, at most %d" % (most_channels, max_channels),
+               0 < most_channels <= max_channels))
+    print "\n%-28s %-20s %s" % ("check", "value", "result")
+    for check, value, result in checks:
+        if not result:
+            passed = 0
+        print "%-28s %-20s %s" % (check, value, "ok" if result else "FAILED")
+    if passed == 0:
+        exit(1)
+
+
+# application entry point
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+#!/usr/bin/python
+"""
+NETCONF stand-in
+
+Runs the netconf-running-config action of Cisco and Dell devices against a local paramiko server
+implementing the netconf subsystem, and checks the archived replies
+"""
+
+import sys
+import socket
+import random
+import getopt
+import logging
+import threading
+
+import paramiko
+
+import standin
+
+# the stand-in picks its behaviour by the username a device logs in with
+DEVICES = (("chunked", "cisco", "NETCONF 1.1, replies in chunks of random sizes"),
+           ("eom", "dell", "NETCONF 1.0, replies ended by ]]>]]>"),
+           ("error", "cisco", "rpc-error reply"))
+PROMPT = "standin#"
+BASE_NS = "urn:ietf:params:xml:ns:netconf:base:1.0"
+EOM = "]]>]]>"
+CHUNK_END = "\n##\n"
+MAX_CHUNK = 5000            # largest chunk of a reply in the chunked framing
+MAX_SEND = 9000             # largest piece of a reply sent at once, so chunk headers are split between reads
+CONFIG = "".join("<interface><name>GigabitEthernet0/%d</name><description>port %d</description></interface>" % (i, i)
+                 for i in range(20000))
+REPLY = '<rpc-reply message-id="%s" xmlns="' + BASE_NS + '"><data>' + CONFIG + '</data></rpc-reply>'
+ERROR_REPLY = '<nc:rpc-reply message-id="%s" xmlns:nc="' + BASE_NS + '"><nc:rpc-error>' \
+              '<nc:error-type>application</nc:error-type><nc:error-tag>operation-failed</nc:error-tag>' \
+              '</nc:rpc-error></nc:rpc-reply>'
+OK_REPLY = '<rpc-reply message-id="%s" xmlns="' + BASE_NS + '"><ok/></rpc-reply>'
+
+
+class NetconfSubsystem(paramiko.SubsystemHandler):
+    """The netconf subsystem of the stand-in, which answers every rpc but <close-session> with the same reply
+
+    """
+
+    def start_subsystem(self, name, transport, channel):
+        """Exchanges hellos and answers rpcs until the session is closed
+
+        :param name: the subsystem name
+        :param transport: the server transport
+        :param channel: the subsystem channel
+        """
+        username = transport.get_username()
+        capabilities = "<capability>urn:ietf:params:netconf:base:1.0</capability>"
+        if username != "eom":
+            capabilities += "<capability>urn:ietf:params:netconf:base:1.1</capability>"
+        channel.sendall('<?xml version="1.0" encoding="UTF-8"?><hello xmlns="' + BASE_NS + '"><capabilities>' +
+                        capabilities + '</capabilities><session-id>1</session-id></hello>' + EOM)
+        self.buffer = ""
+        try:
+            hello = self.read(channel, EOM)
+            chunked = "urn:ietf:params:netconf:base:1.1" in capabilities and \
+                      "urn:ietf:params:netconf:base:1.1" in hello
+            while True:
+                rpc = self.read(channel, CHUNK_END if chunked else EOM)
+                message_id = rpc.split('message-id="')[1].split('"')[0]
+                if "<close-session/>" in rpc:
+                    self.send(channel, OK_REPLY % message_id, chunked)
+                    break
+                elif username == "error":
+                    self.send(channel, ERROR_REPLY % message_id, chunked)
+                else:
+                    self.send(channel, REPLY % message_id, chunked)
+        except (EOFError, IndexError, socket.error):
+            pass
+        channel.close()
+
+    def read(self, channel, end):
+        """Reads a message from the client
+
+        The chunk headers of a chunked message are left in, the stand-in only looks for the rpc in it.
+        :param channel: the subsystem channel
+        :param end: the end of message marker
+        :return: the message
+        :raises EOFError: if the client closes the channel
+        """
+        while end not in self.buffer:
+            data = channel.recv(65536)
+            if not data:
+                raise EOFError
+            self.buffer += data
+        message, self.buffer = self.buffer.split(end, 1)
+        return message
+
+    def send(self, channel, message, chunked):
+        """Sends a message to the client
+
+        :param channel: the subsystem channel
+        :param message: the message
+        :param chunked: boolean, 1 for the chunked framing
+        """
+        if chunked == 0:
+            channel.sendall(message + EOM)
+            return
+        chunks = []
+        while message != "":
+            chunk = message[:random.randint(1, MAX_CHUNK)]
+            message = message[len(chunk):]
+            chunks.append("\n#%d\n%s" % (len(chunk), chunk))
+        data = "".join(chunks) + CHUNK_END
+        while data != "":
+            piece = data[:random.randint(1, MAX_SEND)]
+            data = data[len(piece):]
+            channel.sendall(piece)
+
+
+class StandinServer(paramiko.ServerInterface):
+    """Stand-in device which accepts any password and runs a command line that only echoes commands
+
+    """
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_pty_request(self, channel, term, width, height, pixelwidth, pixelheight, modes):
+        return True
+
+    def check_channel_shell_request(self, channel):
+        shell_thread = threading.Thread(target=shell, args=(channel,))
+        shell_thread.daemon = True
+        shell_thread.start()
+        return True
+
+
+def shell(channel):
+    """Echoes each command the device's session sends, followed by the prompt
+
+    :param channel: the shell channel
+    """
+    try:
+        commands = channel.makefile()
+        channel.sendall("\r\n" + PROMPT)
+        for command in commands:
+            channel.sendall(command.strip() + "\r\n" + PROMPT)
+    except socket.error:
+        pass
+
+
+def serve(listener, host_key):
+    """Accepts connections until the listener is closed
+
+    :param listener: the listening socket
+    :param host_key: the server's host key
+    """
+    while True:
+        try:
+            conn, address = listener.accept()
+        except socket.error:
+            return
+        transport = paramiko.Transport(conn)
+        transport.add_server_key(host_key)
+        transport.set_subsystem_handler("netconf", NetconfSubsystem)
+        try:
+            transport.start_server(server=StandinServer())
+        except (paramiko.SSHException, EOFError, socket.error):
+            pass
+
+
+def usage(error):
+    """Displays command-line argument usage and a specified error message
+
+    :param error: the error message stating what went wrong
+    """
+    print(error)
+    print("\nUsage: %s (-e [threads|async])\n" % sys.argv[0])
+    exit(0)
+
+
+def main():
+    """Runs netconfigit against the stand-in and checks what each device archived
+
+    """
+    engine = "threads"
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "e:")
+    except getopt.GetoptError:
+        usage("")
+    for o, a in opts:
+        if o == '-e':       # engine device actions are run on
+            engine = a
+
+    # connections closed by the stand-in are reported as errors by paramiko
+    logging.getLogger("paramiko").setLevel(logging.CRITICAL)
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(5)
+    port = listener.getsockname()[1]
+    server_thread = threading.Thread(target=serve, args=(listener, paramiko.RSAKey.generate(2048)))
+    server_thread.daemon = True
+    server_thread.start()
+
+    devices = ['<device name="%s" type="switch" manufacturer="%s" enabled="1"><access ip="127.0.0.1" type="ssh" '
+               'port="%d" username="%s" password="standin"/><action type="netconf-running-config"/></device>'
+               % (name, manufacturer, port, name) for name, manufacturer, description in DEVICES]
+    archived, failures = standin.run(devices, engine)
+    listener.close()
+
+    passed = 1
+    print "\n%-10s %-50s %s" % ("device", "stand-in", "result")
+    for name, manufacturer, description in DEVICES:
+        if name == "error":
+            result = (name, "netconf-running-config") in failures
+        else:
+            # the get-config is the first rpc of each session
+            result = archived.get(name, {}).get("running-config.xml") == REPLY % "1"
+        if not result:
+            passed = 0
+        print "%-10s %-50s %s" % (name, description, "ok" if result else "FAILED")
+    if passed == 0:
+        exit(1)
+
+
+# application entry point
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/python
+"""
+SEMP stand-in
+
+Runs the current-config action of Solace devices accessed by SEMP against a local HTTP server
+mimicking the SEMP management API, and checks the archived configs
+"""
+
+import sys
+import getopt
+import socket
+import threading
+import SocketServer
+import BaseHTTPServer
+
+import standin
+
+# the stand-in picks its behaviour by the username a device logs in with
+DEVICES = (("ok", "current-config streamed in the reply"),
+           ("fail", "execute-result fail"),
+           ("truncated", "connection closed during the reply"))
+CONFIG = "".join("  create message-vpn vpn%d\n  exit\n" % i for i in range(200000))
+REPLY = '<rpc-reply semp-version="soltr/9_0"><rpc><show><current-config><![CDATA[' + CONFIG + \
+        ']]></current-config></show></rpc><execute-result code="ok"/></rpc-reply>'
+FAIL_REPLY = '<rpc-reply semp-version="soltr/9_0"><parse-error>unauthorized</parse-error>' \
+             '<execute-result code="fail"/></rpc-reply>'
+
+
+class SempHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Answers SEMP requests with the device's current-config, over keep-alive connections
+
+    """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        username = self.headers.get("Authorization", "").split()[-1].decode("base64").split(":")[0]
+        self.rfile.read(int(self.headers["Content-Length"]))
+        data = REPLY
+        if username == "fail":
+            data = FAIL_REPLY
+        self.send_response(200)
+        self.send_header("Content-Type", "text/xml")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if username == "truncated":
+            self.wfile.write(data[:len(data) / 2])
+            self.wfile.flush()
+            self.connection.shutdown(socket.SHUT_RDWR)
+            self.close_connection = 1
+            return
+        self.wfile.write(data)
+
+
+class SempServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Stand-in SEMP server, serving each connection on its own thread
+
+    """
+    daemon_threads = True
+
+
+def usage(error):
+    """Displays command-line argument usage and a specified error message
+
+    :param error: the error message stating what went wrong
+    """
+    print(error)
+    print("\nUsage: %s (-e [threads|async])\n" % sys.argv[0])
+    exit(0)
+
+
+def main():
+    """Runs netconfigit against the stand-in and checks what each device archived
+
+    """
+    engine = "threads"
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "e:")
+    except getopt.GetoptError:
+        usage("")
+    for o, a in opts:
+        if o == '-e':       # engine device actions are run on
+            engine = a
+
+    server = SempServer(("127.0.0.1", 0), SempHandler)
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+
+    devices = ['<device name="%s" type="router" manufacturer="solace" enabled="1"><access ip="127.0.0.1" type="semp" '
+               'scheme="http" port="%d" username="%s" password="standin"/><action type="current-config"/></device>'
+               % (name, server.server_address[1], name) for name, description in DEVICES]
+    archived, failures = standin.run(devices, engine)
+    server.shutdown()
+
+    passed = 1
+    print "\n%-10s %-40s %s" % ("device", "stand-in", "result")
+    for name, description in DEVICES:
+        if name == "ok":
+            result = archived.get(name, {}).get("current-config") == REPLY
+        else:
+            # a failed reply is never archived, not even in part
+            result = (name, "current-config") in failures and archived.get(name, {}) == {}
+        if not result:
+            passed = 0
+        print "%-10s %-40s %s" % (name, description, "ok" if result else "FAILED")
+    if passed == 0:
+        exit(1)
+
+
+# application entry point
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Stand-in runner
+
+Runs netconfigit against the local stand-in servers of the tools in this directory
+"""
+
+import os
+import sys
+import socket
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from modules import netconfigit
+from modules import sshclient
+
+CONFIG = '<netconfigit><logging path="%s"/><passwords plaintext="true"/><options engine="%s" retries="0"/>' \
+         '<repository path="%s"/><transfer ip="127.0.0.1" username="standin" password="standin" tftp_port="%d"/>' \
+         '%s</netconfigit>'
+
+
+def free_port():
+    """Finds a free local udp port for the tftp server netconfigit starts
+
+    :return: the port
+    """
+    probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    probe.bind(("127.0.0.1", 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    return port
+
+
+def run(devices, engine):
+    """Runs netconfigit on devices in a temporary working directory, which is removed afterwards
+
+    Host keys of the stand-ins are kept in the working directory rather than the user's known_hosts file.
+    :param devices: the <device> elements of the configuration
+    :param engine: the engine device actions are run on, "threads" or "async"
+    :return: (dictionary of device name to a dictionary of archived file name to contents,
+              list of the (device name, action) which failed)
+    """
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="netconfigit-standin-")
+    repository = os.path.join(workdir, "repository")
+    os.mkdir(repository)
+    try:
+        # netconfigit downloads into a temporary folder under the current directory
+        os.chdir(workdir)
+        configuration = os.path.join(workdir, "standin.xml")
+        with open(configuration, "w") as config_file:
+            config_file.write(CONFIG % (os.path.join(workdir, "netconfigit.log"), engine, repository + "/",
+                                        free_port(), "".join(devices)))
+        nc = netconfigit.Netconfigit(configuration, "")
+        nc.known_hosts = sshclient.KnownHosts(os.path.join(workdir, "known_hosts"))
+        nc.run_nc()
+        nc.stop_nc()
+
+        archived = {}
+        for device in os.listdir(repository):
+            if not os.path.isdir(os.path.join(repository, device)):
+                continue
+            archived[device] = {}
+            for file_ in os.listdir(os.path.join(repository, device)):
+                with open(os.path.join(repository, device, file_)) as archived_file:
+                    archived[device][file_] = archived_file.read()
+        failures = [failure.items()[0] for failure in nc.failure_list]
+        return archived, failures
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir)